@@ -0,0 +1,142 @@
+import hashlib
+import json
+import logging
+import os
+import tempfile
+import threading
+from collections import OrderedDict
+from shared_code import get_connection_pool
+
+# Cache of extracted submission data keyed by the SHA-256 of the blob content
+# and the extractor version, so Power Automate retries and broker resends of
+# the same email or PDF skip parsing. A bounded in-memory LRU sits in front of
+# an optional persistent store (a directory of JSON files or a Postgres table).
+
+def content_hash(content):
+    """SHA-256 hex digest of blob bytes or of a binary file object (read from the start)"""
+    if isinstance(content, (bytes, bytearray)):
+        return hashlib.sha256(content).hexdigest()
+    content.seek(0)
+    digest = hashlib.file_digest(content, "sha256").hexdigest()
+    content.seek(0)
+    return digest
+
+def cache_key(digest, extractor_version):
+    """Cache key for a content digest, scoped to the extractor version that produced the data"""
+    return f"{extractor_version}:{digest}"
+
+class DiskExtractionStore:
+    """Persistent tier storing each cached extraction as a JSON file in a directory"""
+
+    def __init__(self, directory):
+        self.directory = directory
+        os.makedirs(directory, exist_ok=True)
+
+    def _path(self, key):
+        return os.path.join(self.directory, key.replace(":", "_") + ".json")
+
+    def get(self, key):
+        try:
+            with open(self._path(key), "r") as file:
+                return json.load(file)
+        except FileNotFoundError:
+            return None
+
+    def put(self, key, data):
+        # Write to a temporary file first so readers never see a partial entry
+        fd, tmp_path = tempfile.mkstemp(dir=self.directory, suffix=".tmp")
+        try:
+            with os.fdopen(fd, "w") as file:
+                json.dump(data, file)
+            os.replace(tmp_path, self._path(key))
+        except Exception:
+            os.remove(tmp_path)
+            raise
+
+class PostgresExtractionStore:
+    """Persistent tier storing cached extractions in the extraction_cache table"""
+
+    def get(self, key):
+        with get_connection_pool().connection() as conn:
+            with conn.cursor() as cursor:
+                cursor.execute("SELECT data FROM extraction_cache WHERE cache_key = %s", (key,))
+                row = cursor.fetchone()
+        return row[0] if row else None
+
+    def put(self, key, data):
+        with get_connection_pool().connection() as conn:
+            with conn.cursor() as cursor:
+                cursor.execute(
+                    """INSERT INTO extraction_cache (cache_key, data) VALUES (%s, %s::jsonb)
+                       ON CONFLICT (cache_key) DO NOTHING""",
+                    (key, json.dumps(data))
+                )
+            conn.commit()
+
+class ExtractionCache:
+    """Two-tier extraction cache: a bounded in-memory LRU over an optional persistent store"""
+
+    def __init__(self, max_entries=256, store=None):
+        self.max_entries = max_entries
+        self.store = store
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        """Return a copy of the cached data for key, or None on a miss"""
+        with self._lock:
+            data = self._entries.get(key)
+            if data is not None:
+                self._entries.move_to_end(key)
+                return dict(data)
+        if self.store is None:
+            return None
+        try:
+            data = self.store.get(key)
+        except Exception as e:
+            logging.warning(f"Extraction cache store lookup failed: {str(e)}")
+            return None
+        if data is None:
+            return None
+        self._remember(key, data)
+        return dict(data)
+
+    def put(self, key, data):
+        """Cache a copy of data under key in every tier"""
+        self._remember(key, dict(data))
+        if self.store is not None:
+            try:
+                self.store.put(key, data)
+            except Exception as e:
+                logging.warning(f"Extraction cache store write failed: {str(e)}")
+
+    def _remember(self, key, data):
+        with self._lock:
+            self._entries[key] = data
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+_cache = None
+_cache_lock = threading.Lock()
+
+def get_extraction_cache():
+    """Return the process-wide extraction cache, configured from the environment on first use.
+
+    EXTRACTION_CACHE_SIZE sets the number of in-memory entries (0 disables the
+    in-memory tier's retention) and EXTRACTION_CACHE_STORE selects the
+    persistent tier: unset for none, "postgres", or a directory path.
+    """
+    global _cache
+    if _cache is None:
+        with _cache_lock:
+            if _cache is None:
+                store_setting = os.getenv("EXTRACTION_CACHE_STORE", "")
+                if not store_setting:
+                    store = None
+                elif store_setting == "postgres":
+                    store = PostgresExtractionStore()
+                else:
+                    store = DiskExtractionStore(store_setting)
+                _cache = ExtractionCache(int(os.getenv("EXTRACTION_CACHE_SIZE", "256")), store)
+    return _cache
@@ -0,0 +1,100 @@
+import re
+from collections import namedtuple
+
+# Single definition of the submission fields shared by the email and PDF
+# extractors and the database insert. Each field has a canonical label (as it
+# appears in our submission template), the extra aliases brokers use for it,
+# the section it belongs to (None for direct "Field:" lines) and its coercer.
+
+Field = namedtuple("Field", ["name", "label", "aliases", "section", "coerce"])
+
+NON_NUMERIC_RE = re.compile(r'[^\d.]')
+
+def to_text(value):
+    """Keep text values as they are"""
+    return value
+
+def to_int(value):
+    """Convert a numeric string (e.g. '12,500') to int, keeping the original if it isn't a whole number"""
+    clean_value = NON_NUMERIC_RE.sub('', value)
+    return int(clean_value) if clean_value.isdigit() else value
+
+def to_bool(value):
+    """Convert a yes/no style value to bool"""
+    return value.lower() in ['yes', 'true', 'y', '1']
+
+def to_money(value):
+    """Convert a monetary string to int or float, keeping the original if conversion fails"""
+    # Remove commas and currency signs, keep only digits and decimal points
+    clean_value = NON_NUMERIC_RE.sub('', value)
+    try:
+        return float(clean_value) if '.' in clean_value else int(clean_value)
+    except ValueError:
+        return value  # Keep original if conversion fails
+
+SECTIONS = ['coverage', 'risk', 'financials']
+
+FIELDS = [
+    Field('broker', 'Broker', ('Insurance Broker',), None, to_text),
+    Field('insured', 'Insured', ('Client', 'Company', 'Name'), None, to_text),
+    Field('address', 'Address', ('Location', 'Property Address'), None, to_text),
+    Field('building_type', 'Building Type', ('Property Type', 'Type'), None, to_text),
+    Field('construction', 'Construction', (), None, to_text),
+    Field('year_built', 'Year Built', ('Year',), None, to_int),
+    Field('area', 'Area', ('Square Footage', 'Size', 'Surface Area'), None, to_int),
+    Field('stories', 'Stories', ('Floors', 'No. of Floors', 'Number of Floors'), None, to_int),
+    Field('occupancy', 'Occupancy', (), None, to_text),
+    Field('sprinklers', 'Sprinklers', (), None, to_bool),
+    Field('alarm_system', 'Alarm System', ('Security System', 'Alarm'), None, to_text),
+    # Coverage section
+    Field('building_value', 'Building Value', (), 'coverage', to_money),
+    Field('contents_value', 'Contents Value', (), 'coverage', to_money),
+    Field('business_interruption', 'Business Interruption', ('BI',), 'coverage', to_money),
+    Field('deductible', 'Deductible', (), 'coverage', to_money),
+    # Risk section
+    Field('fire_hazards', 'Fire Hazards', (), 'risk', to_text),
+    Field('natural_disasters', 'Natural Disasters', (), 'risk', to_text),
+    Field('security', 'Security', (), 'risk', to_text),
+    # Financials section
+    Field('property_valuation', 'Property Valuation', (), 'financials', to_money),
+    Field('annual_revenue', 'Annual Revenue', ('Revenue', 'Annual Turnover'), 'financials', to_money),
+]
+
+FIELDS_BY_NAME = {field.name: field for field in FIELDS}
+FIELD_NAMES = [field.name for field in FIELDS]
+DIRECT_FIELDS = [field for field in FIELDS if field.section is None]
+SECTIONED_FIELDS = [field for field in FIELDS if field.section is not None]
+MONETARY_FIELDS = [field.name for field in FIELDS if field.coerce is to_money]
+
+# Lowercased label -> field lookups keyed by section (None for direct fields).
+# ALIAS_LOOKUP accepts every alias, LABEL_LOOKUP only the canonical labels.
+ALIAS_LOOKUP = {
+    (field.section, label.lower()): field
+    for field in FIELDS
+    for label in (field.label,) + field.aliases
+}
+LABEL_LOOKUP = {(field.section, field.label.lower()): field for field in FIELDS}
+
+# Columns of the submissions table written by save_to_database
+SUBMISSION_COLUMNS = FIELD_NAMES + ['source_file', 'content_hash', 'submitted_at']
+
+SUBMISSION_VALUES_TEMPLATE = "(" + ", ".join(f"%({column})s" for column in SUBMISSION_COLUMNS) + ")"
+
+# Replays of the same blob (same source_file and content_hash) are skipped by
+# the uq_submissions_source_content unique index instead of inserting a duplicate
+SUBMISSION_CONFLICT_CLAUSE = " ON CONFLICT (source_file, content_hash) DO NOTHING"
+
+INSERT_SUBMISSION_SQL = (
+    "INSERT INTO submissions (" + ", ".join(SUBMISSION_COLUMNS) + ") VALUES " + SUBMISSION_VALUES_TEMPLATE
+    + SUBMISSION_CONFLICT_CLAUSE + " RETURNING id"
+)
+
+# Multi-row form for psycopg2.extras.execute_values, which fills in the %s
+INSERT_SUBMISSIONS_VALUES_SQL = (
+    "INSERT INTO submissions (" + ", ".join(SUBMISSION_COLUMNS) + ") VALUES %s"
+    + SUBMISSION_CONFLICT_CLAUSE + " RETURNING source_file, content_hash"
+)
+
+def label_pattern(label):
+    """Regex for a label, allowing any run of whitespace between its words"""
+    return r'\s+'.join(re.escape(word) for word in label.split())
@@ -3,9 +3,15 @@ import os
 import re
 import psycopg2
 from datetime import datetime
-from azure.storage.blob import BlobServiceClient
 import azure.functions as func
-from shared_code import save_to_database, is_submission_complete
+from shared_code import save_to_database, is_submission_complete, get_container_client
+from extraction_cache import get_extraction_cache, content_hash, cache_key
+from field_schema import (
+    FIELDS_BY_NAME, DIRECT_FIELDS, SECTIONED_FIELDS, SECTIONS, ALIAS_LOOKUP, NON_NUMERIC_RE, to_int, to_money
+)
+
+# Bump when extraction output changes so cached results are not reused
+EXTRACTOR_VERSION = "email-1"
 
 # Remove this line: app = func.FunctionApp(http_auth_level=func.AuthLevel.ANONYMOUS)
 # Remove the @app.function_name and @app.route decorators
@@ -21,26 +27,32 @@ def process_email_body_impl(req: func.HttpRequest) -> func.HttpResponse:
         if not blob_filename:
             return func.HttpResponse("Missing blob filename", status_code=400)
 
-        # Connect to blob storage
-        blob_service = BlobServiceClient.from_connection_string(os.environ["AzureWebJobsStorage"])
-        
         # Get email content
-        mail_container = blob_service.get_container_client("mailbody")
+        mail_container = get_container_client("mailbody")
         mail_blob = mail_container.get_blob_client(blob_filename)
-        mail_data = mail_blob.download_blob().readall().decode("utf-8")
+        mail_bytes = mail_blob.download_blob().readall()
+        mail_data = mail_bytes.decode("utf-8")
         
         logging.info(f"Email body content length: {len(mail_data)}")
         logging.info(f"Sample content: {mail_data[:80]}...")
         
         # Extract subject from email
         subject = ""
-        subject_match = re.search(r'Subject:(.+?)(?:\r?\n|\Z)', mail_data)
+        subject_match = SUBJECT_RE.search(mail_data)
         if subject_match:
             subject = subject_match.group(1).strip()
             logging.info(f"Email subject: {subject}")
             
-        # Extract data from email body
-        submission_data = extract_data_from_email(mail_data)
+        # Extract data from email body, reusing the cached result for content we've already parsed
+        extraction_cache = get_extraction_cache()
+        mail_hash = content_hash(mail_bytes)
+        extraction_key = cache_key(mail_hash, EXTRACTOR_VERSION)
+        submission_data = extraction_cache.get(extraction_key)
+        if submission_data is None:
+            submission_data = extract_data_from_email(mail_data)
+            extraction_cache.put(extraction_key, submission_data)
+        else:
+            logging.info(f"Using cached extraction for {blob_filename}")
         
         # Check if we have enough data to save
         if is_submission_complete(submission_data):
@@ -48,11 +60,17 @@ def process_email_body_impl(req: func.HttpRequest) -> func.HttpResponse:
             
             # Add metadata
             submission_data["source_file"] = blob_filename
+            submission_data["content_hash"] = mail_hash
             submission_data["submitted_at"] = datetime.utcnow()
             
-            # Save to database
-            save_to_database(submission_data)
-            return func.HttpResponse("Successfully processed submission from email body", status_code=200)
+            # Save to database (a replay of an already saved email inserts nothing)
+            status = save_to_database(submission_data)
+            if status == "inserted":
+                return func.HttpResponse("Successfully processed submission from email body", status_code=200)
+            elif status == "existing":
+                return func.HttpResponse("Submission from email body was already processed", status_code=200)
+            else:
+                return func.HttpResponse("Failed to save submission from email body", status_code=500)
         else:
             return func.HttpResponse("Insufficient data in email body", status_code=400)
         
@@ -62,171 +80,145 @@ def process_email_body_impl(req: func.HttpRequest) -> func.HttpResponse:
         logging.error(f"Exception traceback: {traceback.format_exc()}")
         return func.HttpResponse(f"Error: {str(e)}", status_code=500)
 
+# Extraction patterns are compiled once at import time from the shared field
+# schema. The extractor walks the email a single time: one tokenizer picks up
+# line breaks, section headers and bullet markers, and the "Field:" labels,
+# bullet labels and their values are matched in place where they start.
+
+# Aliases of the shared schema that a pass of the email extractor has never
+# accepted; they stay excluded so its results match the original extractor
+# (checked by experiments/check_email_golden_corpus.py)
+PRIMARY_EXCLUDED_ALIASES = {'Year'}
+FALLBACK_EXCLUDED_ALIASES = {'No. of Floors', 'Alarm', 'BI', 'Revenue'}
+
+def alias_alternation(fields, excluded=()):
+    """Named-group alternation of every label and alias of the given fields"""
+    return '|'.join(
+        f'(?P<{field.name}>' + '|'.join(
+            re.escape(label) for label in (field.label,) + field.aliases if label not in excluded
+        ) + ')'
+        for field in fields
+    )
+
+FALLBACK_LOOKUP = {
+    key: field for key, field in ALIAS_LOOKUP.items()
+    if key[1] not in {alias.lower() for alias in FALLBACK_EXCLUDED_ALIASES}
+}
+
+def coerce_value(field, value):
+    """Coerce a value with the field's coercer; integer fields that are not whole numbers keep their cleaned digits"""
+    if field.coerce is to_int:
+        clean_value = NON_NUMERIC_RE.sub('', value)
+        return int(clean_value) if clean_value.isdigit() else clean_value
+    return field.coerce(value)
+
+# Value patterns for direct fields that only accept a specific format
+PRIMARY_VALUES = {
+    'year_built': r'\s*(\d{4})',
+    'area': r'\s*(\d[\d,.]*)',
+    'stories': r'\s*(\d+)',
+    'sprinklers': r'\s*(Yes|No|Y|N|True|False)',
+}
+
+SUBJECT_RE = re.compile(r'Subject:(.+?)(?:\r?\n|\Z)')
+
+TOKEN_RE = re.compile(
+    r'(?P<newline>\n)|(?P<bullet>[-•])|' + '|'.join(f'(?P<{section}>{section}:)' for section in SECTIONS),
+    re.IGNORECASE
+)
+PRIMARY_LABEL_RE = re.compile('(?:' + alias_alternation(DIRECT_FIELDS, PRIMARY_EXCLUDED_ALIASES) + ')[:;]', re.IGNORECASE)
+BULLET_LABEL_RE = re.compile(r'[-•]\s*(?:' + alias_alternation(SECTIONED_FIELDS) + ')[:;]', re.IGNORECASE)
+TEXT_VALUE_RE = re.compile(r'\s*([^\n]+)')
+MONEY_VALUE_RE = re.compile(r'\s*\$?\s*(\d[\d,.]*)')
+PRIMARY_VALUE_RES = {
+    field.name: re.compile(PRIMARY_VALUES[field.name], re.IGNORECASE) if field.name in PRIMARY_VALUES else TEXT_VALUE_RE
+    for field in DIRECT_FIELDS
+}
+SECTIONED_VALUE_RES = {
+    field.name: MONEY_VALUE_RE if field.coerce is to_money else TEXT_VALUE_RE
+    for field in SECTIONED_FIELDS
+}
+BULLET_LINE_RE = re.compile(r'^[-•]\s*([^:]+):\s*(.+)$')
+COLON_LINE_RE = re.compile(r'^([^:]+):\s*(.+)$')
+
 def extract_data_from_email(email_text):
     """Extract structured submission data from email body with enhanced parsing"""
-    data = {}
-    
-    # Primary field patterns (direct "Field:" format)
-    primary_patterns = {
-        'broker': r'(?:^|\n)(?:Broker|Insurance Broker)[:;]\s*([^\n]+)',
-        'insured': r'(?:^|\n)(?:Insured|Client|Company|Name)[:;]\s*([^\n]+)',
-        'address': r'(?:^|\n)(?:Address|Location|Property Address)[:;]\s*([^\n]+)',
-        'building_type': r'(?:^|\n)(?:Building Type|Property Type|Type)[:;]\s*([^\n]+)',
-        'construction': r'(?:^|\n)Construction[:;]\s*([^\n]+)',
-        'year_built': r'(?:^|\n)Year Built[:;]\s*(\d{4})',
-        'area': r'(?:^|\n)(?:Area|Square Footage|Size|Surface Area)[:;]\s*(\d[\d,.]*)(?:\s*(?:sq\.?|square)?\s*(?:ft|m|feet|meters|m²|sqm))?',
-        'stories': r'(?:^|\n)(?:Stories|Floors|No\. of Floors|Number of Floors)[:;]\s*(\d+)',
-        'occupancy': r'(?:^|\n)Occupancy[:;]\s*([^\n]+)',
-        'sprinklers': r'(?:^|\n)Sprinklers[:;]\s*(Yes|No|Y|N|True|False)',
-        'alarm_system': r'(?:^|\n)(?:Alarm System|Security System|Alarm)[:;]\s*([^\n]+)',
-    }
-    
-    # Sectioned patterns (for "- Field:" format within sections)
-    sectioned_patterns = {
-        # Coverage section
-        'building_value': r'(?:Coverage:|coverage:).*?[-•]\s*Building Value[:;]\s*\$?\s*(\d[\d,.]*)',
-        'contents_value': r'(?:Coverage:|coverage:).*?[-•]\s*Contents Value[:;]\s*\$?\s*(\d[\d,.]*)',
-        'business_interruption': r'(?:Coverage:|coverage:).*?[-•]\s*(?:Business Interruption|BI)[:;]\s*\$?\s*(\d[\d,.]*)',
-        'deductible': r'(?:Coverage:|coverage:).*?[-•]\s*Deductible[:;]\s*\$?\s*(\d[\d,.]*)',
-        
-        # Risk section
-        'fire_hazards': r'(?:Risk:|risk:).*?[-•]\s*Fire Hazards[:;]\s*([^\n]+)',
-        'natural_disasters': r'(?:Risk:|risk:).*?[-•]\s*Natural Disasters[:;]\s*([^\n]+)',
-        'security': r'(?:Risk:|risk:).*?[-•]\s*Security[:;]\s*([^\n]+)',
-        
-        # Financials section
-        'property_valuation': r'(?:Financials:|financials:).*?[-•]\s*Property Valuation[:;]\s*\$?\s*(\d[\d,.]*)',
-        'annual_revenue': r'(?:Financials:|financials:).*?[-•]\s*(?:Annual Revenue|Revenue|Annual Turnover)[:;]\s*\$?\s*(\d[\d,.]*)'
-    }
-    
-    # Extract primary fields first
-    for field, pattern in primary_patterns.items():
-        match = re.search(pattern, email_text, re.IGNORECASE)
-        if match:
-            value = match.group(1).strip()
-            
-            # Handle special field types
-            if field == 'sprinklers':
-                data[field] = value.lower() in ['yes', 'true', 'y', '1']
-            elif field in ['area', 'stories', 'year_built']:
-                clean_value = re.sub(r'[^\d.]', '', value)
-                data[field] = int(clean_value) if clean_value.isdigit() else clean_value
-            else:
-                data[field] = value
-    
-    # Extract sectioned fields using multiline regex with DOTALL flag
-    for field, pattern in sectioned_patterns.items():
-        match = re.search(pattern, email_text, re.IGNORECASE | re.DOTALL)
-        if match:
-            value = match.group(1).strip()
-            
-            # Handle monetary values
-            if field in ['building_value', 'contents_value', 'business_interruption', 
-                        'deductible', 'property_valuation', 'annual_revenue']:
-                # Remove commas and dollar signs, keep only digits and decimal points
-                clean_value = re.sub(r'[^\d.]', '', value)
-                try:
-                    data[field] = float(clean_value) if '.' in clean_value else int(clean_value)
-                except ValueError:
-                    data[field] = value  # Keep original if conversion fails
-            else:
-                data[field] = value
-    
-    # Fallback: Line-by-line parsing for any missed fields
-    if len(data) < 10:  # If we haven't found enough data, try line-by-line
-        lines = email_text.split('\n')
-        current_section = None
-        
-        for line in lines:
-            line = line.strip()
-            if not line:
-                continue
-            
-            # Detect sections
-            if line.lower().startswith('coverage:'):
-                current_section = 'coverage'
-                continue
-            elif line.lower().startswith('risk:'):
-                current_section = 'risk'
-                continue
-            elif line.lower().startswith('financials:'):
-                current_section = 'financials'
-                continue
-            
-            # Parse bullet points within sections
-            bullet_match = re.search(r'^[-•]\s*([^:]+):\s*(.+)$', line)
-            if bullet_match and current_section:
-                key = bullet_match.group(1).strip().lower()
-                value = bullet_match.group(2).strip()
-                
-                # Map field names based on section and key
-                field_mapping = {
-                    'coverage': {
-                        'building value': 'building_value',
-                        'contents value': 'contents_value',
-                        'business interruption': 'business_interruption',
-                        'deductible': 'deductible'
-                    },
-                    'risk': {
-                        'fire hazards': 'fire_hazards',
-                        'natural disasters': 'natural_disasters',
-                        'security': 'security'
-                    },
-                    'financials': {
-                        'property valuation': 'property_valuation',
-                        'annual revenue': 'annual_revenue',
-                        'annual turnover': 'annual_revenue'
-                    }
-                }
-                
-                if current_section in field_mapping and key in field_mapping[current_section]:
-                    field = field_mapping[current_section][key]
-                    
-                    # Process monetary values
-                    if field in ['building_value', 'contents_value', 'business_interruption', 
-                                'deductible', 'property_valuation', 'annual_revenue']:
-                        clean_value = re.sub(r'[^\d.]', '', value)
-                        try:
-                            data[field] = float(clean_value) if '.' in clean_value else int(clean_value)
-                        except ValueError:
-                            data[field] = value
-                    else:
-                        data[field] = value
-            
-            # Also try direct "Key: Value" pattern for any line
-            colon_match = re.search(r'^([^:]+):\s*(.+)$', line)
-            if colon_match:
-                key = colon_match.group(1).strip().lower()
-                value = colon_match.group(2).strip()
-                
-                # Standard field mapping
-                field_mapping = {
-                    'broker': 'broker', 'insurance broker': 'broker',
-                    'insured': 'insured', 'client': 'insured', 'name': 'insured', 'company': 'insured',
-                    'address': 'address', 'location': 'address', 'property address': 'address',
-                    'building type': 'building_type', 'property type': 'building_type', 'type': 'building_type',
-                    'construction': 'construction',
-                    'year built': 'year_built', 'year': 'year_built',
-                    'area': 'area', 'square footage': 'area', 'size': 'area', 'surface area': 'area',
-                    'stories': 'stories', 'floors': 'stories', 'number of floors': 'stories',
-                    'occupancy': 'occupancy',
-                    'sprinklers': 'sprinklers',
-                    'alarm system': 'alarm_system', 'security system': 'alarm_system'
-                }
-                
-                if key in field_mapping:
-                    field = field_mapping[key]
-                    
-                    # Process value based on field type
-                    if field == 'sprinklers':
-                        data[field] = value.lower() in ['yes', 'true', 'y', '1']
-                    elif field in ['area', 'stories', 'year_built']:
-                        clean_value = re.sub(r'[^\d.]', '', value)
-                        try:
-                            data[field] = int(clean_value) if clean_value.isdigit() else clean_value
-                        except ValueError:
-                            data[field] = value
-                    else:
-                        data[field] = value
-    
-    return data
\ No newline at end of file
+    primary = {}
+    sectioned = {}
+    fallback = {}
+    sections_seen = set()
+    current_section = None
+    line_start = 0
+
+    match_primary_field(email_text, line_start, primary)
+    for token in TOKEN_RE.finditer(email_text):
+        kind = token.lastgroup
+        if kind == 'newline':
+            current_section = parse_fallback_line(email_text[line_start:token.start()], current_section, fallback)
+            line_start = token.end()
+            match_primary_field(email_text, line_start, primary)
+        elif kind == 'bullet':
+            match_sectioned_field(email_text, token.start(), sections_seen, sectioned)
+        else:
+            sections_seen.add(kind)
+    parse_fallback_line(email_text[line_start:], current_section, fallback)
+
+    # Primary fields first, then sectioned fields, in schema order
+    data = {field.name: primary[field.name] for field in DIRECT_FIELDS if field.name in primary}
+    data.update((field.name, sectioned[field.name]) for field in SECTIONED_FIELDS if field.name in sectioned)
+
+    # Fallback: line-by-line results for any missed fields
+    if len(data) < 10:  # If we haven't found enough data, use the line-by-line results
+        data.update(fallback)
+
+    return data
+
+def match_primary_field(text, pos, data):
+    """Match a "Field:" label and its value at the start of a line"""
+    label = PRIMARY_LABEL_RE.match(text, pos)
+    if not label or label.lastgroup in data:
+        return
+    field = FIELDS_BY_NAME[label.lastgroup]
+    match = PRIMARY_VALUE_RES[field.name].match(text, label.end())
+    if match:
+        data[field.name] = coerce_value(field, match.group(1).strip())
+
+def match_sectioned_field(text, pos, sections_seen, data):
+    """Match a "- Field:" bullet and its value, once its section header has been seen"""
+    label = BULLET_LABEL_RE.match(text, pos)
+    if not label or label.lastgroup in data:
+        return
+    field = FIELDS_BY_NAME[label.lastgroup]
+    if field.section not in sections_seen:
+        return
+    match = SECTIONED_VALUE_RES[field.name].match(text, label.end())
+    if match:
+        data[field.name] = coerce_value(field, match.group(1).strip())
+
+def parse_fallback_line(line, current_section, data):
+    """Parse a single line for the line-by-line fallback and return the current section"""
+    line = line.strip()
+    if not line:
+        return current_section
+
+    # Detect sections
+    lowered = line.lower()
+    for section in SECTIONS:
+        if lowered.startswith(section + ':'):
+            return section
+
+    # Parse bullet points within sections
+    bullet_match = BULLET_LINE_RE.search(line)
+    if bullet_match and current_section:
+        field = FALLBACK_LOOKUP.get((current_section, bullet_match.group(1).strip().lower()))
+        if field:
+            data[field.name] = coerce_value(field, bullet_match.group(2).strip())
+
+    # Also try direct "Key: Value" pattern for any line
+    colon_match = COLON_LINE_RE.search(line)
+    if colon_match:
+        field = FALLBACK_LOOKUP.get((None, colon_match.group(1).strip().lower()))
+        if field:
+            data[field.name] = coerce_value(field, colon_match.group(2).strip())
+
+    return current_section
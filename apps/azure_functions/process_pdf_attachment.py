@@ -1,17 +1,103 @@
 import logging
+import multiprocessing
 import os
 import re
 import io
+import mmap
+import shutil
+import tempfile
+import threading
 import psycopg2
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from contextlib import contextmanager
 from datetime import datetime
-from azure.storage.blob import BlobServiceClient
 import azure.functions as func
 import PyPDF2
-from shared_code import save_to_database, is_submission_complete
+from shared_code import save_to_database, is_submission_complete, get_container_client
+from extraction_cache import get_extraction_cache, content_hash, cache_key
+from field_schema import (
+    FIELDS_BY_NAME, DIRECT_FIELDS, SECTIONED_FIELDS, SECTIONS, LABEL_LOOKUP, to_money, label_pattern
+)
+
+# Bump when extraction output changes so cached results are not reused
+EXTRACTOR_VERSION = "pdf-1"
 
 # Remove this line: app = func.FunctionApp(http_auth_level=func.AuthLevel.ANONYMOUS)
 # Remove the @app.function_name and @app.route decorators
 
+# Extraction patterns, compiled once at import time from the shared field schema.
+# PDF text is matched on the canonical template labels only.
+
+# Value pattern for each direct field, ending where the next label starts
+DIRECT_VALUES = {
+    'broker': r'\s*([^\n\r]+?)(?=\s*(?:Insured:|Address:|Building|$))',
+    'insured': r'\s*([^\n\r]+?)(?=\s*(?:Address:|Building|Construction|$))',
+    'address': r'\s*([^\n\r]+?)(?=\s*(?:Building\s+Type:|Construction:|Year|$))',
+    'building_type': r'\s*([^\n\r]+?)(?=\s*(?:Construction:|Year|Area|$))',
+    'construction': r'\s*([^\n\r]+?)(?=\s*(?:Year\s+Built:|Area:|Stories|$))',
+    'year_built': r'\s*(\d{4})(?=\s*(?:Area:|Stories:|Occupancy|$))',
+    'area': r'\s*(\d[\d,.\s]*?)(?:\s*sqm|\s*sq\.?\s*m|\s*square\s+meters?)?(?=\s*(?:Stories:|Occupancy:|Sprinklers|$))',
+    'stories': r'\s*(\d+)(?=\s*(?:Occupancy:|Sprinklers:|Alarm|$))',
+    'occupancy': r'\s*([^\n\r]+?)(?=\s*(?:Sprinklers:|Alarm|Coverage|$))',
+    'sprinklers': r'\s*(Yes|No|Y|N|True|False)(?=\s*(?:Alarm|Coverage|Risk|$))',
+    'alarm_system': r'\s*([^\n\r]+?)(?=\s*(?:Coverage:|Risk:|Financials|$))',
+}
+
+MONEY_VALUE = r'\s*\$?\s*(\d[\d,.]*)'
+TEXT_VALUE = r'\s*([^\n\r]+?)(?=\s*[-•]|\s*\n[A-Z]|\s*$)'
+
+DIRECT_PATTERNS = {
+    field.name: re.compile(label_pattern(field.label) + ':' + DIRECT_VALUES[field.name], re.IGNORECASE | re.MULTILINE)
+    for field in DIRECT_FIELDS
+}
+SECTIONED_PATTERNS = {
+    field.name: re.compile(
+        f'{field.section}:.*?[-•]\\s*{label_pattern(field.label)}:'
+        + (MONEY_VALUE if field.coerce is to_money else TEXT_VALUE),
+        re.IGNORECASE | re.DOTALL
+    )
+    for field in SECTIONED_FIELDS
+}
+# Bullet on its own, used once the section header was seen on an earlier page
+BULLET_PATTERNS = {
+    field.name: re.compile(
+        f'[-•]\\s*{label_pattern(field.label)}:' + (MONEY_VALUE if field.coerce is to_money else TEXT_VALUE),
+        re.IGNORECASE | re.DOTALL
+    )
+    for field in SECTIONED_FIELDS
+}
+SECTION_HEADER_PATTERNS = {section: re.compile(f'{section}:', re.IGNORECASE) for section in SECTIONS}
+BULLET_LINE_RE = re.compile(r'^[-•]\s*([^:]+):\s*(.+)$')
+COLON_LINE_RE = re.compile(r'^([^:]+):\s*(.+)$')
+
+# CRITICAL FIX: field labels that get concatenated onto the previous line
+CONCATENATED_LABELS = [
+    'Insured:', 'Address:', 'Building Type:', 'Construction:', 'Year Built:', 
+    'Area:', 'Stories:', 'Occupancy:', 'Sprinklers:', 'Alarm System:',
+    'Coverage:', 'Risk:', 'Financials:'
+]
+
+# All of clean_pdf_text's fixes as one alternation, applied in a single pass:
+# - whitespace between a word and a concatenated label becomes a line break
+# - CRLF/CR line breaks become \n, and space/tab runs become one space
+# - a space is added between camelCase, number-letter and letter-number boundaries
+CLEAN_TEXT_RE = re.compile(
+    r'(?P<label_break>(?<=\w)\s+(?=' + '|'.join(re.escape(label) for label in CONCATENATED_LABELS) + r'))'
+    r'|(?P<line_break>\r\n?)'
+    r'|(?P<spaces>\t[ \t]*| [ \t]+)'
+    r'|(?<=[a-z])(?=[A-Z])|(?<=\d)(?=[A-Za-z])|(?<=[A-Za-z])(?=\d)'
+)
+
+# Attachments larger than this are spooled to a temporary file instead of memory
+PDF_SPOOL_MAX_SIZE = int(os.getenv("PDF_SPOOL_MAX_SIZE", str(16 * 1024 * 1024)))
+
+# PDFs with more pages than this are extracted in a process pool (0 disables it)
+PDF_PARALLEL_PAGE_THRESHOLD = int(os.getenv("PDF_PARALLEL_PAGE_THRESHOLD", "50"))
+PDF_PARALLEL_WORKERS = int(os.getenv("PDF_PARALLEL_WORKERS", str(min(4, os.cpu_count() or 1))))
+PDF_PARALLEL_CHUNK_PAGES = int(os.getenv("PDF_PARALLEL_CHUNK_PAGES", "8"))
+
 def process_pdf_attachment_impl(req: func.HttpRequest) -> func.HttpResponse:
     logging.info("📎 ProcessPDFAttachment function triggered")
     
@@ -23,28 +109,43 @@ def process_pdf_attachment_impl(req: func.HttpRequest) -> func.HttpResponse:
         if not blob_filename:
             return func.HttpResponse("Missing attachment filename", status_code=400)
 
-        # Connect to blob storage
-        blob_service = BlobServiceClient.from_connection_string(os.environ["AzureWebJobsStorage"])
-        
         # Get the PDF content
-        att_container = blob_service.get_container_client("attachments")
+        att_container = get_container_client("attachments")
         pdf_blob = att_container.get_blob_client(blob_filename)
-        pdf_content = pdf_blob.download_blob().readall()
         
         logging.info(f"Processing PDF: {blob_filename}")
         
-        # Extract data from PDF
-        pdf_data = extract_data_from_pdf(pdf_content)
+        # Stream the PDF into a spooled file (spills to disk for large attachments)
+        # and extract data from it page by page, unless this content was already parsed
+        with tempfile.SpooledTemporaryFile(max_size=PDF_SPOOL_MAX_SIZE) as pdf_file:
+            pdf_blob.download_blob().readinto(pdf_file)
+            extraction_cache = get_extraction_cache()
+            pdf_hash = content_hash(pdf_file)
+            extraction_key = cache_key(pdf_hash, EXTRACTOR_VERSION)
+            pdf_data = extraction_cache.get(extraction_key)
+            if pdf_data is None:
+                pdf_data = extract_data_from_pdf(pdf_file)
+                # An empty result may be a transient read failure, so don't cache it
+                if pdf_data:
+                    extraction_cache.put(extraction_key, pdf_data)
+            else:
+                logging.info(f"Using cached extraction for {blob_filename}")
         
         # Check if we have enough data
         if is_submission_complete(pdf_data):
             # Add metadata
             pdf_data["source_file"] = blob_filename
+            pdf_data["content_hash"] = pdf_hash
             pdf_data["submitted_at"] = datetime.utcnow()
             
-            # Save to database
-            save_to_database(pdf_data)
-            return func.HttpResponse("Successfully processed submission from PDF attachment", status_code=200)
+            # Save to database (a replay of an already saved PDF inserts nothing)
+            status = save_to_database(pdf_data)
+            if status == "inserted":
+                return func.HttpResponse("Successfully processed submission from PDF attachment", status_code=200)
+            elif status == "existing":
+                return func.HttpResponse("Submission from PDF attachment was already processed", status_code=200)
+            else:
+                return func.HttpResponse("Failed to save submission from PDF attachment", status_code=500)
         else:
             # Debug - log what was extracted
             for key, value in pdf_data.items():
@@ -59,248 +160,231 @@ def process_pdf_attachment_impl(req: func.HttpRequest) -> func.HttpResponse:
         return func.HttpResponse(f"Error: {str(e)}", status_code=500)
 
 def extract_data_from_pdf(pdf_content):
-    """Extract structured data from PDF content - handles both direct and sectioned formats"""
+    """Extract structured data from PDF content - handles both direct and sectioned formats.
+
+    Accepts the PDF as bytes or a seekable file object. Pages are extracted and
+    matched one at a time, and parsing stops as soon as every field is filled.
+    """
     try:
-        # Create PDF reader
-        pdf_file = io.BytesIO(pdf_content)
-        reader = PyPDF2.PdfReader(pdf_file)
+        pdf_file = io.BytesIO(pdf_content) if isinstance(pdf_content, (bytes, bytearray)) else pdf_content
         
-        # Extract text from all pages
-        text = ""
-        for page in range(len(reader.pages)):
-            page_text = reader.pages[page].extract_text()
-            text += page_text + "\n"
+        matcher = PdfFieldMatcher()
+        pages = 0
+        characters = 0
+        for text in iter_pdf_page_texts(pdf_file):
+            pages += 1
+            characters += len(text)
+            if pages == 1:
+                logging.debug(f"Cleaned PDF content: {text[:500]}...")
+            matcher.feed(text)
+            if matcher.complete:
+                logging.info(f"All fields found after {pages} pages, skipping the rest of the PDF")
+                break
         
-        logging.info(f"Extracted {len(text)} characters from PDF")
-        logging.debug(f"Raw PDF content: {text[:500]}...")
+        logging.info(f"Extracted {characters} characters from {pages} PDF pages")
         
-        # Clean the text
-        text = clean_pdf_text(text)
-        logging.debug(f"Cleaned PDF content: {text[:500]}...")
-        
-        data = {}
+        data = matcher.result()
         
+        logging.info(f"Extracted {len(data)} fields from PDF")
+        for key, value in data.items():
+            logging.info(f"  {key}: {value}")
+            
+        return data
+    
+    except Exception as e:
+        logging.error(f"Error extracting data from PDF: {str(e)}")
+        import traceback
+        logging.error(f"Exception traceback: {traceback.format_exc()}")
+        return {}
+
+def iter_pdf_page_texts(pdf_file):
+    """Yield the cleaned text of each PDF page, one page at a time"""
+    reader = PyPDF2.PdfReader(pdf_file)
+    page_count = len(reader.pages)
+    if PDF_PARALLEL_PAGE_THRESHOLD and page_count > PDF_PARALLEL_PAGE_THRESHOLD:
+        logging.info(f"Extracting {page_count} PDF pages in parallel")
+        yield from iter_pdf_page_texts_parallel(pdf_file, page_count)
+        return
+    for page in reader.pages:
+        yield clean_pdf_text(page.extract_text())
+
+def iter_pdf_page_texts_parallel(pdf_file, page_count):
+    """Yield the cleaned text of each PDF page, extracting page ranges in a process pool.
+
+    Workers memory-map the PDF from a temporary file instead of receiving a
+    pickled copy, so only page ranges and page text cross process boundaries.
+    Results are yielded in page order, with a bounded number of ranges in
+    flight; closing the generator early cancels the ranges not yet started.
+    """
+    executor = get_pdf_executor()
+    with pdf_temp_path(pdf_file) as path:
+        ranges = (
+            (path, start, min(start + PDF_PARALLEL_CHUNK_PAGES, page_count))
+            for start in range(0, page_count, PDF_PARALLEL_CHUNK_PAGES)
+        )
+        pending = deque()
+        try:
+            for page_range in ranges:
+                pending.append(executor.submit(extract_page_range_texts, *page_range))
+                if len(pending) >= 2 * PDF_PARALLEL_WORKERS:
+                    yield from pending.popleft().result()
+            while pending:
+                yield from pending.popleft().result()
+        except BrokenProcessPool:
+            # A worker died (e.g. killed for memory); later PDFs get a new pool
+            logging.error("PDF extraction process pool is broken, replacing it")
+            discard_pdf_executor(executor)
+            raise
+        finally:
+            for future in pending:
+                future.cancel()
+
+def extract_page_range_texts(path, start, stop):
+    """Extract the cleaned text of pages [start, stop) of a PDF file (runs in a worker process)"""
+    with open(path, 'rb') as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mapped:
+        reader = PyPDF2.PdfReader(mapped)
+        return [clean_pdf_text(reader.pages[page].extract_text()) for page in range(start, stop)]
+
+@contextmanager
+def pdf_temp_path(pdf_file):
+    """Copy a PDF stream to a named temporary file the worker processes can map"""
+    tmp = tempfile.NamedTemporaryFile(suffix='.pdf', delete=False)
+    try:
+        with tmp:
+            pdf_file.seek(0)
+            shutil.copyfileobj(pdf_file, tmp)
+        yield tmp.name
+    finally:
+        os.remove(tmp.name)
+
+_pdf_executor = None
+_pdf_executor_lock = threading.Lock()
+
+def get_pdf_executor():
+    """Return the worker-wide process pool for parallel PDF extraction, creating it on first use"""
+    global _pdf_executor
+    if _pdf_executor is None:
+        with _pdf_executor_lock:
+            if _pdf_executor is None:
+                # Forking the multi-threaded Functions worker would copy locks held
+                # by its other threads (gRPC, logging) into the children; workers
+                # are started from a clean forkserver process instead
+                _pdf_executor = ProcessPoolExecutor(
+                    max_workers=PDF_PARALLEL_WORKERS, mp_context=multiprocessing.get_context("forkserver")
+                )
+    return _pdf_executor
+
+def discard_pdf_executor(executor):
+    """Drop a broken process pool, so the next get_pdf_executor call creates a new one"""
+    global _pdf_executor
+    with _pdf_executor_lock:
+        if _pdf_executor is executor:
+            _pdf_executor = None
+    executor.shutdown(wait=False, cancel_futures=True)
+
+class PdfFieldMatcher:
+    """Incrementally match the schema fields against PDF text, one page at a time.
+
+    Section headers seen on earlier pages carry over, so a Coverage/Risk/Financials
+    bullet is still matched when its header is on a previous page. Only the
+    extracted fields and the fallback state are kept between pages.
+    """
+
+    def __init__(self):
+        self.data = {}
+        self.fallback_data = {}
+        self.sections_seen = set()
+        self.current_section = None
+
+    @property
+    def complete(self):
+        return len(self.data) == len(FIELDS_BY_NAME)
+
+    def feed(self, text):
+        """Match the fields still missing against the text of the next page"""
         # PHASE 1: Extract direct field format (Field: Value)
-        direct_patterns = {
-            'broker': r'Broker:\s*([^\n\r]+?)(?=\s*(?:Insured:|Address:|Building|$))',
-            'insured': r'Insured:\s*([^\n\r]+?)(?=\s*(?:Address:|Building|Construction|$))',
-            'address': r'Address:\s*([^\n\r]+?)(?=\s*(?:Building\s+Type:|Construction:|Year|$))',
-            'building_type': r'Building\s+Type:\s*([^\n\r]+?)(?=\s*(?:Construction:|Year|Area|$))',
-            'construction': r'Construction:\s*([^\n\r]+?)(?=\s*(?:Year\s+Built:|Area:|Stories|$))',
-            'year_built': r'Year\s+Built:\s*(\d{4})(?=\s*(?:Area:|Stories:|Occupancy|$))',
-            'area': r'Area:\s*(\d[\d,.\s]*?)(?:\s*sqm|\s*sq\.?\s*m|\s*square\s+meters?)?(?=\s*(?:Stories:|Occupancy:|Sprinklers|$))',
-            'stories': r'Stories:\s*(\d+)(?=\s*(?:Occupancy:|Sprinklers:|Alarm|$))',
-            'occupancy': r'Occupancy:\s*([^\n\r]+?)(?=\s*(?:Sprinklers:|Alarm|Coverage|$))',
-            'sprinklers': r'Sprinklers:\s*(Yes|No|Y|N|True|False)(?=\s*(?:Alarm|Coverage|Risk|$))',
-            'alarm_system': r'Alarm\s+System:\s*([^\n\r]+?)(?=\s*(?:Coverage:|Risk:|Financials|$))',
-        }
-        
-        # Extract direct format fields
-        for field, pattern in direct_patterns.items():
-            match = re.search(pattern, text, re.IGNORECASE | re.MULTILINE)
+        for field, pattern in DIRECT_PATTERNS.items():
+            if field in self.data:
+                continue
+            match = pattern.search(text)
             if match:
                 value = match.group(1).strip()
                 logging.debug(f"Direct extraction - {field}: {value}")
-                
-                # Process the value based on field type
-                if field == 'sprinklers':
-                    data[field] = value.lower() in ['yes', 'true', 'y', '1']
-                elif field in ['area', 'stories', 'year_built']:
-                    clean_value = re.sub(r'[^\d.]', '', value)
-                    try:
-                        data[field] = int(clean_value) if clean_value.isdigit() else value
-                    except ValueError:
-                        data[field] = value
-                else:
-                    data[field] = value
-            else:
-                logging.debug(f"Direct extraction - {field}: NOT FOUND")
+                self.data[field] = FIELDS_BY_NAME[field].coerce(value)
         
         # PHASE 2: Extract sectioned format (Coverage:, Risk:, Financials:)
-        sectioned_patterns = {
-            # Coverage section
-            'building_value': r'Coverage:.*?[-•]\s*Building\s+Value:\s*\$?\s*(\d[\d,.]*)',
-            'contents_value': r'Coverage:.*?[-•]\s*Contents\s+Value:\s*\$?\s*(\d[\d,.]*)',
-            'business_interruption': r'Coverage:.*?[-•]\s*Business\s+Interruption:\s*\$?\s*(\d[\d,.]*)',
-            'deductible': r'Coverage:.*?[-•]\s*Deductible:\s*\$?\s*(\d[\d,.]*)',
-            
-            # Risk section
-            'fire_hazards': r'Risk:.*?[-•]\s*Fire\s+Hazards:\s*([^\n\r]+?)(?=\s*[-•]|\s*\n[A-Z]|\s*$)',
-            'natural_disasters': r'Risk:.*?[-•]\s*Natural\s+Disasters:\s*([^\n\r]+?)(?=\s*[-•]|\s*\n[A-Z]|\s*$)',
-            'security': r'Risk:.*?[-•]\s*Security:\s*([^\n\r]+?)(?=\s*[-•]|\s*\n[A-Z]|\s*$)',
-            
-            # Financials section
-            'property_valuation': r'Financials:.*?[-•]\s*Property\s+Valuation:\s*\$?\s*(\d[\d,.]*)',
-            'annual_revenue': r'Financials:.*?[-•]\s*Annual\s+Revenue:\s*\$?\s*(\d[\d,.]*)'
-        }
-        
-        # Extract sectioned fields using multiline regex with DOTALL flag
-        for field, pattern in sectioned_patterns.items():
-            match = re.search(pattern, text, re.IGNORECASE | re.DOTALL)
+        for field, pattern in SECTIONED_PATTERNS.items():
+            if field in self.data:
+                continue
+            if FIELDS_BY_NAME[field].section in self.sections_seen:
+                pattern = BULLET_PATTERNS[field]
+            match = pattern.search(text)
             if match:
-                value = match.group(1).strip()
-                
-                # Handle monetary values
-                if field in ['building_value', 'contents_value', 'business_interruption', 
-                            'deductible', 'property_valuation', 'annual_revenue']:
-                    # Remove commas and dollar signs, keep only digits and decimal points
-                    clean_value = re.sub(r'[^\d.]', '', value)
-                    try:
-                        data[field] = float(clean_value) if '.' in clean_value else int(clean_value)
-                    except ValueError:
-                        data[field] = value  # Keep original if conversion fails
-                else:
-                    data[field] = value
+                self.data[field] = FIELDS_BY_NAME[field].coerce(match.group(1).strip())
+        for section, pattern in SECTION_HEADER_PATTERNS.items():
+            if section not in self.sections_seen and pattern.search(text):
+                self.sections_seen.add(section)
+        
+        # PHASE 3: Keep the line-by-line fallback up to date for any missed fields
+        self.current_section = parse_fallback_pdf_lines(text, self.current_section, self.fallback_data)
+
+    def result(self):
+        """Return the validated fields extracted so far, in schema order"""
+        data = {field: self.data[field] for field in FIELDS_BY_NAME if field in self.data}
         
-        # PHASE 3: Fallback line-by-line parsing for any missed fields
-        if len(data) < 15:  # If we haven't found most fields, try line-by-line
-            logging.info("Trying fallback line-by-line extraction")
-            fallback_data = extract_fallback_pdf_fields(text)
+        if len(data) < 15:  # If we haven't found most fields, use the line-by-line results
+            logging.info("Using fallback line-by-line extraction")
             
             # Merge fallback data (don't overwrite existing good data)
-            for key, value in fallback_data.items():
+            for key, value in self.fallback_data.items():
                 if key not in data or not data[key]:
                     data[key] = value
         
         # PHASE 4: Final validation and cleanup
-        data = validate_pdf_data(data)
-        
-        logging.info(f"Extracted {len(data)} fields from PDF")
-        for key, value in data.items():
-            logging.info(f"  {key}: {value}")
-            
-        return data
-    
-    except Exception as e:
-        logging.error(f"Error extracting data from PDF: {str(e)}")
-        import traceback
-        logging.error(f"Exception traceback: {traceback.format_exc()}")
-        return {}
+        return validate_pdf_data(data)
 
 def clean_pdf_text(text):
-    """Clean and normalize PDF text for better parsing"""
-    # CRITICAL FIX: Add line breaks before field labels when they're concatenated
-    field_labels = [
-        'Insured:', 'Address:', 'Building Type:', 'Construction:', 'Year Built:', 
-        'Area:', 'Stories:', 'Occupancy:', 'Sprinklers:', 'Alarm System:',
-        'Coverage:', 'Risk:', 'Financials:'
-    ]
-    
-    # Add newlines before field labels that are concatenated
-    for label in field_labels:
-        text = re.sub(f'(\\w+)\\s+{re.escape(label)}', f'\\1\n{label}', text)
-    
-    # Normalize line breaks and spacing
-    text = re.sub(r'\r\n?', '\n', text)  # Convert all line breaks to \n
-    text = re.sub(r'[ \t]+', ' ', text)  # Normalize spaces and tabs
-    
-    # Fix common PDF extraction spacing issues
-    text = re.sub(r'([a-z])([A-Z])', r'\1 \2', text)  # Add space between camelCase
-    text = re.sub(r'(\d)([A-Za-z])', r'\1 \2', text)  # Add space between number and letter
-    text = re.sub(r'([A-Za-z])(\d)', r'\1 \2', text)  # Add space between letter and number
-    
-    return text.strip()
+    """Clean and normalize PDF text for better parsing, in a single pass over the text"""
+    return CLEAN_TEXT_RE.sub(clean_text_replacement, text).strip()
+
+def clean_text_replacement(match):
+    return '\n' if match.lastgroup in ('label_break', 'line_break') else ' '
 
 def extract_fallback_pdf_fields(text):
     """Fallback extraction using line-by-line approach for PDF"""
     data = {}
-    
-    lines = text.split('\n')
-    current_section = None
-    
-    for line in lines:
+    parse_fallback_pdf_lines(text, None, data)
+    return data
+
+def parse_fallback_pdf_lines(text, current_section, data):
+    """Line-by-line fallback parsing into data, returning the section the text ends in"""
+    for line in text.split('\n'):
         line = line.strip()
         if not line:
             continue
         
         # Detect sections
-        if line.lower().startswith('coverage:'):
-            current_section = 'coverage'
-            continue
-        elif line.lower().startswith('risk:'):
-            current_section = 'risk'
-            continue
-        elif line.lower().startswith('financials:'):
-            current_section = 'financials'
+        section = next((s for s in SECTIONS if line.lower().startswith(s + ':')), None)
+        if section:
+            current_section = section
             continue
         
         # Parse bullet points within sections
-        bullet_match = re.search(r'^[-•]\s*([^:]+):\s*(.+)$', line)
+        bullet_match = BULLET_LINE_RE.search(line)
         if bullet_match and current_section:
-            key = bullet_match.group(1).strip().lower()
-            value = bullet_match.group(2).strip()
-            
-            # Map field names based on section and key
-            field_mapping = {
-                'coverage': {
-                    'building value': 'building_value',
-                    'contents value': 'contents_value',
-                    'business interruption': 'business_interruption',
-                    'deductible': 'deductible'
-                },
-                'risk': {
-                    'fire hazards': 'fire_hazards',
-                    'natural disasters': 'natural_disasters',
-                    'security': 'security'
-                },
-                'financials': {
-                    'property valuation': 'property_valuation',
-                    'annual revenue': 'annual_revenue'
-                }
-            }
-            
-            if current_section in field_mapping and key in field_mapping[current_section]:
-                field = field_mapping[current_section][key]
-                
-                # Process monetary values
-                if field in ['building_value', 'contents_value', 'business_interruption', 
-                            'deductible', 'property_valuation', 'annual_revenue']:
-                    clean_value = re.sub(r'[^\d.]', '', value)
-                    try:
-                        data[field] = float(clean_value) if '.' in clean_value else int(clean_value)
-                    except ValueError:
-                        data[field] = value
-                else:
-                    data[field] = value
+            field = LABEL_LOOKUP.get((current_section, bullet_match.group(1).strip().lower()))
+            if field:
+                data[field.name] = field.coerce(bullet_match.group(2).strip())
         
         # Also try direct "Key: Value" pattern for any line
         elif ':' in line and not line.startswith('-') and not line.startswith('•'):
-            colon_match = re.search(r'^([^:]+):\s*(.+)$', line)
+            colon_match = COLON_LINE_RE.search(line)
             if colon_match:
-                key = colon_match.group(1).strip().lower()
-                value = colon_match.group(2).strip()
-                
-                # Standard field mapping
-                field_mapping = {
-                    'broker': 'broker',
-                    'insured': 'insured',
-                    'address': 'address',
-                    'building type': 'building_type',
-                    'construction': 'construction',
-                    'year built': 'year_built',
-                    'area': 'area',
-                    'stories': 'stories',
-                    'occupancy': 'occupancy',
-                    'sprinklers': 'sprinklers',
-                    'alarm system': 'alarm_system'
-                }
-                
-                if key in field_mapping:
-                    field = field_mapping[key]
-                    
-                    # Process value based on field type
-                    if field == 'sprinklers':
-                        data[field] = value.lower() in ['yes', 'true', 'y', '1']
-                    elif field in ['area', 'stories', 'year_built']:
-                        clean_value = re.sub(r'[^\d.]', '', value)
-                        try:
-                            data[field] = int(clean_value) if clean_value.isdigit() else value
-                        except ValueError:
-                            data[field] = value
-                    else:
-                        data[field] = value
+                field = LABEL_LOOKUP.get((None, colon_match.group(1).strip().lower()))
+                if field:
+                    data[field.name] = field.coerce(colon_match.group(2).strip())
     
-    return data
+    return current_section
 
 def validate_pdf_data(data):
     """Final validation and cleanup of extracted PDF data"""
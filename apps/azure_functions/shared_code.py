@@ -1,7 +1,19 @@
 import logging
 import os
+import threading
+import time
 import psycopg2
+import requests
+from psycopg2.extras import execute_values
+from requests.adapters import HTTPAdapter
+from azure.core.pipeline.transport import RequestsTransport
+from azure.storage.blob import BlobServiceClient
+from collections import Counter, deque
+from contextlib import contextmanager
 from datetime import datetime
+from field_schema import (
+    SUBMISSION_COLUMNS, SUBMISSION_VALUES_TEMPLATE, INSERT_SUBMISSION_SQL, INSERT_SUBMISSIONS_VALUES_SQL
+)
 
 def is_submission_complete(data):
     """Check if submission data is complete enough to save"""
@@ -23,66 +35,294 @@ def is_submission_complete(data):
         
     return True
 
+class PoolTimeout(Exception):
+    """Raised when no pooled connection becomes available in time"""
+
+class ConnectionPool:
+    """Thread-safe pool of database connections with a hard size limit.
+
+    Idle connections are health-checked before reuse and broken ones are
+    replaced with fresh connections from ``connect``, which can be any
+    zero-argument callable returning a DB-API connection (psycopg2 or a stand-in).
+    """
+
+    def __init__(self, connect, max_size=5, timeout=30, health_check_after=30):
+        self.connect = connect
+        self.max_size = max_size
+        self.timeout = timeout
+        self.health_check_after = health_check_after
+        self._idle = deque()  # (connection, last used) pairs, most recent last
+        self._slots = threading.BoundedSemaphore(max_size)
+        self._lock = threading.Lock()
+
+    def getconn(self):
+        """Check out a healthy connection, opening a new one if none is idle"""
+        if not self._slots.acquire(timeout=self.timeout):
+            raise PoolTimeout(f"No database connection available after {self.timeout}s (max {self.max_size})")
+        try:
+            while True:
+                with self._lock:
+                    idle = self._idle.pop() if self._idle else None
+                if idle is None:
+                    return self.connect()
+                conn, last_used = idle
+                if self._is_healthy(conn, last_used):
+                    return conn
+                logging.warning("Discarding unhealthy pooled database connection")
+                self._close(conn)
+        except Exception:
+            self._slots.release()
+            raise
+
+    def putconn(self, conn, discard=False):
+        """Return a connection to the pool, closing it if it is broken or discarded"""
+        try:
+            if discard or conn.closed:
+                self._close(conn)
+                return
+            try:
+                conn.rollback()  # Never hand out a connection mid-transaction
+            except Exception:
+                self._close(conn)
+                return
+            with self._lock:
+                self._idle.append((conn, time.monotonic()))
+        finally:
+            self._slots.release()
+
+    @contextmanager
+    def connection(self):
+        """Context manager that checks out a connection and always returns it"""
+        conn = self.getconn()
+        try:
+            yield conn
+        except (psycopg2.OperationalError, psycopg2.InterfaceError):
+            self.putconn(conn, discard=True)
+            raise
+        except Exception:
+            self.putconn(conn)
+            raise
+        else:
+            self.putconn(conn)
+
+    def closeall(self):
+        """Close every idle connection"""
+        with self._lock:
+            idle, self._idle = self._idle, deque()
+        for conn, _ in idle:
+            self._close(conn)
+
+    def _is_healthy(self, conn, last_used):
+        if conn.closed:
+            return False
+        if time.monotonic() - last_used < self.health_check_after:
+            return True
+        try:
+            cursor = conn.cursor()
+            cursor.execute("SELECT 1")
+            cursor.close()
+            conn.rollback()
+            return True
+        except Exception:
+            return False
+
+    def _close(self, conn):
+        try:
+            conn.close()
+        except Exception:
+            pass
+
+_pool = None
+_pool_lock = threading.Lock()
+
+def get_connection_pool():
+    """Return the process-wide connection pool, creating it on first use"""
+    global _pool
+    if _pool is None:
+        with _pool_lock:
+            if _pool is None:
+                _pool = ConnectionPool(
+                    connect=lambda: psycopg2.connect(
+                        dbname=os.getenv("PG_DB"),
+                        user=os.getenv("PG_USER"),
+                        password=os.getenv("PG_PASSWORD"),
+                        host=os.getenv("PG_HOST"),
+                        port=os.getenv("PG_PORT"),
+                        sslmode=os.getenv("PG_SSLMODE")
+                    ),
+                    max_size=int(os.getenv("PG_POOL_MAX_SIZE", "5")),
+                    timeout=float(os.getenv("PG_POOL_TIMEOUT", "30")),
+                )
+    return _pool
+
+def set_connection_pool(pool):
+    """Replace the process-wide connection pool (e.g. with one using a stand-in connect)"""
+    global _pool
+    with _pool_lock:
+        if _pool is not None:
+            _pool.closeall()
+        _pool = pool
+
+# Containers used by the submission functions; their clients are cached with the service client
+BLOB_CONTAINERS = ["mailbody", "attachments", "submission-template"]
+
+_blob_service = None
+_container_clients = {}
+_blob_lock = threading.Lock()
+
+def get_blob_service_client():
+    """Return the worker-wide BlobServiceClient, creating it on first use.
+
+    The client and its HTTP session are built once per worker so connections are
+    kept alive and reused across invocations. Works with any connection string
+    in AzureWebJobsStorage, including the local storage emulator
+    ("UseDevelopmentStorage=true").
+    """
+    global _blob_service
+    if _blob_service is None:
+        with _blob_lock:
+            if _blob_service is None:
+                pool_size = int(os.getenv("BLOB_HTTP_POOL_SIZE", "10"))
+                session = requests.Session()
+                adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size)
+                session.mount("https://", adapter)
+                session.mount("http://", adapter)
+                _blob_service = BlobServiceClient.from_connection_string(
+                    os.environ["AzureWebJobsStorage"],
+                    transport=RequestsTransport(session=session, session_owner=False)
+                )
+                for container_name in BLOB_CONTAINERS:
+                    _container_clients[container_name] = _blob_service.get_container_client(container_name)
+    return _blob_service
+
+def get_container_client(container_name):
+    """Return the cached ContainerClient for a container"""
+    container = _container_clients.get(container_name)
+    if container is None:
+        service = get_blob_service_client()
+        with _blob_lock:
+            container = _container_clients.setdefault(container_name, service.get_container_client(container_name))
+    return container
+
 def save_to_database(data):
-    """Save structured data to PostgreSQL database"""
-    try:
-        # Connect to PostgreSQL database
-        conn = psycopg2.connect(
-            dbname=os.getenv("PG_DB"),
-            user=os.getenv("PG_USER"),
-            password=os.getenv("PG_PASSWORD"),
-            host=os.getenv("PG_HOST"),
-            port=os.getenv("PG_PORT"),
-            sslmode=os.getenv("PG_SSLMODE")
-        )
-        cursor = conn.cursor()
-        
-        # Ensure all required fields exist (with NULL values if missing)
-        required_fields = [
-            "broker", "insured", "address", "building_type", "construction", "year_built",
-            "area", "stories", "occupancy", "sprinklers", "alarm_system",
-            "building_value", "contents_value", "business_interruption", "deductible",
-            "fire_hazards", "natural_disasters", "security", "property_valuation",
-            "annual_revenue", "source_file", "submitted_at"
-        ]
-        
-        # Add NULL for missing fields
-        for field in required_fields:
-            if field not in data:
-                data[field] = None
-                
-        # Log data to be inserted
-        for key, value in data.items():
-            logging.info(f"{key}: {value} ({type(value)})")
-        
-        # Insert into database
-        cursor.execute("""
-            INSERT INTO submissions (
-                broker, insured, address, building_type, construction, year_built,
-                area, stories, occupancy, sprinklers, alarm_system,
-                building_value, contents_value, business_interruption, deductible,
-                fire_hazards, natural_disasters, security, property_valuation,
-                annual_revenue, source_file, submitted_at
-            ) VALUES (
-                %(broker)s, %(insured)s, %(address)s, %(building_type)s, %(construction)s,
-                %(year_built)s, %(area)s, %(stories)s, %(occupancy)s, %(sprinklers)s,
-                %(alarm_system)s, %(building_value)s, %(contents_value)s,
-                %(business_interruption)s, %(deductible)s, %(fire_hazards)s,
-                %(natural_disasters)s, %(security)s, %(property_valuation)s,
-                %(annual_revenue)s, %(source_file)s, %(submitted_at)s
+    """Save structured data to PostgreSQL database.
+
+    The insert is idempotent on (source_file, content_hash): returns "inserted"
+    for a new row, "existing" if the same blob was already saved, or None on error.
+    """
+    # Add NULL for missing fields
+    for field in SUBMISSION_COLUMNS:
+        if field not in data:
+            data[field] = None
+            
+    # Log data to be inserted
+    for key, value in data.items():
+        logging.info(f"{key}: {value} ({type(value)})")
+    
+    # Retry once on a dropped connection; the broken one is discarded by the pool.
+    # Once the INSERT has been sent the row may already be stored (e.g. the
+    # connection was lost during commit), so it is only sent again when the
+    # content_hash makes it idempotent; a statement timeout is never retried.
+    for attempt in range(2):
+        sent = False
+        try:
+            with get_connection_pool().connection() as conn:
+                with conn.cursor() as cursor:
+                    sent = True
+                    cursor.execute(INSERT_SUBMISSION_SQL, data)
+                    status = "inserted" if cursor.fetchone() else "existing"
+                conn.commit()
+            
+            if status == "inserted":
+                logging.info("Successfully inserted submission data into database")
+            else:
+                logging.info(f"Submission from {data['source_file']} already exists, nothing inserted")
+            return status
+        except (psycopg2.OperationalError, psycopg2.InterfaceError) as e:
+            retryable = not isinstance(e, psycopg2.extensions.QueryCanceledError) and (
+                not sent or data["content_hash"] is not None
             )
-        """, data)
-        conn.commit()
-        
-        logging.info("Successfully inserted submission data into database")
-        return True
+            if attempt == 0 and retryable:
+                logging.warning(f"Database connection error, retrying with a new connection: {str(e)}")
+                continue
+            logging.error(f"Database error: {str(e)}")
+            import traceback
+            logging.error(f"Traceback: {traceback.format_exc()}")
+            return None
+        except Exception as e:
+            logging.error(f"Database error: {str(e)}")
+            import traceback
+            logging.error(f"Traceback: {traceback.format_exc()}")
+            return None
+
+def save_submissions_batch(submissions, page_size=500):
+    """Save many submissions in a single transaction and report each row's outcome.
+
+    Rows are written with multi-row INSERTs of up to ``page_size`` rows. A page
+    that fails is rolled back to its savepoint and retried row by row, so a bad
+    row is reported as failed without sinking the rest of the batch. Rows whose
+    (source_file, content_hash) is already stored are skipped as "existing".
+    Returns one {"index", "source_file", "status", "error"} dict per submission.
+    """
+    rows = [{column: submission.get(column) for column in SUBMISSION_COLUMNS} for submission in submissions]
+    results = [
+        {"index": i, "source_file": row["source_file"], "status": "pending", "error": None}
+        for i, row in enumerate(rows)
+    ]
+    
+    try:
+        with get_connection_pool().connection() as conn:
+            with conn.cursor() as cursor:
+                for start in range(0, len(rows), page_size):
+                    page = rows[start:start + page_size]
+                    cursor.execute("SAVEPOINT submissions_page")
+                    try:
+                        inserted_keys = Counter(execute_values(
+                            cursor, INSERT_SUBMISSIONS_VALUES_SQL, page,
+                            template=SUBMISSION_VALUES_TEMPLATE, page_size=len(page), fetch=True
+                        ))
+                        cursor.execute("RELEASE SAVEPOINT submissions_page")
+                        for row, result in zip(page, results[start:start + page_size]):
+                            # Only the first of several identical rows in a page is inserted
+                            key = (row["source_file"], row["content_hash"])
+                            if inserted_keys[key]:
+                                inserted_keys[key] -= 1
+                                result["status"] = "inserted"
+                            else:
+                                result["status"] = "existing"
+                    except (psycopg2.OperationalError, psycopg2.InterfaceError):
+                        raise
+                    except psycopg2.Error as e:
+                        logging.warning(f"Batch page at row {start} failed, retrying row by row: {str(e)}")
+                        cursor.execute("ROLLBACK TO SAVEPOINT submissions_page")
+                        for i, row in enumerate(page, start):
+                            insert_row_with_savepoint(cursor, row, results[i])
+            conn.commit()
     except Exception as e:
-        logging.error(f"Database error: {str(e)}")
+        logging.error(f"Database error during batch insert: {str(e)}")
         import traceback
         logging.error(f"Traceback: {traceback.format_exc()}")
-        return False
-    finally:
-        if 'conn' in locals():
-            if 'cursor' in locals():
-                cursor.close()
-            conn.close()
\ No newline at end of file
+        for result in results:
+            result["status"] = "failed"
+            result["error"] = result["error"] or str(e)
+    
+    counts = Counter(result["status"] for result in results)
+    logging.info(
+        f"Batch insert complete: {counts['inserted']} inserted, {counts['existing']} already present, "
+        f"{counts['failed']} failed"
+    )
+    return results
+
+def insert_row_with_savepoint(cursor, row, result):
+    """Insert a single row inside its own savepoint, recording the outcome in result"""
+    cursor.execute("SAVEPOINT submissions_row")
+    try:
+        cursor.execute(INSERT_SUBMISSION_SQL, row)
+        result["status"] = "inserted" if cursor.fetchone() else "existing"
+        cursor.execute("RELEASE SAVEPOINT submissions_row")
+    except (psycopg2.OperationalError, psycopg2.InterfaceError):
+        raise
+    except psycopg2.Error as e:
+        cursor.execute("ROLLBACK TO SAVEPOINT submissions_row")
+        result["status"] = "failed"
+        result["error"] = str(e)
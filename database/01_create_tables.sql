@@ -37,13 +37,17 @@ CREATE TABLE submissions (
     "property_valuation" VARCHAR(255) NOT NULL,
     "annual_revenue" VARCHAR(255) NOT NULL, 
     "source_file" VARCHAR(255) NOT NULL, 
+    "content_hash" VARCHAR(64), -- SHA-256 of the source blob, NULL for rows created before it was recorded
     "submitted_at" DATE NOT NULL,
     "created_at" TIMESTAMP WITH TIME ZONE DEFAULT CURRENT_TIMESTAMP,
     "updated_at" TIMESTAMP WITH TIME ZONE DEFAULT CURRENT_TIMESTAMP,
     "workflow_stage" VARCHAR(255) NOT NULL DEFAULT 'extraction',
     "submission_status" VARCHAR(255) NOT NULL DEFAULT 'pending',
     "priority_level" VARCHAR(255) NOT NULL DEFAULT 'medium',
-    "check_status" VARCHAR(255) NOT NULL DEFAULT 'pending'
+    "check_status" VARCHAR(255) NOT NULL DEFAULT 'pending',
+    "claimed_by" VARCHAR(255), -- stage worker currently processing the submission, NULL when unclaimed
+    "claimed_at" TIMESTAMP WITH TIME ZONE, -- lease start while claimed; earliest retry once a failed attempt is released
+    "stage_attempts" INTEGER NOT NULL DEFAULT 0 -- failed attempts at the current workflow_stage
 );
 
 
@@ -130,13 +134,23 @@ CREATE TABLE audit_log (
     created_at TIMESTAMP WITH TIME ZONE DEFAULT CURRENT_TIMESTAMP
 );
 
+-- Extraction cache table (parsed submission data keyed by extractor version and content hash)
+CREATE TABLE extraction_cache (
+    cache_key VARCHAR(100) PRIMARY KEY,
+    data JSONB NOT NULL,
+    created_at TIMESTAMP WITH TIME ZONE DEFAULT CURRENT_TIMESTAMP
+);
+
 -- Create indexes for better performance
 CREATE INDEX idx_submissions_stage ON submissions(stage);
 CREATE INDEX idx_submissions_status ON submissions(status);
 CREATE INDEX idx_submissions_submission_date ON submissions("submissionDate");
 CREATE INDEX idx_submissions_reference ON submissions(reference);
+CREATE UNIQUE INDEX uq_submissions_source_content ON submissions(source_file, content_hash);
+CREATE INDEX idx_submissions_workflow_stage_queue ON submissions(workflow_stage, submitted_at, created_at);
 CREATE INDEX idx_missing_data_submission_id ON missing_data_items("submissionId");
 CREATE INDEX idx_duplicate_info_submission_id ON duplicate_info("submissionId");
+CREATE UNIQUE INDEX uq_duplicate_info_submission_original ON duplicate_info("submissionId", "originalSubmissionId");
 CREATE INDEX idx_compliance_checks_submission_id ON compliance_checks("submissionId");
 CREATE INDEX idx_guideline_checks_submission_id ON guideline_checks("submissionId");
 CREATE INDEX idx_pending_actions_priority ON pending_actions(priority);
@@ -0,0 +1,8 @@
+-- Idempotent submission writes
+-- Adds the content hash column and unique key used by save_to_database's
+-- INSERT ... ON CONFLICT. Safe to run on a database created from an earlier
+-- 01_create_tables.sql and to re-run.
+
+ALTER TABLE submissions ADD COLUMN IF NOT EXISTS "content_hash" VARCHAR(64);
+
+CREATE UNIQUE INDEX IF NOT EXISTS uq_submissions_source_content ON submissions(source_file, content_hash);
@@ -0,0 +1,9 @@
+-- Stage-run job queue
+-- Adds the lease columns used by the agentic stage workers to claim
+-- submissions (SELECT ... FOR UPDATE SKIP LOCKED by workflow_stage) and the
+-- index that makes the claim query cheap. Safe to re-run.
+
+ALTER TABLE submissions ADD COLUMN IF NOT EXISTS "claimed_by" VARCHAR(255);
+ALTER TABLE submissions ADD COLUMN IF NOT EXISTS "claimed_at" TIMESTAMP WITH TIME ZONE;
+
+CREATE INDEX IF NOT EXISTS idx_submissions_workflow_stage_queue ON submissions(workflow_stage, submitted_at, created_at);
@@ -0,0 +1,10 @@
+-- Extraction cache table
+-- Persistent tier of the extraction cache (EXTRACTION_CACHE_STORE=postgres):
+-- parsed email/PDF data keyed by content hash and extractor version. Safe to
+-- run on a database created from an earlier 01_create_tables.sql and to re-run.
+
+CREATE TABLE IF NOT EXISTS extraction_cache (
+    cache_key VARCHAR(100) PRIMARY KEY,
+    data JSONB NOT NULL,
+    created_at TIMESTAMP WITH TIME ZONE DEFAULT CURRENT_TIMESTAMP
+);
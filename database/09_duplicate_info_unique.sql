@@ -0,0 +1,13 @@
+-- Unique duplicate links
+-- A stage 2 run that is retried, or whose lease is lost and reclaimed, records
+-- the same duplicate again. Removes repeated ("submissionId",
+-- "originalSubmissionId") rows, keeping the first, and adds the unique index
+-- used by save_duplicate_info's INSERT ... ON CONFLICT DO NOTHING. Safe to re-run.
+
+DELETE FROM duplicate_info later
+USING duplicate_info earlier
+WHERE later."submissionId" = earlier."submissionId"
+  AND later."originalSubmissionId" = earlier."originalSubmissionId"
+  AND (later.created_at, later.id) > (earlier.created_at, earlier.id);
+
+CREATE UNIQUE INDEX IF NOT EXISTS uq_duplicate_info_submission_original ON duplicate_info("submissionId", "originalSubmissionId");
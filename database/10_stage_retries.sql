@@ -0,0 +1,6 @@
+-- Stage job retries
+-- Adds the count of failed attempts at a submission's current workflow_stage.
+-- The stage workers back off before retrying a failed submission and move it
+-- to workflow_stage 'failed' after STAGE_MAX_ATTEMPTS failures. Safe to re-run.
+
+ALTER TABLE submissions ADD COLUMN IF NOT EXISTS "stage_attempts" INTEGER NOT NULL DEFAULT 0;
@@ -54,6 +54,11 @@ run_sql_file "02_insert_dummy_data.sql" "Dummy data insertion"
 run_sql_file "03_create_views.sql" "View creation"
 run_sql_file "04_create_functions.sql" "Function creation"
 run_sql_file "05_setup_permissions.sql" "Permission setup"
+run_sql_file "06_idempotent_submissions.sql" "Idempotent submissions migration"
+run_sql_file "07_stage_queue.sql" "Stage queue migration"
+run_sql_file "08_extraction_cache.sql" "Extraction cache migration"
+run_sql_file "09_duplicate_info_unique.sql" "Duplicate info unique index migration"
+run_sql_file "10_stage_retries.sql" "Stage retries migration"
 
 echo -e "${GREEN}✓ Database setup completed successfully!${NC}"
 echo -e "${YELLOW}Next steps:${NC}"
@@ -0,0 +1,74 @@
+import os
+import re
+import sys
+import random
+import logging
+import timeit
+from PyPDF2 import PdfReader
+
+sys.path.insert(0, "apps/azure_functions")
+from process_pdf_attachment import clean_pdf_text
+
+# Configure logging
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+logger = logging.getLogger(__name__)
+
+def legacy_clean_pdf_text(text):
+    """Previous multi-pass clean_pdf_text, kept as the reference implementation"""
+    field_labels = [
+        'Insured:', 'Address:', 'Building Type:', 'Construction:', 'Year Built:',
+        'Area:', 'Stories:', 'Occupancy:', 'Sprinklers:', 'Alarm System:',
+        'Coverage:', 'Risk:', 'Financials:'
+    ]
+    for label in field_labels:
+        text = re.sub(f'(\\w+)\\s+{re.escape(label)}', f'\\1\n{label}', text)
+    text = re.sub(r'\r\n?', '\n', text)
+    text = re.sub(r'[ \t]+', ' ', text)
+    text = re.sub(r'([a-z])([A-Z])', r'\1 \2', text)
+    text = re.sub(r'(\d)([A-Za-z])', r'\1 \2', text)
+    text = re.sub(r'([A-Za-z])(\d)', r'\1 \2', text)
+    return text.strip()
+
+def build_corpus(pdf_path, samples=2000, seed=0):
+    """Regression corpus: every page of the guidelines PDF plus synthetic broker text"""
+    corpus = []
+    if os.path.exists(pdf_path):
+        corpus.extend(page.extract_text() for page in PdfReader(pdf_path).pages)
+        logger.info(f"Loaded {len(corpus)} pages from {pdf_path}")
+    else:
+        logger.warning(f"PDF not found at {pdf_path}, using synthetic text only")
+
+    tokens = [
+        'Broker:', 'Insured:', 'Address:', 'Building Type:', 'Building  Type:', 'Construction:', 'Year Built:',
+        'Area:', 'Stories:', 'Occupancy:', 'Sprinklers:', 'Alarm System:', 'Coverage:', 'Risk:', 'Financials:',
+        'GreenTech Solutions Ltd', 'SteelFrame', '780sqm', 'EC1A1BB', '$2,000,000', '- Building Value:', '•',
+        'Yes', 'No', ' ', '  ', '\t', '\r\n', '\r', '\n', '\xa0', 'é', '٣'
+    ]
+    rng = random.Random(seed)
+    for _ in range(samples):
+        corpus.append(''.join(rng.choice(tokens) for _ in range(rng.randint(0, 80))))
+    return corpus
+
+def benchmark_clean_pdf_text():
+    pdf_path = "experiments/data/stage4/UW Commercial Insurance Manual.pdf"
+    corpus = build_corpus(pdf_path)
+
+    # Regression check: output must be byte-identical to the reference
+    mismatches = [text for text in corpus if clean_pdf_text(text) != legacy_clean_pdf_text(text)]
+    if mismatches:
+        logger.error(f"{len(mismatches)} of {len(corpus)} samples differ, first: {mismatches[0][:200]!r}")
+        return False
+    logger.info(f"All {len(corpus)} samples match the reference output")
+
+    # Microbenchmark: whole corpus and one large concatenated document
+    document = "\n".join(corpus)
+    logger.info(f"Timing on {len(corpus)} samples and a {len(document)} character document")
+    for name, function in [("legacy", legacy_clean_pdf_text), ("single-pass", clean_pdf_text)]:
+        per_sample = min(timeit.repeat(lambda: [function(text) for text in corpus], number=1, repeat=5))
+        per_document = min(timeit.repeat(lambda: function(document), number=1, repeat=5))
+        logger.info(f"{name:>12}: corpus {per_sample * 1000:.1f} ms, document {per_document * 1000:.1f} ms")
+
+    return True
+
+if __name__ == "__main__":
+    sys.exit(0 if benchmark_clean_pdf_text() else 1)
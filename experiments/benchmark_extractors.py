@@ -0,0 +1,109 @@
+import argparse
+import json
+import logging
+import math
+import sys
+import time
+from collections import Counter
+
+sys.path.insert(0, "apps/azure_functions")
+from process_email_body import extract_data_from_email
+from process_pdf_attachment import extract_data_from_pdf
+from broker_corpus import LAYOUTS, generate_corpus, score_extraction
+
+# Throughput and accuracy of extract_data_from_email and extract_data_from_pdf
+# on the synthetic broker corpus (see broker_corpus.py). For every layout the
+# corpus is generated at increasing scales; each scale reports docs/sec,
+# bytes/sec and field accuracy against the ground truth, and the growth of the
+# time per document against its size is summarised as an exponent
+# (1.0 = linear). Run from the repository root:
+#
+#   python experiments/benchmark_extractors.py
+#   python experiments/benchmark_extractors.py --layouts pdf_many_pages --scales 1 4 16 --output extractors.json
+
+# The extractors log every field at INFO; only this script's lines are shown
+logging.basicConfig(level=logging.WARNING, format='%(asctime)s - %(levelname)s - %(message)s')
+logger = logging.getLogger(__name__)
+logger.setLevel(logging.INFO)
+
+EXTRACTORS = {"email": extract_data_from_email, "pdf": extract_data_from_pdf}
+
+def time_extraction(extract, documents, repeat):
+    """Best wall time over repeat passes of the extractor over the documents, and the last pass's output"""
+    best, outputs = math.inf, []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        outputs = [extract(document.content) for document in documents]
+        best = min(best, time.perf_counter() - start)
+    return best, outputs
+
+def benchmark_layout(layout, scales, count, repeat, seed):
+    kind = LAYOUTS[layout][0]
+    extract = EXTRACTORS[kind]
+    rows = []
+    for scale in scales:
+        # Fewer documents at larger scales keep every run to a similar size
+        documents = generate_corpus(max(3, count // scale), [layout], scale, seed)
+        size = sum(len(document.content) for document in documents)
+        seconds, outputs = time_extraction(extract, documents, repeat)
+
+        correct = fields = exact = 0
+        failures = Counter()
+        for document, extracted in zip(documents, outputs):
+            right, missing, wrong = score_extraction(extracted, document.truth)
+            correct += len(right)
+            fields += len(document.truth)
+            exact += not missing and not wrong
+            failures.update([f"missing {field}" for field in missing] + [f"wrong {field}" for field in wrong])
+
+        rows.append({
+            "scale": scale,
+            "documents": len(documents),
+            "bytes_per_document": size // len(documents),
+            "seconds_per_document": seconds / len(documents),
+            "documents_per_second": round(len(documents) / seconds, 2),
+            "megabytes_per_second": round(size / seconds / 1e6, 3),
+            "field_accuracy": round(correct / fields, 4),
+            "exact_documents": round(exact / len(documents), 4),
+            "failures": dict(failures.most_common(5)),
+        })
+        logger.info(
+            f"{layout:>20} x{scale:<4} {rows[-1]['bytes_per_document']:>9} B/doc "
+            f"{rows[-1]['documents_per_second']:>9.1f} docs/s {rows[-1]['megabytes_per_second']:>8.2f} MB/s "
+            f"accuracy {rows[-1]['field_accuracy']:.3f} exact {rows[-1]['exact_documents']:.2f}"
+            + (f" {rows[-1]['failures']}" if failures else "")
+        )
+
+    first, last = rows[0], rows[-1]
+    growth = None
+    if last["bytes_per_document"] > first["bytes_per_document"]:
+        growth = round(
+            math.log(last["seconds_per_document"] / first["seconds_per_document"])
+            / math.log(last["bytes_per_document"] / first["bytes_per_document"]), 2
+        )
+        logger.info(f"{layout:>20} time per document grows ~ size^{growth}")
+    return {"kind": kind, "scales": rows, "size_exponent": growth}
+
+def benchmark_extractors():
+    parser = argparse.ArgumentParser(description="Benchmark the email and PDF extractors on a synthetic corpus")
+    parser.add_argument("--layouts", nargs="*", choices=list(LAYOUTS), default=list(LAYOUTS))
+    parser.add_argument("--scales", nargs="*", type=int, default=[1, 4, 16])
+    parser.add_argument("--count", type=int, default=64, help="Documents per layout at scale 1")
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", help="Also write the results as JSON")
+    args = parser.parse_args()
+
+    results = {layout: benchmark_layout(layout, args.scales, args.count, args.repeat, args.seed)
+               for layout in args.layouts}
+
+    if args.output:
+        with open(args.output, "w") as file:
+            json.dump(results, file, indent=2, sort_keys=True)
+        logger.info(f"Results written to {args.output}")
+
+    # Every field of every document should be extracted at every scale
+    return all(row["field_accuracy"] == 1.0 for result in results.values() for row in result["scales"])
+
+if __name__ == "__main__":
+    sys.exit(0 if benchmark_extractors() else 1)
@@ -0,0 +1,279 @@
+import random
+import re
+from collections import namedtuple
+
+# Synthetic broker submissions for the email and PDF extractors.
+#
+# Every document is generated from a random submission together with the
+# ground truth the extractors should return for it (values coerced the way
+# field_schema coerces them). Layouts:
+#   email_direct         "Field: value" lines only
+#   email_sectioned      aliases, shuffled fields and Coverage/Risk/Financials
+#                        bullet sections
+#   email_quoted_thread  a sectioned submission above a long quoted thread of
+#                        earlier submissions for other insureds
+#   pdf_template         the submission template laid out one field per line
+#   pdf_concatenated     several fields per line, as text extraction often
+#                        runs them together
+#   pdf_many_pages       cover letter and terms pages first, the submission
+#                        split over the last pages
+# scale grows each document (filler paragraphs, quoted messages or pages), so
+# timings across scales show how the extractors grow with input size.
+
+BrokerDocument = namedtuple("BrokerDocument", ["layout", "kind", "content", "truth"])
+
+DIRECT_FIELDS = [
+    ("broker", "Broker", ["Insurance Broker"]),
+    ("insured", "Insured", ["Client", "Company"]),
+    ("address", "Address", ["Location", "Property Address"]),
+    ("building_type", "Building Type", ["Property Type"]),
+    ("construction", "Construction", []),
+    ("year_built", "Year Built", []),
+    ("area", "Area", ["Square Footage", "Surface Area"]),
+    ("stories", "Stories", ["Floors", "Number of Floors"]),
+    ("occupancy", "Occupancy", []),
+    ("sprinklers", "Sprinklers", []),
+    ("alarm_system", "Alarm System", ["Security System"]),
+]
+
+SECTIONS = [
+    ("Coverage", [
+        ("building_value", "Building Value", []),
+        ("contents_value", "Contents Value", []),
+        ("business_interruption", "Business Interruption", ["BI"]),
+        ("deductible", "Deductible", []),
+    ]),
+    ("Risk", [
+        ("fire_hazards", "Fire Hazards", []),
+        ("natural_disasters", "Natural Disasters", []),
+        ("security", "Security", []),
+    ]),
+    ("Financials", [
+        ("property_valuation", "Property Valuation", []),
+        ("annual_revenue", "Annual Revenue", ["Revenue", "Annual Turnover"]),
+    ]),
+]
+
+# Value vocabularies avoid words the PDF patterns treat as the start of the
+# next label (e.g. "Building", "Year", "Alarm") and hyphens, which start bullets
+COMPANY_WORDS = (
+    ["Green", "North", "Blue", "Silver", "Oak", "River", "Summit", "Harbour", "Coffee", "Atlas", "Bright"],
+    ["Tech", "Haven", "Stone", "Logistics", "Foods", "Works", "Bakery", "Print", "Motors", "Labs", "Textiles"],
+    ["Solutions", "Holdings", "Trading", "Services", "Group", "Partners"],
+    ["Ltd", "Limited", "PLC", "LLP"],
+)
+BROKERS = ["Prime Insurance Brokers", "Marsh Lane Brokers", "Citywide Risk Partners", "Harbour Brokers"]
+STREETS = ["High Street", "Station Road", "Church Lane", "Mill Road", "Park Avenue", "King Street"]
+POSTCODES = ["EC1A 1BB", "SW1A 2AA", "M1 1AE", "B33 8TH", "LS1 4AP", "G1 1XQ", "CF10 1EP"]
+VALUES = {
+    "building_type": ["Commercial Office", "Warehouse", "Retail Unit", "Light Industrial", "Restaurant"],
+    "construction": ["Brick", "Steel Frame", "Reinforced Concrete", "Timber Frame", "Masonry"],
+    "occupancy": ["Office", "Storage and distribution", "Retail shop", "Manufacturing", "Hotel", "Bakery"],
+    "alarm_system": ["Monitored", "Central station", "Local bell", "None"],
+    "fire_hazards": ["None known", "Commercial kitchen", "Flammable storage", "Paint spraying booth"],
+    "natural_disasters": ["Low flood risk", "Flood zone 2", "Subsidence history", "None"],
+    "security": ["CCTV", "Guard on site at night", "Alarm only", "CCTV and access control"],
+}
+FILLER = (
+    "Please let us know if you need any further information about this risk. The client has been with "
+    "their current insurer for several years and is looking for a competitive renewal. Claims experience "
+    "over the last five years has been clean and the premises are well maintained. This message and any "
+    "attachments are confidential and intended solely for the addressee."
+)
+TERMS = (
+    "The insurer shall not be liable for loss arising from wear and tear or gradual deterioration. Cover "
+    "is subject to the premises being occupied and the protections described being maintained in full "
+    "working order. The policy wording prevails over any summary of cover."
+)
+
+def money(rng, low, high, step):
+    return rng.randint(low // step, high // step) * step
+
+def random_submission(rng):
+    """(raw text values, ground truth) of a random submission"""
+    company = " ".join(rng.choice(words) for words in COMPANY_WORDS)
+    values = {
+        "broker": (rng.choice(BROKERS), None),
+        "insured": (company, None),
+        "address": (f"{rng.randint(1, 400)} {rng.choice(STREETS)}, London {rng.choice(POSTCODES)}", None),
+        "year_built": (str(rng.randint(1900, 2022)), int),
+        "stories": (str(rng.randint(1, 20)), int),
+        "sprinklers": (rng.choice(["Yes", "No"]), lambda value: value == "Yes"),
+    }
+    area = rng.randint(100, 50000)
+    values["area"] = (f"{area:,}", lambda value, area=area: area)
+    for field in VALUES:
+        values[field] = (rng.choice(VALUES[field]), None)
+    for field, low, high, step in [
+        ("building_value", 100000, 20000000, 50000), ("contents_value", 10000, 5000000, 10000),
+        ("business_interruption", 50000, 5000000, 50000), ("deductible", 1000, 50000, 500),
+        ("property_valuation", 100000, 30000000, 50000), ("annual_revenue", 100000, 90000000, 100000),
+    ]:
+        amount = money(rng, low, high, step)
+        values[field] = (f"${amount:,}", lambda value, amount=amount: amount)
+    raw = {field: text for field, (text, _) in values.items()}
+    truth = {field: (coerce(text) if coerce else text) for field, (text, coerce) in values.items()}
+    return raw, truth
+
+def label(rng, name, aliases, use_aliases):
+    return rng.choice([name, *aliases]) if use_aliases and aliases else name
+
+def direct_lines(rng, raw, use_aliases=False, shuffle=False):
+    fields = list(DIRECT_FIELDS)
+    if shuffle:
+        rng.shuffle(fields)
+    return [f"{label(rng, name, aliases, use_aliases)}: {raw[field]}" for field, name, aliases in fields]
+
+def section_lines(rng, raw, use_aliases=False, bullet="-"):
+    lines = []
+    for section, fields in SECTIONS:
+        lines.append(f"{section}:")
+        lines.extend(
+            f"{rng.choice(['-', '•']) if bullet is None else bullet} "
+            f"{label(rng, name, aliases, use_aliases)}: {raw[field]}"
+            for field, name, aliases in fields
+        )
+        lines.append("")
+    return lines
+
+def email_header(rng, raw):
+    return [
+        f"From: {raw['broker']} <quotes@example.com>",
+        "To: underwriting@example.com",
+        f"Subject: Property quote request for {raw['insured']}",
+        "",
+        "Dear Underwriter,",
+        "",
+        "Please find below the details of a new property submission.",
+        "",
+    ]
+
+def email_footer(scale):
+    return ["", *([FILLER, ""] * scale), "Kind regards,", "Account Executive"]
+
+def email_direct(rng, scale):
+    raw, truth = random_submission(rng)
+    direct = {field for field, _, _ in DIRECT_FIELDS}
+    lines = email_header(rng, raw) + direct_lines(rng, raw) + email_footer(scale)
+    return "\n".join(lines), {field: value for field, value in truth.items() if field in direct}
+
+def email_sectioned(rng, scale):
+    raw, truth = random_submission(rng)
+    lines = (email_header(rng, raw) + direct_lines(rng, raw, use_aliases=True, shuffle=True) + [""]
+             + section_lines(rng, raw, use_aliases=True, bullet=None) + email_footer(scale))
+    return "\n".join(lines), truth
+
+def email_quoted_thread(rng, scale):
+    text, truth = email_sectioned(rng, 1)
+    lines = text.split("\n")
+    for depth in range(1, 4 * scale + 1):
+        earlier, _ = email_sectioned(rng, 1)
+        prefix = "> " * min(depth, 5)
+        lines.append("")
+        lines.append(f"{prefix}On Mon, 3 Mar 2025 at 09:{depth % 60:02d}, Account Executive wrote:")
+        lines.extend(f"{prefix}{line}" for line in earlier.split("\n"))
+    return "\n".join(lines), truth
+
+def pdf_template(rng, scale):
+    raw, truth = random_submission(rng)
+    lines = ["Property Insurance Submission", ""] + direct_lines(rng, raw) + [""] + section_lines(rng, raw)
+    pages = [lines] + [[TERMS] * 8 for _ in range(scale - 1)]
+    return render_pdf(pages), truth
+
+def pdf_concatenated(rng, scale):
+    raw, truth = random_submission(rng)
+    pairs = direct_lines(rng, raw)
+    lines = ["Property Insurance Submission"]
+    while pairs:
+        count = rng.randint(2, 4)
+        lines.append(rng.choice([" ", ""]).join(pairs[:count]))
+        pairs = pairs[count:]
+    lines += section_lines(rng, raw, bullet="•")
+    pages = [lines] + [[TERMS] * 8 for _ in range(scale - 1)]
+    return render_pdf(pages), truth
+
+def pdf_many_pages(rng, scale):
+    raw, truth = random_submission(rng)
+    pages = [["Cover letter", FILLER, FILLER]] + [[TERMS] * 8 for _ in range(4 * scale)]
+    sections = section_lines(rng, raw)
+    # The Coverage header ends one page and its bullets start the next
+    pages.append(["Property Insurance Submission"] + direct_lines(rng, raw) + [""] + sections[:1])
+    pages.append(sections[1:])
+    return render_pdf(pages), truth
+
+LAYOUTS = {
+    "email_direct": ("email", email_direct),
+    "email_sectioned": ("email", email_sectioned),
+    "email_quoted_thread": ("email", email_quoted_thread),
+    "pdf_template": ("pdf", pdf_template),
+    "pdf_concatenated": ("pdf", pdf_concatenated),
+    "pdf_many_pages": ("pdf", pdf_many_pages),
+}
+
+def generate_document(layout, rng, scale=1):
+    """One BrokerDocument of the layout; content is str for emails and PDF bytes for PDFs"""
+    kind, render = LAYOUTS[layout]
+    content, truth = render(rng, scale)
+    return BrokerDocument(layout, kind, content, truth)
+
+def generate_corpus(count, layouts=None, scale=1, seed=0):
+    """count documents of each layout, reproducible from the seed"""
+    rng = random.Random(seed)
+    return [generate_document(layout, rng, scale) for layout in (layouts or LAYOUTS) for _ in range(count)]
+
+def pdf_escape(text):
+    return text.replace("\\", "\\\\").replace("(", "\\(").replace(")", "\\)")
+
+def render_pdf(pages):
+    """Minimal PDF with one Helvetica text stream per page, from a list of pages of text lines"""
+    bodies = {
+        1: b"<< /Type /Catalog /Pages 2 0 R >>",
+        3: b"<< /Type /Font /Subtype /Type1 /BaseFont /Helvetica /Encoding /WinAnsiEncoding >>",
+    }
+    page_ids = []
+    for lines in pages:
+        page_id = max(bodies) + 1
+        text = "\n".join(["BT /F1 10 Tf 12 TL 40 800 Td", *(f"({pdf_escape(line)}) Tj T*" for line in lines), "ET"])
+        stream = text.encode("cp1252", "replace")
+        bodies[page_id] = (
+            f"<< /Type /Page /Parent 2 0 R /MediaBox [0 0 595 842] "
+            f"/Resources << /Font << /F1 3 0 R >> >> /Contents {page_id + 1} 0 R >>"
+        ).encode("ascii")
+        bodies[page_id + 1] = b"<< /Length %d >>\nstream\n%s\nendstream" % (len(stream), stream)
+        page_ids.append(page_id)
+    kids = " ".join(f"{page_id} 0 R" for page_id in page_ids)
+    bodies[2] = f"<< /Type /Pages /Kids [{kids}] /Count {len(page_ids)} >>".encode("ascii")
+
+    pdf = bytearray(b"%PDF-1.4\n")
+    offsets = {}
+    for number in sorted(bodies):
+        offsets[number] = len(pdf)
+        pdf += b"%d 0 obj\n%s\nendobj\n" % (number, bodies[number])
+    xref = len(pdf)
+    size = max(bodies) + 1
+    pdf += b"xref\n0 %d\n0000000000 65535 f \n" % size
+    pdf += b"".join(b"%010d 00000 n \n" % offsets[number] for number in range(1, size))
+    pdf += b"trailer\n<< /Size %d /Root 1 0 R >>\nstartxref\n%d\n%%%%EOF\n" % (size, xref)
+    return bytes(pdf)
+
+WHITESPACE_RE = re.compile(r"\s+")
+
+def values_match(expected, actual):
+    """Numbers and booleans must be equal; text is compared ignoring whitespace"""
+    if isinstance(expected, bool) or isinstance(actual, bool):
+        return expected is actual
+    if isinstance(expected, (int, float)):
+        return isinstance(actual, (int, float)) and expected == actual
+    return WHITESPACE_RE.sub("", str(expected)) == WHITESPACE_RE.sub("", str(actual))
+
+def score_extraction(extracted, truth):
+    """(correct, missing, wrong) field names of an extraction against its ground truth"""
+    correct, missing, wrong = [], [], []
+    for field, expected in truth.items():
+        if field not in extracted:
+            missing.append(field)
+        elif values_match(expected, extracted[field]):
+            correct.append(field)
+        else:
+            wrong.append(field)
+    return correct, missing, wrong
@@ -0,0 +1,46 @@
+import json
+import sys
+import logging
+import timeit
+
+sys.path.insert(0, "apps/azure_functions")
+from process_email_body import extract_data_from_email
+
+# Configure logging
+logging.basicConfig(level=logging.WARNING, format='%(asctime)s - %(levelname)s - %(message)s')
+logger = logging.getLogger(__name__)
+logger.setLevel(logging.INFO)
+
+# Golden corpus check for extract_data_from_email. Each case of
+# experiments/data/email_golden_corpus.json holds an email body and the output
+# of the extractor before the single-pass rewrite: broker emails (direct,
+# sectioned, quoted threads) plus randomised label/value/section soup. The
+# current extractor must return the same fields, in the same order, with the
+# same value types. Run from the repository root:
+#
+#   python experiments/check_email_golden_corpus.py
+
+def canonical(data):
+    """JSON text of an extraction, so 1, 1.0 and True and the field order all count"""
+    return json.dumps(data, ensure_ascii=False)
+
+def check_email_golden_corpus():
+    corpus_path = "experiments/data/email_golden_corpus.json"
+    with open(corpus_path, "r", encoding="utf-8") as file:
+        cases = json.load(file)["cases"]
+
+    mismatches = [case for case in cases if canonical(extract_data_from_email(case["email"])) != canonical(case["expected"])]
+    if mismatches:
+        first = mismatches[0]
+        logger.error(f"{len(mismatches)} of {len(cases)} emails differ from the golden output, first: {first['email'][:200]!r}")
+        logger.error(f"expected {canonical(first['expected'])}")
+        logger.error(f"got      {canonical(extract_data_from_email(first['email']))}")
+        return False
+    logger.info(f"All {len(cases)} emails match the golden output")
+
+    seconds = min(timeit.repeat(lambda: [extract_data_from_email(case["email"]) for case in cases], number=1, repeat=3))
+    logger.info(f"Corpus extracted in {seconds * 1000:.1f} ms")
+    return True
+
+if __name__ == "__main__":
+    sys.exit(0 if check_email_golden_corpus() else 1)
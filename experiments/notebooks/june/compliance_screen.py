@@ -0,0 +1,282 @@
+import re
+import unicodedata
+from collections import defaultdict, namedtuple
+
+# Deterministic pre-screen for the stage 3 compliance checks.
+#
+# The insured's name is looked up in the D&B, Companies House and internal
+# company datasets through an exact index of normalised names and a trigram
+# index for near matches, and every text field of the submission is scanned
+# for the flagged countries of the internal company check. Checks whose outcome
+# is clear-cut (a flagged country named in an address or country field, no
+# record at all) get their report section here without an LLM call; the others
+# are given only the matched records, e.g. a capital city in an address or a
+# country named in free text ("12 Moscow Road, London", "Cuba libre bar").
+
+# Outcome of one check: a finished report section (the agent is skipped), or
+# None and the reference records the agent should review
+ScreenOutcome = namedtuple("ScreenOutcome", ["report", "records"])
+
+Match = namedtuple("Match", ["record", "score", "address_match"])
+
+# A flagged country found in a text: the flagged-country record, the name that
+# matched (normalised) and whether only its capital city matched
+CountryHit = namedtuple("CountryHit", ["record", "alias", "capital"])
+
+LEGAL_SUFFIXES = {
+    "ltd", "limited", "plc", "llc", "llp", "lp", "inc", "incorporated", "co", "corp",
+    "corporation", "company", "gmbh", "sa", "the",
+}
+
+NON_ALNUM_RE = re.compile(r"[^a-z0-9]+")
+UK_POSTCODE_RE = re.compile(r"\b([A-Z]{1,2}\d[A-Z\d]?)\s*(\d[A-Z]{2})\b", re.IGNORECASE)
+
+# Submission fields (by their last key) that hold an address or a country
+ADDRESS_FIELD_RE = re.compile(r"address|location|country|city|postcode", re.IGNORECASE)
+
+# Other names under which flagged countries appear in addresses
+COUNTRY_ALIASES = {
+    "Democratic People's Republic of Korea": ["North Korea", "DPRK"],
+    "Iran": ["Islamic Republic of Iran"],
+    "Myanmar (Burma)": ["Myanmar", "Burma"],
+    "Russia": ["Russian Federation"],
+    "Democratic Republic of Congo": ["Democratic Republic of the Congo", "DR Congo", "DRC"],
+    "Côte d'Ivoire": ["Ivory Coast"],
+    "Lao People's Democratic Republic": ["Laos"],
+    "Syria": ["Syrian Arab Republic"],
+    "Tanzania": ["United Republic of Tanzania"],
+    "Vietnam": ["Viet Nam"],
+}
+
+# Capitals (and main cities) of flagged countries. They are also street, shop
+# and company names elsewhere, so a match is only passed on for review.
+COUNTRY_CAPITALS = {
+    "Democratic People's Republic of Korea": ["Pyongyang"],
+    "Iran": ["Tehran"],
+    "Myanmar (Burma)": ["Naypyidaw", "Yangon"],
+    "Russia": ["Moscow"],
+    "Belarus": ["Minsk"],
+    "Cuba": ["Havana"],
+    "Democratic Republic of Congo": ["Kinshasa"],
+    "Syria": ["Damascus"],
+    "Venezuela": ["Caracas"],
+}
+
+# FATF statuses that fail the sanctions check outright; anything else flagged
+# (the grey list) needs enhanced due diligence
+FAILING_STATUSES = {"black list", "sanctioned"}
+
+def normalize_text(text):
+    """Lowercase ASCII words separated by single spaces"""
+    text = unicodedata.normalize("NFKD", str(text)).encode("ascii", "ignore").decode("ascii")
+    return NON_ALNUM_RE.sub(" ", text.lower().replace("&", " and ")).strip()
+
+def normalize_name(name):
+    """Normalised company name without legal suffixes, e.g. 'Parsian Evin Hotel Ltd.' -> 'parsian evin hotel'"""
+    words = [word for word in normalize_text(name).split() if word not in LEGAL_SUFFIXES]
+    return " ".join(words)
+
+def trigrams(text):
+    padded = f"  {text} "
+    return {padded[i:i + 3] for i in range(len(padded) - 2)}
+
+def postcode(address):
+    match = UK_POSTCODE_RE.search(address or "")
+    return (match.group(1) + match.group(2)).upper() if match else None
+
+class NameIndex:
+    """Exact and trigram indexes over the company names of a reference dataset"""
+
+    def __init__(self, records, name_fields, address_fields):
+        self.records = records
+        self.address_fields = address_fields
+        self._exact = defaultdict(set)
+        self._postings = defaultdict(set)
+        self._trigrams = {}
+        for i, record in enumerate(records):
+            for field in name_fields:
+                name = normalize_name(record.get(field) or "")
+                if not name:
+                    continue
+                self._exact[name].add(i)
+                grams = trigrams(name)
+                self._trigrams[(i, name)] = grams
+                for gram in grams:
+                    self._postings[gram].add((i, name))
+
+    def _address(self, record):
+        return ", ".join(str(record[field]) for field in self.address_fields if record.get(field))
+
+    def match(self, name, address=None, threshold=0.6):
+        """Records whose name matches exactly (score 1.0) or with trigram similarity >= threshold, best first"""
+        name = normalize_name(name or "")
+        if not name:
+            return []
+        scores = {i: 1.0 for i in self._exact.get(name, ())}
+        if not scores:
+            grams = trigrams(name)
+            shared = defaultdict(int)
+            for gram in grams:
+                for key in self._postings.get(gram, ()):
+                    shared[key] += 1
+            for (i, candidate), count in shared.items():
+                # Dice coefficient of the two trigram sets
+                score = 2 * count / (len(grams) + len(self._trigrams[(i, candidate)]))
+                if score >= threshold and score > scores.get(i, 0.0):
+                    scores[i] = score
+
+        submission_postcode = postcode(address)
+        ranked = []
+        for i, score in scores.items():
+            record_postcode = postcode(self._address(self.records[i]))
+            address_match = submission_postcode is not None and submission_postcode == record_postcode
+            ranked.append((-score, not address_match, i, Match(self.records[i], round(score, 3), address_match)))
+        ranked.sort(key=lambda item: item[:3])
+        return [match for *_, match in ranked]
+
+class CountryMatcher:
+    """Finds flagged countries (by name, alias or capital) in free text"""
+
+    def __init__(self, flagged_countries):
+        self.countries = {}
+        for record in flagged_countries:
+            country = record["Flagged Country"]
+            for alias in COUNTRY_CAPITALS.get(country, []):
+                self.countries[normalize_text(alias)] = (record, True)
+            for alias in [country, *COUNTRY_ALIASES.get(country, [])]:
+                self.countries[normalize_text(alias)] = (record, False)
+        alternation = "|".join(
+            re.escape(alias) for alias in sorted(self.countries, key=len, reverse=True) if alias
+        )
+        self.pattern = re.compile(rf"\b(?:{alternation})\b")
+
+    def find(self, text):
+        """A CountryHit per flagged country mentioned in text, in order of appearance (a name beats a capital)"""
+        found = {}
+        for match in self.pattern.finditer(normalize_text(text)):
+            record, capital = self.countries[match.group(0)]
+            key = record["Flagged Country"]
+            if key not in found or (found[key].capital and not capital):
+                found[key] = CountryHit(record, match.group(0), capital)
+        return list(found.values())
+
+def iter_text_fields(value, path=""):
+    """(dotted path, text) for every string in a nested submission"""
+    if isinstance(value, dict):
+        for key, item in value.items():
+            yield from iter_text_fields(item, f"{path}.{key}" if path else str(key))
+    elif isinstance(value, list):
+        for i, item in enumerate(value):
+            yield from iter_text_fields(item, f"{path}[{i}]")
+    elif isinstance(value, (str, bytes)):
+        yield path, value.decode("utf-8") if isinstance(value, bytes) else value
+
+def is_address_field(path):
+    """Whether the last key of a dotted field path names an address or country field"""
+    key = re.sub(r"\[\d+\]$", "", path).rsplit(".", 1)[-1]
+    return bool(ADDRESS_FIELD_RE.search(key))
+
+def submission_name_and_address(submission):
+    """The insured's name and property address from a broker JSON or a submissions-table row"""
+    name = submission.get("client") or submission.get("insured") or ""
+    property_information = submission.get("property_information") or {}
+    address = property_information.get("location") or submission.get("address") or ""
+    if isinstance(name, bytes):
+        name = name.decode("utf-8")
+    if isinstance(address, bytes):
+        address = address.decode("utf-8")
+    return name, address
+
+class ComplianceScreener:
+    """Pre-screens submissions against the stage 3 reference datasets"""
+
+    def __init__(self, dnb, companies_house, company_database, flagged_countries, threshold=0.6):
+        self.threshold = threshold
+        self.dnb = NameIndex(dnb, ["Company Name"], ["Registered Address", "Country"])
+        self.companies_house = NameIndex(companies_house, ["Company Name"], ["Registered office address"])
+        self.company_database = NameIndex(
+            company_database, ["Client Name", "Insured Name"], ["Address", "City"]
+        )
+        self.countries = CountryMatcher(flagged_countries)
+        self.flagged_country_count = len(flagged_countries)
+
+    def screen(self, submission):
+        """Return a ScreenOutcome per check: "dnb", "sanctions", "companies_house" and "company_database" """
+        name, address = submission_name_and_address(submission)
+        dnb_matches = self.dnb.match(name, address, self.threshold)
+        outcomes = {
+            "dnb": self._registry_outcome(
+                "Dun and Bradstreet", name, dnb_matches,
+                "Needs Additional Information (the company could not be verified)"
+            ),
+            "companies_house": self._registry_outcome(
+                "Companies House", name, self.companies_house.match(name, address, self.threshold),
+                "Needs Additional Information (the company could not be verified)"
+            ),
+            "company_database": self._registry_outcome(
+                "internal company database", name, self.company_database.match(name, address, self.threshold),
+                "Pass (new company, not previously seen)"
+            ),
+        }
+        outcomes["sanctions"] = self._sanctions_outcome(submission, dnb_matches)
+        return outcomes
+
+    def _registry_outcome(self, source, name, matches, not_found_determination):
+        if matches:
+            return ScreenOutcome(None, [match.record for match in matches])
+        return ScreenOutcome(
+            f"Deterministic pre-screen: no {source} record matches the insured \"{name}\" "
+            f"by exact or near name match.\nCompliance determination: {not_found_determination}",
+            []
+        )
+
+    def _sanctions_outcome(self, submission, dnb_matches):
+        hits = []
+        fields = list(iter_text_fields(submission))
+        # The registered address and country of a matched D&B record count too
+        for match in dnb_matches:
+            fields.extend(
+                (f"D&B record {match.record['Company Name']}.{key}", str(match.record[key]))
+                for key in ("Registered Address", "Country") if match.record.get(key)
+            )
+        for path, text in fields:
+            for hit in self.countries.find(text):
+                # Only a country name in an address or country field is conclusive
+                hits.append((hit, path, text, is_address_field(path) and not hit.capital))
+
+        lines = [
+            f"Deterministic sanctions screen of every submission field against the internal "
+            f"flagged-country list ({self.flagged_country_count} countries)."
+        ]
+        if not hits:
+            lines.append("No flagged countries were found.")
+            lines.append("Compliance determination: Pass")
+            return ScreenOutcome("\n".join(lines), [])
+
+        conclusive = [(hit, path, text) for hit, path, text, is_conclusive in hits if is_conclusive]
+        failing = any(hit.record["FATF Status"].lower() in FAILING_STATUSES for hit, _, _ in conclusive)
+        if not failing and len(conclusive) < len(hits):
+            # A capital or a name outside an address may be a street, a shop or
+            # a coincidence: the SanctionCheckAgent reviews every match
+            return ScreenOutcome(None, [
+                {
+                    **hit.record,
+                    "Matched Text": hit.alias,
+                    "Matched As": "capital city" if hit.capital else "country name",
+                    "Submission Field": path,
+                    "Field Text": text,
+                }
+                for hit, path, text, _ in hits
+            ])
+
+        lines.append("Flagged countries found in address or country fields:")
+        for hit, path, text in conclusive:
+            lines.append(
+                f"- {hit.record['Flagged Country']} ({hit.record['FATF Status']}: {hit.record['Reason']}) "
+                f"in {path}: \"{text}\""
+            )
+        lines.append(
+            "Compliance determination: Fail" if failing
+            else "Compliance determination: Needs Additional Information (enhanced due diligence required)"
+        )
+        return ScreenOutcome("\n".join(lines), [])
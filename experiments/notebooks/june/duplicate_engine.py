@@ -0,0 +1,191 @@
+import hashlib
+import os
+from collections import defaultdict, namedtuple
+import numpy as np
+from compliance_screen import normalize_name, normalize_text, postcode, trigrams
+
+# Candidate generation for the stage 2 duplicate check.
+#
+# Every submission is indexed under blocking keys (normalised insured name,
+# postcode, broker) and under the LSH bands of a MinHash signature of its
+# address and occupancy text. A new submission is only compared with the
+# submissions sharing one of its keys or bands, so a lookup touches a handful
+# of rows however large the submissions table grows. Only submissions that came
+# before the new one (see submission_order) are candidates, so the original of a
+# duplicate pair is always the older row. Each candidate gets a
+# 0-100 match confidence; only those between DUPLICATE_CONFIDENCE_LOW and
+# DUPLICATE_CONFIDENCE_HIGH need an LLM to decide.
+
+MINHASH_PERMUTATIONS = 64
+# 16 bands of 4 rows: pairs with a text Jaccard similarity of about 0.5 or
+# more share at least one band with high probability
+LSH_BANDS = 16
+SHINGLE_SIZE = 5
+
+# Blocking keys shared by more submissions than this (a busy broker) are not
+# used to generate candidates
+DUPLICATE_MAX_BLOCK_SIZE = int(os.getenv("DUPLICATE_MAX_BLOCK_SIZE", "500"))
+DUPLICATE_CONFIDENCE_HIGH = int(os.getenv("DUPLICATE_CONFIDENCE_HIGH", "85"))
+DUPLICATE_CONFIDENCE_LOW = int(os.getenv("DUPLICATE_CONFIDENCE_LOW", "50"))
+
+# Weights of the match confidence components (they sum to 1)
+CONFIDENCE_WEIGHTS = {"name": 0.4, "address": 0.2, "postcode": 0.15, "text": 0.15, "broker": 0.1}
+
+SubmissionRecord = namedtuple(
+    "SubmissionRecord", ["id", "broker", "insured", "address", "occupancy", "submitted_at", "source_file", "created_at"]
+)
+Candidate = namedtuple("Candidate", ["record", "confidence", "scores"])
+
+def submission_order(record):
+    """Sort key placing submissions in the order they arrived: submitted_at, then created_at, then id"""
+    return (record.submitted_at, record.created_at, str(record.id))
+
+def shingles(text, size=SHINGLE_SIZE):
+    """Character shingles of the normalised text"""
+    text = normalize_text(text)
+    if len(text) <= size:
+        return {text} if text else set()
+    return {text[i:i + size] for i in range(len(text) - size + 1)}
+
+class MinHasher:
+    """MinHash signatures from a fixed family of multiply-shift hash functions"""
+
+    def __init__(self, num_perm=MINHASH_PERMUTATIONS, seed=1):
+        rng = np.random.default_rng(seed)
+        self.a = rng.integers(1, 2**63, size=num_perm, dtype=np.uint64) * np.uint64(2) + np.uint64(1)
+        self.b = rng.integers(0, 2**63, size=num_perm, dtype=np.uint64)
+
+    def signature(self, shingle_set):
+        if not shingle_set:
+            return np.full(len(self.a), np.iinfo(np.uint32).max, dtype=np.uint32)
+        hashes = np.array(
+            [int.from_bytes(hashlib.blake2b(s.encode("utf-8"), digest_size=4).digest(), "little")
+             for s in shingle_set],
+            dtype=np.uint64,
+        )
+        # (a * x + b) mod 2**64, keeping the high 32 bits
+        with np.errstate(over="ignore"):
+            values = (hashes[:, None] * self.a + self.b) >> np.uint64(32)
+        return values.min(axis=0).astype(np.uint32)
+
+def dice(a, b):
+    """Dice coefficient of two trigram sets"""
+    return 2 * len(a & b) / (len(a) + len(b)) if a or b else 0.0
+
+def text(value):
+    return value.decode("utf-8") if isinstance(value, bytes) else str(value or "")
+
+class DuplicateIndex:
+    """Blocking-key and MinHash LSH index over submissions"""
+
+    def __init__(self, num_perm=MINHASH_PERMUTATIONS, bands=LSH_BANDS, max_block_size=DUPLICATE_MAX_BLOCK_SIZE):
+        self.hasher = MinHasher(num_perm)
+        self.bands = bands
+        self.rows_per_band = num_perm // bands
+        self.max_block_size = max_block_size
+        self.records = {}
+        self.signatures = {}
+        self.names = {}
+        self.addresses = {}
+        self.blocks = defaultdict(set)
+        self.buckets = defaultdict(set)
+
+    def __len__(self):
+        return len(self.records)
+
+    def __contains__(self, submission_id):
+        return str(submission_id) in self.records
+
+    def _blocking_keys(self, record):
+        keys = []
+        name = normalize_name(text(record.insured))
+        if name:
+            keys.append(("name", name))
+        code = postcode(text(record.address))
+        if code:
+            keys.append(("postcode", code))
+        broker = normalize_name(text(record.broker))
+        if broker:
+            keys.append(("broker", broker))
+        return keys
+
+    def _signature(self, record):
+        return self.hasher.signature(shingles(f"{text(record.address)} {text(record.occupancy)}"))
+
+    def _band_keys(self, signature):
+        rows = self.rows_per_band
+        return [(band, signature[band * rows:(band + 1) * rows].tobytes()) for band in range(self.bands)]
+
+    def add(self, record):
+        """Index a submission (re-adding a known id is a no-op)"""
+        submission_id = str(record.id)
+        if submission_id in self.records:
+            return
+        signature = self._signature(record)
+        self.records[submission_id] = record
+        self.signatures[submission_id] = signature
+        self.names[submission_id] = normalize_name(text(record.insured))
+        self.addresses[submission_id] = trigrams(normalize_text(text(record.address)))
+        for key in self._blocking_keys(record):
+            self.blocks[key].add(submission_id)
+        for key in self._band_keys(signature):
+            self.buckets[key].add(submission_id)
+
+    def candidates(self, record, top_n=10):
+        """The top_n earlier indexed submissions most likely to duplicate record, highest confidence first"""
+        signature = self._signature(record)
+        ids = set()
+        for key in self._blocking_keys(record):
+            block = self.blocks.get(key, ())
+            if len(block) <= self.max_block_size:
+                ids.update(block)
+        for key in self._band_keys(signature):
+            ids.update(self.buckets.get(key, ()))
+        order = submission_order(record)
+        ids = {submission_id for submission_id in ids if submission_order(self.records[submission_id]) < order}
+
+        name = normalize_name(text(record.insured))
+        code = postcode(text(record.address))
+        broker = normalize_name(text(record.broker))
+        name_grams = trigrams(name)
+        address_grams = trigrams(normalize_text(text(record.address)))
+        scored = []
+        for submission_id in ids:
+            other = self.records[submission_id]
+            other_name = self.names[submission_id]
+            scores = {
+                "name": 1.0 if name and name == other_name else dice(name_grams, trigrams(other_name)),
+                "address": dice(address_grams, self.addresses[submission_id]),
+                # Estimated Jaccard similarity of the address and occupancy shingles
+                "text": float(np.mean(signature == self.signatures[submission_id])),
+                "postcode": 1.0 if code and code == postcode(text(other.address)) else 0.0,
+                "broker": 1.0 if broker and broker == normalize_name(text(other.broker)) else 0.0,
+            }
+            confidence = round(100 * sum(CONFIDENCE_WEIGHTS[key] * score for key, score in scores.items()))
+            scored.append(Candidate(other, max(0, min(100, confidence)),
+                                    {key: round(score, 3) for key, score in scores.items()}))
+        scored.sort(key=lambda candidate: (-candidate.confidence, str(candidate.record.id)))
+        return scored[:top_n]
+
+def classify(confidence):
+    """'duplicate', 'ambiguous' or 'unique' for a match confidence"""
+    if confidence >= DUPLICATE_CONFIDENCE_HIGH:
+        return "duplicate"
+    if confidence >= DUPLICATE_CONFIDENCE_LOW:
+        return "ambiguous"
+    return "unique"
+
+def candidate_to_dict(candidate):
+    """JSON-serialisable summary of a candidate, as kept in workflow state"""
+    record = candidate.record
+    return {
+        "id": str(record.id),
+        "insured": text(record.insured),
+        "broker": text(record.broker),
+        "address": text(record.address),
+        "occupancy": text(record.occupancy),
+        "submitted_at": str(record.submitted_at),
+        "source_file": text(record.source_file),
+        "matchConfidence": candidate.confidence,
+        "scores": candidate.scores,
+    }
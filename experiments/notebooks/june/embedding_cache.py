@@ -0,0 +1,212 @@
+import asyncio
+import hashlib
+import logging
+import re
+import sqlite3
+import threading
+from array import array
+from concurrent.futures import ThreadPoolExecutor
+from typing import List
+from llama_index.core.base.embeddings.base import BaseEmbedding
+from pydantic import Field, PrivateAttr
+
+# Content-addressed embedding cache for the guideline ingestion pipeline.
+#
+# Vectors are stored as float32 blobs in SQLite, keyed by the embedding model
+# name and the SHA-256 of the text, so re-indexing unchanged chunks makes no
+# embedding calls at all. Misses are sent to the wrapped model in batches of
+# its embed_batch_size, with at most max_concurrency batches in flight.
+
+def text_hash(text):
+    """SHA-256 hex digest of a text"""
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+class EmbeddingStore:
+    """SQLite table of float32 vectors keyed by (model, text hash)"""
+
+    # SQLite limits the number of bound parameters per statement
+    LOOKUP_CHUNK = 500
+
+    def __init__(self, path):
+        self.path = path
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            """CREATE TABLE IF NOT EXISTS embeddings (
+                   model TEXT NOT NULL,
+                   text_hash TEXT NOT NULL,
+                   vector BLOB NOT NULL,
+                   PRIMARY KEY (model, text_hash)
+               )"""
+        )
+        self._conn.commit()
+
+    def get_many(self, model, hashes):
+        """Return {text hash: vector} for the hashes that are stored"""
+        found = {}
+        unique = list(dict.fromkeys(hashes))
+        with self._lock:
+            for start in range(0, len(unique), self.LOOKUP_CHUNK):
+                chunk = unique[start:start + self.LOOKUP_CHUNK]
+                placeholders = ", ".join("?" * len(chunk))
+                rows = self._conn.execute(
+                    f"SELECT text_hash, vector FROM embeddings WHERE model = ? AND text_hash IN ({placeholders})",
+                    [model, *chunk]
+                )
+                for hash_, blob in rows:
+                    vector = array("f")
+                    vector.frombytes(blob)
+                    found[hash_] = vector.tolist()
+        return found
+
+    def put_many(self, model, items):
+        """Store (text hash, vector) pairs"""
+        with self._lock:
+            self._conn.executemany(
+                "INSERT OR REPLACE INTO embeddings (model, text_hash, vector) VALUES (?, ?, ?)",
+                [(model, hash_, array("f", vector).tobytes()) for hash_, vector in items]
+            )
+            self._conn.commit()
+
+class CachedEmbedding(BaseEmbedding):
+    """Embedding model wrapper that serves repeated texts from an EmbeddingStore"""
+
+    max_concurrency: int = Field(default=4, description="Maximum embedding batches in flight at once.")
+
+    _embed_model: BaseEmbedding = PrivateAttr()
+    _store: EmbeddingStore = PrivateAttr()
+    _stats_lock: threading.Lock = PrivateAttr()
+    _hits: int = PrivateAttr(default=0)
+    _misses: int = PrivateAttr(default=0)
+
+    def __init__(self, embed_model, cache_path, max_concurrency=4, **kwargs):
+        # Take whole ingestion batches so cache lookups and miss batching happen here
+        super().__init__(
+            model_name=embed_model.model_name,
+            embed_batch_size=2048,
+            max_concurrency=max_concurrency,
+            **kwargs
+        )
+        self._embed_model = embed_model
+        self._store = EmbeddingStore(cache_path)
+        self._stats_lock = threading.Lock()
+
+    @classmethod
+    def class_name(cls) -> str:
+        return "CachedEmbedding"
+
+    @property
+    def stats(self):
+        """Cache hit and miss counts since start-up"""
+        return {"hits": self._hits, "misses": self._misses}
+
+    def _lookup(self, model, texts):
+        hashes = [text_hash(text) for text in texts]
+        found = self._store.get_many(model, hashes)
+        missing = list(dict.fromkeys(
+            (hash_, text) for hash_, text in zip(hashes, texts) if hash_ not in found
+        ))
+        with self._stats_lock:
+            self._hits += len(texts) - len(missing)
+            self._misses += len(missing)
+        if missing:
+            logging.info(f"Embedding cache: {len(texts) - len(missing)} hits, {len(missing)} to embed")
+        return hashes, found, missing
+
+    def _batches(self, missing):
+        size = self._embed_model.embed_batch_size
+        return [missing[start:start + size] for start in range(0, len(missing), size)]
+
+    def _embed_texts(self, model, texts, embed_batch):
+        hashes, found, missing = self._lookup(model, texts)
+        if missing:
+            batches = self._batches(missing)
+            with ThreadPoolExecutor(max_workers=min(self.max_concurrency, len(batches))) as executor:
+                results = executor.map(lambda batch: embed_batch([text for _, text in batch]), batches)
+                for batch, vectors in zip(batches, results):
+                    items = [(hash_, vector) for (hash_, _), vector in zip(batch, vectors)]
+                    self._store.put_many(model, items)
+                    found.update(items)
+        return [found[hash_] for hash_ in hashes]
+
+    async def _aembed_texts(self, model, texts, aembed_batch):
+        hashes, found, missing = await asyncio.to_thread(self._lookup, model, texts)
+        if missing:
+            semaphore = asyncio.Semaphore(self.max_concurrency)
+
+            async def embed(batch):
+                async with semaphore:
+                    vectors = await aembed_batch([text for _, text in batch])
+                items = [(hash_, vector) for (hash_, _), vector in zip(batch, vectors)]
+                await asyncio.to_thread(self._store.put_many, model, items)
+                found.update(items)
+
+            await asyncio.gather(*(embed(batch) for batch in self._batches(missing)))
+        return [found[hash_] for hash_ in hashes]
+
+    # Query embeddings are cached apart from text embeddings because some
+    # models embed queries differently from documents
+
+    def _query_model(self):
+        return f"{self.model_name}:query"
+
+    def _embed_queries(self, queries):
+        return [self._embed_model.get_query_embedding(query) for query in queries]
+
+    async def _aembed_queries(self, queries):
+        return [await self._embed_model.aget_query_embedding(query) for query in queries]
+
+    def _get_query_embedding(self, query: str) -> List[float]:
+        return self._embed_texts(self._query_model(), [query], self._embed_queries)[0]
+
+    async def _aget_query_embedding(self, query: str) -> List[float]:
+        return (await self._aembed_texts(self._query_model(), [query], self._aembed_queries))[0]
+
+    def _get_text_embedding(self, text: str) -> List[float]:
+        return self._get_text_embeddings([text])[0]
+
+    async def _aget_text_embedding(self, text: str) -> List[float]:
+        return (await self._aget_text_embeddings([text]))[0]
+
+    def _get_text_embeddings(self, texts: List[str]) -> List[List[float]]:
+        return self._embed_texts(self.model_name, texts, self._embed_model.get_text_embedding_batch)
+
+    async def _aget_text_embeddings(self, texts: List[str]) -> List[List[float]]:
+        return await self._aembed_texts(self.model_name, texts, self._embed_model.aget_text_embedding_batch)
+
+WORD_RE = re.compile(r"\w+")
+
+class DeterministicEmbedding(BaseEmbedding):
+    """Offline stand-in for the Azure embedding model.
+
+    Each text maps to a normalised hashed bag-of-words vector, so identical
+    texts always get identical vectors and texts sharing words are close.
+    """
+
+    embed_dim: int = Field(default=256, gt=0)
+
+    def __init__(self, embed_dim=256, **kwargs):
+        super().__init__(model_name=f"deterministic-{embed_dim}", embed_dim=embed_dim, **kwargs)
+
+    @classmethod
+    def class_name(cls) -> str:
+        return "DeterministicEmbedding"
+
+    def _embed(self, text):
+        vector = [0.0] * self.embed_dim
+        for word in WORD_RE.findall(text.lower()):
+            digest = hashlib.blake2b(word.encode("utf-8"), digest_size=8).digest()
+            index = int.from_bytes(digest[:4], "little") % self.embed_dim
+            vector[index] += 1.0 if digest[4] & 1 else -1.0
+        norm = sum(value * value for value in vector) ** 0.5
+        return [value / norm for value in vector] if norm else vector
+
+    def _get_query_embedding(self, query: str) -> List[float]:
+        return self._embed(query)
+
+    async def _aget_query_embedding(self, query: str) -> List[float]:
+        return self._embed(query)
+
+    def _get_text_embedding(self, text: str) -> List[float]:
+        return self._embed(text)
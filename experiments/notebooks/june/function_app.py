@@ -20,11 +20,25 @@ from llama_index.core.agent.workflow import (
     ToolCallResult,
     AgentStream,
 )
-from llama_index.core import SimpleDirectoryReader, VectorStoreIndex
 import asyncio
-from azure.storage.blob import BlobServiceClient, BlobClient, ContainerClient
+import copy
+import threading
+import time
+import traceback
+from azure.storage.blob import BlobClient, ContainerClient
 import psycopg2
+import psycopg2.pool
 import datetime
+from guideline_index import GuidelineIndexManager
+from embedding_cache import CachedEmbedding
+from vector_search import DenseRetriever, LlamaIndexRetriever, CachedRetriever
+from compliance_screen import ComplianceScreener, normalize_name, normalize_text, postcode
+from reference_data import ReferenceDataStore, FileSource, BlobSource
+from duplicate_engine import DuplicateIndex, SubmissionRecord, candidate_to_dict, classify
+from stage_queue import StageQueue, pooled_cursor
+from rate_limiter import RateLimitRegistry, rate_limited_clients
+from llm_cache import LLMResponseCache
+from instrumentation import Instrumentation, create_sink
 
 #############################################################################################################################
 # INITIALISE LLM AND EMBEDDING MODELS
@@ -41,8 +55,10 @@ pg_host = os.getenv('PG_HOST')
 pg_port = os.getenv('PG_PORT')
 pg_sslmode = os.getenv('PG_SSLMODE')
 
-# PG database connection
-conn = psycopg2.connect(
+# PG connection pool; each concurrently processed submission borrows its own connection
+db_pool = psycopg2.pool.ThreadedConnectionPool(
+    minconn=1,
+    maxconn=int(os.getenv("PG_POOL_MAX_SIZE", "10")),
     dbname=os.getenv("PG_DB"),
     user=os.getenv("PG_USER"),
     password=os.getenv("PG_PASSWORD"),
@@ -51,6 +67,11 @@ conn = psycopg2.connect(
     sslmode=os.getenv("PG_SSLMODE")
 )
 
+# Stage work queue over the submissions table (see stage_queue.py)
+stage_queue = StageQueue(db_pool)
+# Submissions each stage trigger claims and processes concurrently
+stage_batch_size = int(os.getenv("STAGE_BATCH_SIZE", "4"))
+
 # For Azure OpenAI model
 api_key = os.getenv('AZURE_OPENAI_API_KEY')
 azure_endpoint = os.getenv('AZURE_OPENAI_ENDPOINT')
@@ -64,6 +85,42 @@ embedding_deployment_name = os.getenv('AZURE_EMBEDDING_DEPLOYMENT_NAME')
 # Blob storage connection
 azure_storage_connection_string = os.getenv("AZURE_STORAGE_CONNECTION_STRING")
 
+# Every Azure OpenAI request of this worker goes through the shared rate limiter
+# (see rate_limiter.py): per-deployment requests/min and tokens/min budgets and
+# an adaptive concurrency limit, with 429s retried after Retry-After in the queue
+rate_limits = RateLimitRegistry()
+rate_limits.configure(
+    gpt_deployment_name,
+    requests_per_minute=int(os.getenv("LLM_REQUESTS_PER_MINUTE", "60")),
+    tokens_per_minute=int(os.getenv("LLM_TOKENS_PER_MINUTE", "60000")),
+    max_concurrency=int(os.getenv("LLM_MAX_CONCURRENCY", "8")),
+    latency_target=float(os.getenv("LLM_LATENCY_TARGET", "30")),
+)
+rate_limits.configure(
+    embedding_deployment_name,
+    requests_per_minute=int(os.getenv("EMBEDDING_REQUESTS_PER_MINUTE", "300")),
+    tokens_per_minute=int(os.getenv("EMBEDDING_TOKENS_PER_MINUTE", "300000")),
+    max_concurrency=int(os.getenv("EMBEDDING_MAX_CONCURRENCY", "4")),
+    latency_target=float(os.getenv("EMBEDDING_LATENCY_TARGET", "10")),
+)
+# LLM responses can be recorded and replayed (see llm_cache.py), e.g. to
+# re-run a submission after a downstream fix without paying for the LLM again
+llm_cache_mode = os.getenv("LLM_CACHE_MODE", "off")
+llm_cache = None if llm_cache_mode == "off" else LLMResponseCache(
+    os.getenv("LLM_CACHE_PATH", "../../storage/llm_cache.sqlite"), mode=llm_cache_mode
+)
+# Latency and token spans of the stage runs (see instrumentation.py), exported to
+# the sinks listed in INSTRUMENTATION_SINKS: memory (ring buffer), jsonl and otel
+instrumentation = Instrumentation(*[
+    create_sink(
+        name.strip(),
+        jsonl_path=os.getenv("INSTRUMENTATION_JSONL_PATH", "../../storage/spans.jsonl"),
+        capacity=int(os.getenv("INSTRUMENTATION_BUFFER_SIZE", "10000")),
+    )
+    for name in os.getenv("INSTRUMENTATION_SINKS", "memory").split(",") if name.strip()
+])
+http_client, async_http_client = rate_limited_clients(rate_limits, cache=llm_cache, instrumentation=instrumentation)
+
 # Initialize the LLM and embedding model
 llm = AzureOpenAI(
     model=gpt_model_name,
@@ -71,14 +128,24 @@ llm = AzureOpenAI(
     api_key=api_key,
     azure_endpoint=azure_endpoint,
     api_version=gpt_api_version,
+    http_client=http_client,
+    async_http_client=async_http_client,
+)
+# Embeddings are cached on disk by model and text hash, so re-indexing unchanged
+# guideline chunks makes no embedding calls
+embed_model = CachedEmbedding(
+    AzureOpenAIEmbedding(
+        model=embedding_model_name,
+        deployment_name=embedding_deployment_name,
+        api_key=api_key,
+        azure_endpoint=azure_endpoint,
+        api_version=embedding_api_version,
+        http_client=http_client,
+        async_http_client=async_http_client,
+    ),
+    cache_path=os.getenv("EMBEDDING_CACHE_PATH", "../../storage/embedding_cache.sqlite"),
+    max_concurrency=int(os.getenv("EMBEDDING_MAX_CONCURRENCY", "4")),
 )
-embed_model = AzureOpenAIEmbedding(
-    model=embedding_model_name,
-    deployment_name=embedding_deployment_name,
-    api_key=api_key,
-    azure_endpoint=azure_endpoint,
-    api_version=embedding_api_version,
-)   
 
 Settings.llm = llm
 Settings.embed_model = embed_model
@@ -87,33 +154,82 @@ Settings.embed_model = embed_model
 # USER-DEFINE FUNCTIONS
 #############################################################################################################################
 
+def format_property_template(data: dict) -> str:
+    """Format the submission template as the text the triage agent reads."""
+    result = []
+    for key, value in data.items():
+        if isinstance(value, dict):
+            result.append(f"{key}:")
+            for sub_key, sub_value in value.items():
+                result.append(f"  {sub_key}: {sub_value}")
+        else:
+            result.append(f"{key}: {value}")
+    return "\n".join(result)
+
+def format_reference_records(records: list) -> str:
+    """Format a list of reference records as the text the agents read."""
+    result = []
+    for i, record in enumerate(records):
+        result.append(f"Submission_{i+1}:")
+        for key, value in record.items():
+            result.append(f"  {key}: {value}")
+    return "\n".join(result)
+
+# Reference data read by the tools, loaded once per worker, indexed by the keys
+# the tools query by and reloaded when the file or blob changes
+stage_3_data_dir = "../../data/stage3/"
+
+reference_data = ReferenceDataStore()
+reference_data.register(
+    "property_template",
+    BlobSource(azure_storage_connection_string, "submission-template", "property_quote_submission_template.json"),
+    build=format_property_template,
+)
+reference_data.register(
+    "existing_submissions",
+    FileSource("../../data/submissions/mock_duplicate_submissions.json"),
+    keys={
+        "client": (["client", "client_name"], normalize_name),
+        "postcode": (["property_information.location", "property_details.address"], postcode),
+    },
+)
+reference_data.register(
+    "dnb",
+    FileSource(os.path.join(stage_3_data_dir, "dun&bradstreet.json")),
+    keys={"company": (["Company Name"], normalize_name)},
+)
+reference_data.register(
+    "companies_house",
+    FileSource(os.path.join(stage_3_data_dir, "companyhouse.json")),
+    keys={"company": (["Company Name"], normalize_name)},
+)
+reference_data.register(
+    "company_database",
+    FileSource(os.path.join(stage_3_data_dir, "companydatabase.json")),
+    keys={"company": (["Client Name", "Insured Name"], normalize_name)},
+)
+reference_data.register(
+    "flagged_countries",
+    FileSource(os.path.join(stage_3_data_dir, "internalcompanycheck.json")),
+    keys={"country": (["Flagged Country"], normalize_text)},
+)
+
+async def read_reference_data(name: str):
+    """Return a reference dataset, loading it off the event loop when it is new or changed."""
+    with instrumentation.span("reference", name):
+        return await asyncio.to_thread(reference_data.get, name)
+
 # Stage 1 functions
 
+@instrumentation.tool
 async def read_property_template_data() -> str:
     """Read template from JSON file and return it as text."""
     try:
-        # with open("../../data/submissions/property_quote_submission_template.json", "r") as file:
-        #     data = json.load(file) 
-        blob_service_client = BlobServiceClient.from_connection_string(azure_storage_connection_string)
-        container_name = "submission-template"
-        blob_name = "property_quote_submission_template.json"
-        blob_client = blob_service_client.get_blob_client(container=container_name, blob=blob_name)
-        data = json.loads(blob_client.download_blob().readall())
-                
-        # Convert JSON data to formatted text
-        result = []
-        for key, value in data.items():
-            if isinstance(value, dict):
-                result.append(f"{key}:")
-                for sub_key, sub_value in value.items():
-                    result.append(f"  {sub_key}: {sub_value}")
-            else:
-                result.append(f"{key}: {value}")
-        
-        return "\n".join(result)
+        return await read_reference_data("property_template")
     except Exception as e:
         return f"Error reading JSON file: {str(e)}"
 
+@instrumentation.tool
 async def record_notes(ctx: Context, notes: str, notes_title: str) -> str:
     """Useful for recording notes based on triage. Your input should be notes with a title to save the notes under."""
     current_state = await ctx.get("state")
@@ -123,6 +239,7 @@ async def record_notes(ctx: Context, notes: str, notes_title: str) -> str:
     await ctx.set("state", current_state)
     return "Notes recorded."
 
+@instrumentation.tool
 async def write_email(ctx: Context, email: str) -> str:
     """Useful for writing and updating a report. Your input should be a markdown formatted report section."""
     current_state = await ctx.get("state")
@@ -131,6 +248,7 @@ async def write_email(ctx: Context, email: str) -> str:
     print (f"\n Email content: {email}")
     return "email sent."
 
+@instrumentation.tool
 async def move_to_next_stage() -> str:
     """Useful for writing and updating a report. Your input should be a markdown formatted report section."""
     print("All good -> moving to data duplication check stage")
@@ -138,36 +256,40 @@ async def move_to_next_stage() -> str:
 
 # Stage 2 functions
 
-async def read_existing_submissions() -> str:
-    
-    """Read existing quote submissions stored in JSON format and return it as text."""
+@instrumentation.tool
+async def read_existing_submissions(ctx: Context, client_name: str = "", property_address: str = "") -> str:
+    """Return the existing submissions that may duplicate the new one, with their match confidence, as text."""
     try:
-        with open("../../data/submissions/mock_duplicate_submissions.json", "r") as file:
-            data = json.load(file)
-        # Print the JSON structure for debugging
-        print(f"Found {len(data)} submissions in the database")
-                
-        # If the data is a list of submissions instead of a dictionary
-        if isinstance(data, list):
-            formatted_data = {}
-            for i, submission in enumerate(data):
-                formatted_data[f"Submission_{i+1}"] = submission
-            data = formatted_data
-
-            # Convert JSON data to formatted text
-            result = []
-            for key, value in data.items():
-                if isinstance(value, dict):
-                    result.append(f"{key}:")
-                    for sub_key, sub_value in value.items():
-                        result.append(f"  {sub_key}: {sub_value}")
-                else:
-                    result.append(f"{key}: {value}")
-            
-            return "\n".join(result)
+        state = await ctx.get("state")
+        candidates = state.get("duplicate_candidates")
+        if candidates is not None:
+            # Candidates found by the duplicate engine (see agentic_stage_2)
+            print(f"Found {len(candidates)} candidate duplicate submissions")
+            return format_reference_records(candidates)
+
+        submissions = await read_reference_data("existing_submissions")
+        rows = list(dict.fromkeys([
+            *submissions.lookup("client", client_name),
+            *submissions.lookup("postcode", property_address),
+        ]))
+        print(f"Found {len(rows)} of {len(submissions)} existing submissions matching {client_name}")
+        if not rows:
+            return f"No existing submissions found for client {client_name} or property address {property_address}."
+        return format_reference_records(submissions.records(rows))
     except Exception as e:
         return f"Error reading JSON file: {str(e)}"
+
+@instrumentation.tool
+async def confirm_duplicate(ctx: Context, original_submission_id: str) -> str:
+    """Record that the new submission duplicates the existing submission with the given id."""
+    state = await ctx.get("state")
+    for candidate in state.get("duplicate_candidates") or []:
+        if candidate["id"] == original_submission_id:
+            await asyncio.to_thread(save_duplicate_info, state["submission_id"], candidate)
+            return f"Duplicate of {original_submission_id} recorded with match confidence {candidate['matchConfidence']}."
+    return f"{original_submission_id} is not one of the candidate duplicate submissions."
     
+@instrumentation.tool
 async def record_notes(ctx: Context, notes: str, notes_title: str) -> str:
     """Useful for recording notes based on user ask. Your input should be notes with a title to save the notes under."""
     current_state = await ctx.get("state")
@@ -177,6 +299,7 @@ async def record_notes(ctx: Context, notes: str, notes_title: str) -> str:
     await ctx.set("state", current_state)
     return "Notes recorded."
 
+@instrumentation.tool
 async def write_email(ctx: Context, email: str) -> str:
     """Useful for writing and updating a report. Your input should be a markdown formatted report section."""
     current_state = await ctx.get("state")
@@ -185,6 +308,7 @@ async def write_email(ctx: Context, email: str) -> str:
     print (f"\n Email content: {email}")
     return "email sent."
 
+@instrumentation.tool
 async def move_to_next_stage() -> str:
     """Useful for writing and updating a report. Your input should be a markdown formatted report section."""
     print("All good -> moving to data duplication check stage")
@@ -192,155 +316,51 @@ async def move_to_next_stage() -> str:
 
 # Stage 3 functions
 
-async def read_dun_and_bradstreet() -> str:
-    """Read existing dun and bradstreet sample data in JSON format and return it as text."""
-    try:
-        with open("../../data/stage3/dun&bradstreet.json", "r") as file:
-            data = json.load(file)
-        # Print the JSON structure for debugging
-        print(f"Found {len(data)} submissions in the database")
-                
-        # If the data is a list of submissions instead of a dictionary
-        if isinstance(data, list):
-            formatted_data = {}
-            for i, submission in enumerate(data):
-                formatted_data[f"Submission_{i+1}"] = submission
-            data = formatted_data
-
-            # Convert JSON data to formatted text
-            result = []
-            for key, value in data.items():
-                if isinstance(value, dict):
-                    result.append(f"{key}:")
-                    for sub_key, sub_value in value.items():
-                        result.append(f"  {sub_key}: {sub_value}")
-                else:
-                    result.append(f"{key}: {value}")
-            
-            return "\n".join(result)
-    except Exception as e:
-        return f"Error reading JSON file: {str(e)}"
-    
-async def read_internal_company_check() -> str:
-    
-    """Read internal company check sample data in JSON format and return it as text."""
+async def read_reference_records(ctx: Context, dataset: str, company_name: str = "") -> str:
+    """Return the records the pre-screen matched for this check, else the dataset's records for company_name (all records without one)."""
     try:
-        with open("../../data/stage3/internalcompanycheck.json", "r") as file:
-            data = json.load(file)
-        # Print the JSON structure for debugging
-        print(f"Found {len(data)} submissions in the database")
-                
-        # If the data is a list of submissions instead of a dictionary
-        if isinstance(data, list):
-            formatted_data = {}
-            for i, submission in enumerate(data):
-                formatted_data[f"Submission_{i+1}"] = submission
-            data = formatted_data
-
-            # Convert JSON data to formatted text
-            result = []
-            for key, value in data.items():
-                if isinstance(value, dict):
-                    result.append(f"{key}:")
-                    for sub_key, sub_value in value.items():
-                        result.append(f"  {sub_key}: {sub_value}")
-                else:
-                    result.append(f"{key}: {value}")
-            
-            return "\n".join(result)
+        state = await ctx.get("state")
+        records = state.get("prescreen_records")
+        if records is None:
+            reference = await read_reference_data(dataset)
+            records = reference.find("company", company_name) if company_name else reference.records()
+        print(f"Found {len(records)} {dataset} records")
+        return format_reference_records(records)
     except Exception as e:
         return f"Error reading JSON file: {str(e)}"
 
-async def read_companies_house() -> str:
-    
-    """Read companies house sample data in JSON format and return it as text."""
-    try:
-        with open("../../data/stage3/companyhouse.json", "r") as file:
-            data = json.load(file)
-        # Print the JSON structure for debugging
-        print(f"Found {len(data)} submissions in the database")
-                
-        # If the data is a list of submissions instead of a dictionary
-        if isinstance(data, list):
-            formatted_data = {}
-            for i, submission in enumerate(data):
-                formatted_data[f"Submission_{i+1}"] = submission
-            data = formatted_data
-
-            # Convert JSON data to formatted text
-            result = []
-            for key, value in data.items():
-                if isinstance(value, dict):
-                    result.append(f"{key}:")
-                    for sub_key, sub_value in value.items():
-                        result.append(f"  {sub_key}: {sub_value}")
-                else:
-                    result.append(f"{key}: {value}")
-            
-            return "\n".join(result)
-    except Exception as e:
-        return f"Error reading JSON file: {str(e)}"
-    
-async def read_companies_house() -> str:
-    
-    """Read companies house sample data in JSON format and return it as text."""
-    try:
-        with open("../../data/stage3/companyhouse.json", "r") as file:
-            data = json.load(file)
-        # Print the JSON structure for debugging
-        print(f"Found {len(data)} submissions in the database")
-                
-        # If the data is a list of submissions instead of a dictionary
-        if isinstance(data, list):
-            formatted_data = {}
-            for i, submission in enumerate(data):
-                formatted_data[f"Submission_{i+1}"] = submission
-            data = formatted_data
-
-            # Convert JSON data to formatted text
-            result = []
-            for key, value in data.items():
-                if isinstance(value, dict):
-                    result.append(f"{key}:")
-                    for sub_key, sub_value in value.items():
-                        result.append(f"  {sub_key}: {sub_value}")
-                else:
-                    result.append(f"{key}: {value}")
-            
-            return "\n".join(result)
-    except Exception as e:
-        return f"Error reading JSON file: {str(e)}"
-    
-async def read_company_database() -> str:
+@instrumentation.tool
+async def read_dun_and_bradstreet(ctx: Context, company_name: str = "") -> str:
+    """Read the dun and bradstreet records matching the submission's company and return them as text."""
+    return await read_reference_records(ctx, "dnb", company_name)
+
+@instrumentation.tool
+async def read_internal_company_check(ctx: Context) -> str:
     
-    """Read companies house sample data in JSON format and return it as text."""
+    """Read internal company check sample data in JSON format and return it as text, or the flagged-country matches the pre-screen found in the submission."""
     try:
-        with open("../../data/stage3/companydatabase.json", "r") as file:
-            data = json.load(file)
-        # Print the JSON structure for debugging
-        print(f"Found {len(data)} submissions in the database")
-                
-        # If the data is a list of submissions instead of a dictionary
-        if isinstance(data, list):
-            formatted_data = {}
-            for i, submission in enumerate(data):
-                formatted_data[f"Submission_{i+1}"] = submission
-            data = formatted_data
-
-            # Convert JSON data to formatted text
-            result = []
-            for key, value in data.items():
-                if isinstance(value, dict):
-                    result.append(f"{key}:")
-                    for sub_key, sub_value in value.items():
-                        result.append(f"  {sub_key}: {sub_value}")
-                else:
-                    result.append(f"{key}: {value}")
-            
-            return "\n".join(result)
+        state = await ctx.get("state")
+        records = state.get("prescreen_records")
+        if records is not None:
+            print(f"Found {len(records)} flagged-country matches for review")
+            return format_reference_records(records)
+        flagged_countries = await read_reference_data("flagged_countries")
+        print(f"Found {len(flagged_countries)} flagged countries")
+        return format_reference_records(flagged_countries.records())
     except Exception as e:
         return f"Error reading JSON file: {str(e)}"
 
+@instrumentation.tool
+async def read_companies_house(ctx: Context, company_name: str = "") -> str:
+    """Read the companies house records matching the submission's company and return them as text."""
+    return await read_reference_records(ctx, "companies_house", company_name)
+
+@instrumentation.tool
+async def read_company_database(ctx: Context, company_name: str = "") -> str:
+    """Read the internal company database records matching the submission's company and return them as text."""
+    return await read_reference_records(ctx, "company_database", company_name)
+
+@instrumentation.tool
 async def write_report(ctx: Context, report_content: str, report_section: str) -> str:
     """Useful for writing and updating a report. Your input should be a markdown formatted report section."""
     current_state = await ctx.get("state")
@@ -351,6 +371,7 @@ async def write_report(ctx: Context, report_content: str, report_section: str) -
     await ctx.set("state", current_state)
     return "Report updated."
 
+@instrumentation.tool
 async def write_email(ctx: Context, email: str) -> str:
     """Useful for writing and updating a report. Your input should be a markdown formatted report section."""
     current_state = await ctx.get("state")
@@ -359,6 +380,7 @@ async def write_email(ctx: Context, email: str) -> str:
     print (f"\n Email content: {email}")
     return "email sent."
 
+@instrumentation.tool
 async def move_to_next_stage() -> str:
     """Useful for writing and updating a report. Your input should be a markdown formatted report section."""
     print("All good -> moving to data duplication check stage")
@@ -366,18 +388,48 @@ async def move_to_next_stage() -> str:
 
 # Stage 4 functions
 
-# Load the documents from the directory
-documents = SimpleDirectoryReader(input_dir="../../data/stage4/").load_data()
-index = VectorStoreIndex.from_documents(documents)
-retriever = index.as_retriever(similarity_top_k=5)
-
+# The guideline index is loaded on first search from its persisted copy, so a cold
+# start no longer re-embeds the stage 4 documents. GuidelineIndexManager
+# fingerprints the source documents and only embeds new or modified chunks.
+# GUIDELINES_RETRIEVAL_BACKEND picks how search_documents retrieves: "numpy"
+# (memory-mapped embedding matrix, the default) or "llamaindex" (the default
+# LlamaIndex vector store retriever). Results are cached across submissions
+# by CachedRetriever; when another process (e.g. the ingestion scripts) persists
+# a new index version, the backend is reloaded and the cache invalidated.
+guidelines_data_dir = os.getenv("GUIDELINES_DATA_DIR", "../../data/stage4/")
+guidelines_index_dir = os.getenv("GUIDELINES_INDEX_DIR", "../../storage/stage4_index")
+guidelines_retrieval_backend = os.getenv("GUIDELINES_RETRIEVAL_BACKEND", "numpy")
+guidelines_manager = GuidelineIndexManager(guidelines_data_dir, guidelines_index_dir)
+guidelines_retriever = None
+guidelines_lock = threading.Lock()
+
+def load_guidelines_backend():
+    """Load the configured retrieval backend over the up-to-date guideline index."""
+    if guidelines_retrieval_backend == "llamaindex":
+        return LlamaIndexRetriever(guidelines_manager.load().as_retriever(similarity_top_k=5))
+    return DenseRetriever(guidelines_manager.load_dense(), embed_model, top_k=5)
+
+def get_guidelines_retriever():
+    """Return the cached guideline retriever, (re)loading the persisted index when its version changes."""
+    global guidelines_retriever
+    if guidelines_retriever is None or guidelines_retriever.version != guidelines_manager.current_version():
+        with guidelines_lock:
+            if guidelines_retriever is None:
+                backend = load_guidelines_backend()
+                guidelines_retriever = CachedRetriever(backend, guidelines_manager.current_version())
+            elif guidelines_retriever.version != guidelines_manager.current_version():
+                backend = load_guidelines_backend()
+                guidelines_retriever.reset(backend, guidelines_manager.current_version())
+    return guidelines_retriever
+
+@instrumentation.tool
 async def search_documents(query: str) -> str:
     """Search the PDF documents for information on a given topic."""
-    await asyncio.sleep(1)
-    retrieval_results = retriever.retrieve(query)
-    contexts = [node.text for node in retrieval_results]
+    retriever = await asyncio.to_thread(get_guidelines_retriever)
+    contexts = await retriever.aretrieve(query)
     return "\n\n".join([f"Document chunk {i+1}:\n{context}" for i, context in enumerate(contexts)])
 
+@instrumentation.tool
 async def record_notes(ctx: Context, notes: str, notes_title: str) -> str:
     """Useful for recording notes based on research done on guidelines. Your input should be notes with a title to save the notes under."""
     current_state = await ctx.get("state")
@@ -387,6 +439,7 @@ async def record_notes(ctx: Context, notes: str, notes_title: str) -> str:
     await ctx.set("state", current_state)
     return "Notes recorded."
 
+@instrumentation.tool
 async def write_email(ctx: Context, email: str) -> str:
     """Useful for writing and updating a report. Your input should be a markdown formatted report section."""
     current_state = await ctx.get("state")
@@ -395,6 +448,7 @@ async def write_email(ctx: Context, email: str) -> str:
     print (f"\n Email content: {email}")
     return "email sent."
 
+@instrumentation.tool
 async def move_to_next_stage() -> str:
     """Useful for writing and updating a report. Your input should be a markdown formatted report section."""
     print("All good -> moving to data duplication check stage")
@@ -497,7 +551,7 @@ duplicate_check_agent = FunctionAgent(
 
         Process to follow:
         1. First, read the incoming submission thoroughly
-        2. Use the read_existing_submissions tool to retrieve all existing submissions from our database
+        2. Use the read_existing_submissions tool to retrieve the existing submissions from our database that may match, each with the matchConfidence (0-100) computed by our duplicate engine
         3. Compare the new submission against existing ones, looking for matching criteria such as but not limited to:
             - Client name
             - Property location
@@ -512,6 +566,7 @@ duplicate_check_agent = FunctionAgent(
             - Any discrepancies or differences between submissions that are important to note
 
         5. If you determine this is a duplicate submission:
+            - Use the confirm_duplicate tool with the id of the existing submission it duplicates
             - Clearly state this in your notes
             - Include details on how to reconcile the duplicate submissions
             
@@ -524,7 +579,7 @@ duplicate_check_agent = FunctionAgent(
         Always handover to the EmailAgent, even if you find there is no duplication. The EmailAgent will handle the next steps.
         """),
     llm=llm,
-    tools=[ read_existing_submissions, record_notes],
+    tools=[ read_existing_submissions, record_notes, confirm_duplicate],
     can_handoff_to=["DuplicateCheckEmailAgent"],
 )
 
@@ -589,15 +644,12 @@ dnb_check_agent = FunctionAgent(
             - Provide a clear compliance determination (Pass/Fail/Needs Additional Information)
             - Include specific references to D&B data points reviewed
 
-        5. After completing your analysis, hand over control to the SanctionCheckAgent for further compliance verification
+        5. After writing your report section, finish. The other compliance checks run at the same time as yours, and the CheckEmailAgent reviews all the report sections once they are done.
 
         Do a detailed compliance check of the submission and ensure you are thorough in your review before writing report section.
-        After completing your D&B compliance report section, hand over to the SanctionCheckAgent with your findings for further processing and client communication.
-        Always handover to the SanctionCheckAgent. The SanctionCheckAgent will handle the next steps.
         """),
     llm=llm,
     tools=[read_dun_and_bradstreet, write_report],
-    can_handoff_to=["SanctionCheckAgent"],
 )
 
 sanction_check_agent = FunctionAgent(
@@ -609,7 +661,7 @@ sanction_check_agent = FunctionAgent(
 
         Your responsibilities:
         1. Thoroughly analyze the broker quote submission for any potential sanctions compliance issues
-        2. Use the read_internal_company_check tool to retrieve data about sanctioned countries and entities
+        2. Use the read_internal_company_check tool to retrieve data about sanctioned countries and entities. When the deterministic pre-screen found possible matches (a capital city, or a country named outside an address), the tool returns only those, with the matched text and the submission field it was found in; decide whether each one is a genuine tie to the flagged country
         3. Conduct a comprehensive sanctions compliance check including:
             - Check if the company has operations in sanctioned countries
             - Verify if any company directors or beneficial owners are from sanctioned countries
@@ -617,21 +669,19 @@ sanction_check_agent = FunctionAgent(
             - Assess any business relationships with sanctioned countries
             - Check for any red flags that might indicate sanctions evasion
 
-        4. Review the existing report created by the Dun & Bradstreet agent
-        5. Document your findings using the write_report tool:
+        4. Document your findings using the write_report tool:
             - Create a section titled "Sanctions Compliance Check"
             - Include all verification steps performed
             - Document any potential sanctions violations found
             - Provide a clear compliance determination (Pass/Fail/Needs Additional Information)
             - Include specific references to the sanctioned countries list reviewed
 
-        6. After completing your analysis, hand over control to the CompaniesHouseCheckAgent for further verification
+        5. After writing your report section, finish. The other compliance checks run at the same time as yours, and the CheckEmailAgent reviews all the report sections once they are done.
 
-        Ensure your sanctions check is thorough and rigorous as this is a critical compliance requirement. Always document your reasoning clearly, particularly for any borderline cases. After completing your sanctions compliance report section, hand over to the CompaniesHouseCheckAgent with your findings for further processing.
+        Ensure your sanctions check is thorough and rigorous as this is a critical compliance requirement. Always document your reasoning clearly, particularly for any borderline cases.
         """),
     llm=llm,
     tools=[read_internal_company_check, write_report],
-    can_handoff_to=["CompaniesHouseCheckAgent"],
 )
 
 companies_house_check_agent = FunctionAgent(
@@ -658,13 +708,12 @@ companies_house_check_agent = FunctionAgent(
             - Provide a clear compliance determination (Pass/Fail/Needs Additional Information)
             - Include specific references to Companies House data points reviewed
 
-        5. After completing your analysis, hand over control to the CompanyDatabaseCheckAgent for further verification
+        5. After writing your report section, finish. The other compliance checks run at the same time as yours, and the CheckEmailAgent reviews all the report sections once they are done.
 
-        Ensure your compliance check is thorough and rigorous as this is a critical requirement. Always document your reasoning clearly, particularly for any borderline cases. After completing your Companies House compliance report section, hand over to the CompanyDatabaseCheckAgent with your findings for further processing.
+        Ensure your compliance check is thorough and rigorous as this is a critical requirement. Always document your reasoning clearly, particularly for any borderline cases.
         """),
     llm=llm,
     tools=[ read_companies_house, write_report],
-    can_handoff_to=["CompanyDatabaseCheckAgent"],
 )
 
 company_database_check_agent = FunctionAgent(
@@ -693,13 +742,12 @@ company_database_check_agent = FunctionAgent(
         
         5. If the company is not found in the internal database, you should approve this submission as it is a new company.
 
-        6. After completing your analysis, hand over control to the EmailAgent for further communication with the broker
+        6. After writing your report section, finish. The other compliance checks run at the same time as yours, and the CheckEmailAgent reviews all the report sections once they are done.
 
-        Ensure your compliance check is thorough and rigorous as this is a critical requirement. Always document your reasoning clearly, particularly for any borderline cases. After completing your internal company database compliance report section, hand over to the EmailAgent with your findings for further processing.
+        Ensure your compliance check is thorough and rigorous as this is a critical requirement. Always document your reasoning clearly, particularly for any borderline cases.
         """),
     llm=llm,
     tools=[ read_company_database, write_report],
-    can_handoff_to=["CheckEmailAgent"],
 )
 
 check_email_agent = FunctionAgent(
@@ -803,6 +851,110 @@ research_email_agent = FunctionAgent(
     tools=[write_email, move_to_next_stage]
 )
 
+#############################################################################################################################
+# DEFINE WORKFLOWS
+#############################################################################################################################
+
+# Workflows are built once per worker and shared by all requests. Each run gets its
+# own Context seeded with a copy of the stage's initial state, so concurrent
+# requests never write into each other's notes, reports or emails.
+
+stage_1_workflow = AgentWorkflow(
+    agents=[triage_agent, triage_email_agent],
+    root_agent=triage_agent.name,
+    initial_state={
+        "triage_notes": {},
+        "customer_email": "not drafted yet."
+    },
+)
+
+stage_2_workflow = AgentWorkflow(
+    agents=[duplicate_check_agent, duplicate_check_email_agent],
+    root_agent=duplicate_check_agent.name,
+    initial_state={
+        "triage_notes": {},
+        "customer_email": "not drafted yet."
+    },
+)
+
+stage_2_email_workflow = AgentWorkflow(
+    agents=[duplicate_check_email_agent],
+    root_agent=duplicate_check_email_agent.name,
+    initial_state={
+        "triage_notes": {},
+        "customer_email": "not drafted yet."
+    },
+)
+
+# Stage 3's compliance checks are independent, so each runs as its own single-agent
+# workflow (concurrently, see run_compliance_checks) and the CheckEmailAgent
+# workflow then receives their merged report sections. The last element is the
+# check's key in the deterministic pre-screen (see compliance_screen.py).
+stage_3_checks = [
+    (dnb_check_agent, "Dun and Bradstreet Compliance Check", "dnb"),
+    (sanction_check_agent, "Sanctions Compliance Check", "sanctions"),
+    (companies_house_check_agent, "Companies House Compliance Check", "companies_house"),
+    (company_database_check_agent, "Internal Company Database Compliance Check", "company_database"),
+]
+
+stage_3_check_workflows = {
+    agent.name: AgentWorkflow(
+        agents=[agent],
+        root_agent=agent.name,
+        initial_state={
+            "report_content": {}
+        },
+    )
+    for agent, *_ in stage_3_checks
+}
+
+stage_3_email_workflow = AgentWorkflow(
+    agents=[check_email_agent],
+    root_agent=check_email_agent.name,
+    initial_state={
+        "report_content": {},
+        "customer_email": "not drafted yet."
+    },
+)
+
+stage_4_workflow = AgentWorkflow(
+    agents=[research_agent, research_email_agent],
+    root_agent=research_agent.name,
+    initial_state={
+        "research_notes": {},
+        "customer_email": "not drafted yet."
+    },
+)
+
+async def new_run_context(workflow: AgentWorkflow) -> Context:
+    """Create a per-request Context holding a private copy of the workflow's initial state."""
+    ctx = Context(workflow)
+    await ctx.set("state", copy.deepcopy(workflow.initial_state))
+    return ctx
+
+async def run_stage_jobs(stage: int, process_submission) -> str:
+    """Claim a batch of submissions waiting at a stage, process them concurrently and advance the ones that succeed."""
+    with instrumentation.span("db", "claim", stage=stage):
+        submission_ids = await asyncio.to_thread(stage_queue.claim, stage, stage_batch_size)
+
+    async def run_job(submission_id):
+        # Spans recorded while processing the submission are attributed to its run
+        with instrumentation.run(stage, submission_id):
+            try:
+                await process_submission(submission_id)
+            except Exception as e:
+                logging.error(f"Stage {stage} failed for submission {submission_id}: {str(e)}")
+                logging.error(traceback.format_exc())
+                with instrumentation.span("db", "release"):
+                    await asyncio.to_thread(stage_queue.release, submission_id, stage)
+                return False
+            with instrumentation.span("db", "advance"):
+                return await asyncio.to_thread(stage_queue.advance, submission_id, stage)
+
+    results = await asyncio.gather(*(run_job(submission_id) for submission_id in submission_ids))
+    advanced = sum(results)
+    return f"{advanced} of {len(submission_ids)} claimed submissions processed"
+
 #############################################################################################################################
 # STAGE 1: Agentic Triage and Email Response for Insurance Quote Submission
 #############################################################################################################################
@@ -817,48 +969,35 @@ async def agentic_stage_1(req: func.HttpRequest):
     
     """HTTP trigger function to run the agent workflow for insurance quote submission triage."""
     logging.info('Processing a request to run the agent workflow for insurance quote submission triage.')
-    
-    # Define the agent workflow with the agents and initial state
-    agent_workflow = AgentWorkflow(
-        agents=[triage_agent, triage_email_agent],
-        root_agent=triage_agent.name,
-        initial_state={
-            "triage_notes": {},
-            "customer_email": "not drafted yet."
-        },
-    )
 
-    # Update submissions table with workflow_stage = 'core-data'
-    cursor = conn.cursor()
+    # Claim the submissions waiting for triage and move them to 'core-data' once processed
+    summary = await run_stage_jobs(1, triage_submission)
+    return func.HttpResponse(body = f"Agentic Stage 1 complete: {summary}", status_code = 200)
 
-    # Retrieve submission id
-    cursor.execute(
-        """SELECT id FROM submissions ORDER BY submitted_at DESC LIMIT 1"""
-        )
-    submission_id = cursor.fetchone()[0]
-    logging.info(f"Retrieved submission ID: {submission_id}")
+@instrumentation.timed("db")
+def fetch_submission_row(submission_id: str, columns: str) -> tuple:
+    """Fetch the given columns of one submission."""
+    with pooled_cursor(db_pool) as cursor:
+        cursor.execute(f"""SELECT {columns} FROM submissions WHERE id = %s""", (submission_id,))
+        return cursor.fetchone()
 
-    # Update the submission with workflow_stage = 'core-data'
-    cursor.execute(
-        """UPDATE submissions SET workflow_stage = 'core-data' WHERE id = %s""", (submission_id,)
-        )
-    logging.info("Updated the workflow status")
+async def triage_submission(submission_id: str) -> None:
+    """Run the stage 1 triage workflow on one submission."""
+    logging.info(f"Triaging submission ID: {submission_id}")
+
+    # Run the shared stage 1 workflow with fresh per-request state
+    agent_workflow = stage_1_workflow
+    ctx = await new_run_context(agent_workflow)
 
     # Retrieve submission data
-    cursor.execute("""SELECT "broker", "insured", "address", "building_type", "construction", 
-                "year_built", "area", "stories", "occupancy", "sprinklers", "alarm_system", 
-                "building_value", "contents_value", "business_interruption", "deductible", 
-                "fire_hazards", "natural_disasters", "security", "property_valuation", 
-                "annual_revenue", "source_file", "submitted_at" 
-                FROM submissions ORDER BY submitted_at DESC LIMIT 1""")
-
-    # Fetch the last row from the executed query
-    row = cursor.fetchone()
     fields = ["broker", "insured", "address", "building_type", "construction", 
             "year_built", "area", "stories", "occupancy", "sprinklers", "alarm_system", 
             "building_value", "contents_value", "business_interruption", "deductible", 
             "fire_hazards", "natural_disasters", "security", "property_valuation", 
             "annual_revenue", "source_file", "submitted_at"]
+    row = await asyncio.to_thread(
+        fetch_submission_row, submission_id, ", ".join(f'"{field}"' for field in fields)
+    )
 
     # Create submission data json
     submission_data = {fields[i]: row[i].encode('utf-8') for i in range(len(fields)) if fields[i] != "submitted_at"}
@@ -867,6 +1006,7 @@ async def agentic_stage_1(req: func.HttpRequest):
 
     # Initialize the agent workflow with the user message
     handler = agent_workflow.run(
+        ctx=ctx,
         user_msg=(
             f"""
             Please triage the following property insurance quote submission from a broker:
@@ -883,6 +1023,7 @@ async def agentic_stage_1(req: func.HttpRequest):
 
     try:
         async for event in handler.stream_events():
+            instrumentation.observe(event)
             if (
                 hasattr(event, "current_agent_name")
                 and event.current_agent_name != current_agent
@@ -931,81 +1072,159 @@ async def agentic_stage_1(req: func.HttpRequest):
     # cursor.execute("""UPDATE submissions SET submission_status = %s, updated_at = %s WHERE id = %s""", (submission_status, current_time, submission_id))
     # cursor.close()
 
-    return func.HttpResponse(body = "Agentic Stage 1 complete", status_code = 200)
-
 #############################################################################################################################
 # STAGE 2: AGENTIC DUPLICATE CHECK FOR INSURANCE QUOTE SUBMISSION
 #############################################################################################################################
 
+# Existing submissions indexed for duplicate candidate generation (see
+# duplicate_engine.py); loaded once, then topped up with newly created rows
+duplicate_index = DuplicateIndex()
+duplicate_index_created_at = None
+duplicate_index_lock = threading.Lock()
+
+# created_at is set when the inserting transaction starts, so a row can become
+# visible after rows with a later created_at have already been read. Each top-up
+# re-reads this many seconds behind the newest created_at seen; it must be longer
+# than any transaction that inserts submissions.
+duplicate_index_rescan_seconds = float(os.getenv("DUPLICATE_INDEX_RESCAN_SECONDS", "300"))
+
+# Number of candidates scored per submission
+duplicate_top_n = int(os.getenv("DUPLICATE_TOP_N", "5"))
+
+submission_record_columns = '"id", "broker", "insured", "address", "occupancy", "submitted_at", "source_file", "created_at"'
+
+@instrumentation.timed("db")
+def refresh_duplicate_index() -> None:
+    """Index the submissions created since the last refresh, and any committed late (every submission on the first call)."""
+    global duplicate_index_created_at
+    with duplicate_index_lock, pooled_cursor(db_pool) as cursor:
+        if duplicate_index_created_at is None:
+            cursor.execute(f"""SELECT {submission_record_columns} FROM submissions ORDER BY created_at""")
+        else:
+            # Re-reading rows inside the window is harmless: add ignores known ids
+            cursor.execute(
+                f"""SELECT {submission_record_columns} FROM submissions WHERE created_at >= %s ORDER BY created_at""",
+                (duplicate_index_created_at - datetime.timedelta(seconds=duplicate_index_rescan_seconds),)
+            )
+        rows = cursor.fetchall()
+        for row in rows:
+            duplicate_index.add(SubmissionRecord(*row))
+        if rows:
+            duplicate_index_created_at = max(duplicate_index_created_at or rows[-1][-1], rows[-1][-1])
+        logging.info(f"Duplicate index holds {len(duplicate_index)} submissions ({len(rows)} read)")
+
+@instrumentation.timed("db")
+def save_duplicate_info(submission_id: str, candidate: dict) -> None:
+    """Insert a duplicate_info row linking a submission to the existing submission it duplicates (once per pair)."""
+    try:
+        with pooled_cursor(db_pool) as cursor:
+            cursor.execute(
+                """INSERT INTO duplicate_info ("submissionId", "originalSubmissionId", reference, client, "submissionDate", broker, "matchConfidence")
+                   VALUES (%s, %s, %s, %s, %s, %s, %s)
+                   ON CONFLICT ("submissionId", "originalSubmissionId") DO NOTHING""",
+                (submission_id, candidate["id"], candidate["source_file"][:50], candidate["insured"],
+                 candidate["submitted_at"], candidate["broker"], candidate["matchConfidence"])
+            )
+            recorded = cursor.rowcount
+        if recorded:
+            logging.info(f"Recorded {submission_id} as a duplicate of {candidate['id']} "
+                         f"(match confidence {candidate['matchConfidence']})")
+        else:
+            logging.info(f"{submission_id} is already recorded as a duplicate of {candidate['id']}")
+    except Exception as e:
+        logging.error(f"Failed to record duplicate of {candidate['id']}: {str(e)}")
+        raise
+
+def duplicate_check_notes(submission: SubmissionRecord, duplicates: list, best: dict) -> str:
+    """Notes for a duplicate check settled without the DuplicateCheckAgent."""
+    if duplicates:
+        lines = [f"Duplicate submission: the submission for {submission.insured} duplicates existing submissions:"]
+        for candidate in duplicates:
+            lines.append(
+                f"- {candidate['source_file']} (id {candidate['id']}) for {candidate['insured']} from "
+                f"{candidate['broker']}, submitted {candidate['submitted_at']}, match confidence "
+                f"{candidate['matchConfidence']} (component scores {candidate['scores']})"
+            )
+        lines.append("The duplicates have been recorded in duplicate_info; reconcile with the original submission.")
+        return "\n".join(lines)
+    closest = (f" The closest existing submission, {best['source_file']} for {best['insured']}, "
+               f"has a match confidence of {best['matchConfidence']}." if best else "")
+    return (f"Not a duplicate: no existing submission is a likely match for {submission.insured}.{closest} "
+            "This is a new submission that should be processed.")
+
 @app.route(route="agentic_stage_2")
 async def agentic_stage_2(req: func.HttpRequest) -> func.HttpResponse:
     
     """HTTP trigger function to run the agent workflow for insurance quote submission duplicate check."""
     logging.info('Processing a request to run the agent workflow for insurance quote submission duplicate check.')
-    
-    # Define the agent workflow with the agents and initial state
-    agent_workflow = AgentWorkflow(
-        agents=[duplicate_check_agent, duplicate_check_email_agent],
-        root_agent=duplicate_check_agent.name,
-        initial_state={
-            "triage_notes": {},
-            "customer_email": "not drafted yet."
-        },
-    )
 
-    handler = agent_workflow.run(
-        user_msg=(
-            """
+    # Claim the triaged submissions and move them to 'enrichment' once checked
+    summary = await run_stage_jobs(2, check_duplicates)
+    return func.HttpResponse(body = f"Agentic Stage 2 complete: {summary}", status_code = 200)
+
+async def check_duplicates(submission_id: str) -> None:
+    """Run the stage 2 duplicate check on one submission."""
+    row = await asyncio.to_thread(fetch_submission_row, submission_id, submission_record_columns)
+    submission = SubmissionRecord(*row)
+    logging.info(f"Checking submission ID {submission.id} for duplicates")
+
+    # Score the likely duplicates among the submissions that came before this
+    # one; clear matches are recorded straight away and only ambiguous ones are
+    # left to the DuplicateCheckAgent
+    await asyncio.to_thread(refresh_duplicate_index)
+    candidates = [candidate_to_dict(candidate) for candidate in duplicate_index.candidates(submission, duplicate_top_n)]
+    duplicates = [candidate for candidate in candidates if classify(candidate["matchConfidence"]) == "duplicate"]
+    ambiguous = [candidate for candidate in candidates if classify(candidate["matchConfidence"]) == "ambiguous"]
+    logging.info(f"Duplicate candidates: {len(duplicates)} duplicate, {len(ambiguous)} ambiguous, "
+                 f"{len(candidates) - len(duplicates) - len(ambiguous)} unlikely")
+    for candidate in duplicates:
+        await asyncio.to_thread(save_duplicate_info, str(submission.id), candidate)
+
+    submission_data = {
+        field: value.decode("utf-8") if isinstance(value, bytes) else str(value)
+        for field, value in submission._asdict().items() if field != "created_at"
+    }
+
+    if ambiguous and not duplicates:
+        # Run the shared stage 2 workflow on the ambiguous candidates only
+        agent_workflow = stage_2_workflow
+        ctx = await new_run_context(agent_workflow)
+        state = await ctx.get("state")
+        state["submission_id"] = str(submission.id)
+        state["duplicate_candidates"] = ambiguous
+        await ctx.set("state", state)
+        user_msg = (
+            f"""
             Please triage the following property insurance quote submission from a broker:
-            {
-            "insurance_broker": "ABC Insurance Brokers",
-            "date": "24-04-2025",
-            "insurance_company": "Lloyd’s Insurance",
-            "address": "100 Fenchurch Street, London, EC3M 5JD",
-            "recipient": "Mr. John Smith",
-            "subject": "Request for Property Insurance Quote for GreenTech Solutions Ltd.",
-            "client": "GreenTech Solutions Ltd.",
-            "property_information": {
-            "location": "55 Tech Drive, London, EC1A 1BB",
-            "type": "Commercial Office Building",
-            "construction": "Steel frame with brick exterior, built in 2010, no recent renovations",
-            "surface_area": "780 meter square",
-            "occupancy": "Office space for 50 employees"
-            },
-            "coverage_requirements": {
-            "desired_coverage_amount": "£2,000,000",
-            "coverage_type": ["Fire", "theft", "third-party liability"],
-            "deductibles": "£1,000 per incident",
-            "additional_coverage": ["Business interruption", "flood protection"]
-            },
-            "risk_assessment": {
-            "fire_hazards": ["Sprinkler system installed", "regular fire drills"],
-            "natural_disasters": [
-                "Low flood risk area",
-                "not located near seismic fault lines"
-            ],
-            "security_measures": ["24/7 CCTV monitoring", "keycard access control"]
-            },
-            "financial_information": {
-            "property_value": "£2.5M",
-            "business_revenue": "£8M annually"
-            },
-            "contact_person": {
-            "name": "James Carter",
-            "email": "james.carter@abcinsurance.com",
-            "phone": "020 7123 4567"
-            }
-        }
-            Please analyze this submission and determine if it is a duplicate of an existing submission.
+            {submission_data}
+            Please analyze this submission and determine if it is a duplicate of one of the {len(ambiguous)} candidate existing submissions.
             """
         )
-    )
+    else:
+        # Clear-cut: go straight to the DuplicateCheckEmailAgent with the engine's notes
+        agent_workflow = stage_2_email_workflow
+        ctx = await new_run_context(agent_workflow)
+        state = await ctx.get("state")
+        state["triage_notes"]["Duplicate Check"] = duplicate_check_notes(
+            submission, duplicates, candidates[0] if candidates else None
+        )
+        await ctx.set("state", state)
+        user_msg = (
+            f"""
+            The following property insurance quote submission from a broker has been checked for duplicates:
+            {submission_data}
+            The duplicate check notes are in the current state.
+            """
+        )
+
+    handler = agent_workflow.run(ctx=ctx, user_msg=user_msg)
 
     current_agent = None
     current_tool_calls = ""
 
     try:
         async for event in handler.stream_events():
+            instrumentation.observe(event)
             if (
                 hasattr(event, "current_agent_name")
                 and event.current_agent_name != current_agent
@@ -1042,32 +1261,101 @@ async def agentic_stage_2(req: func.HttpRequest) -> func.HttpResponse:
 
     response = await handler
 
-    return func.HttpResponse(body = "Agentic Stage 2 complete", status_code = 200)
-
 #############################################################################################################################
 # STAGE 3: AGENTIC COMPLIANCE CHECK FOR INSURANCE QUOTE SUBMISSION
 #############################################################################################################################
 
+# Per-check time limit in seconds; a check that runs over is reported as incomplete
+compliance_check_timeout = float(os.getenv("COMPLIANCE_CHECK_TIMEOUT", "180"))
+
+# Pre-screen over the stage 3 reference datasets, rebuilt whenever one of them is reloaded
+compliance_screener = None
+compliance_screener_datasets = ()
+compliance_screener_lock = threading.Lock()
+
+def get_compliance_screener() -> ComplianceScreener:
+    """Return the compliance pre-screener for the currently loaded stage 3 reference datasets."""
+    global compliance_screener, compliance_screener_datasets
+    with compliance_screener_lock:
+        names = ["dnb", "companies_house", "company_database", "flagged_countries"]
+        datasets = tuple(reference_data.get(name) for name in names)
+        if compliance_screener is None or any(
+            dataset is not indexed for dataset, indexed in zip(datasets, compliance_screener_datasets)
+        ):
+            compliance_screener = ComplianceScreener(
+                **{name: dataset.records() for name, dataset in zip(names, datasets)}
+            )
+            compliance_screener_datasets = datasets
+            logging.info("Rebuilt the compliance pre-screen indexes")
+        return compliance_screener
+
+async def run_compliance_check(agent_name: str, section: str, user_msg: str, records: list = None) -> dict:
+    """Run one compliance check agent in its own context and return the report sections it wrote."""
+    workflow = stage_3_check_workflows[agent_name]
+    ctx = await new_run_context(workflow)
+    if records is not None:
+        # The agent's read tool returns only these pre-screened records
+        state = await ctx.get("state")
+        state["prescreen_records"] = records
+        await ctx.set("state", state)
+    handler = workflow.run(ctx=ctx, user_msg=user_msg)
+
+    async def follow():
+        # The checks run concurrently in one stage 3 run, so each needs its own
+        # observer to keep its agent and LLM turn spans apart
+        with instrumentation.child_run() as observer:
+            async for event in handler.stream_events():
+                if observer is not None:
+                    observer.observe(event)
+        return await handler
+
+    start = time.perf_counter()
+    try:
+        await asyncio.wait_for(follow(), timeout=compliance_check_timeout)
+    except asyncio.TimeoutError:
+        await handler.cancel_run()
+        logging.warning(f"{agent_name} timed out after {compliance_check_timeout:.0f}s")
+        return {section: (
+            f"The check did not finish within {compliance_check_timeout:.0f} seconds. "
+            "Compliance determination: Needs Additional Information"
+        )}
+    except Exception as e:
+        logging.error(f"{agent_name} failed: {str(e)}")
+        return {section: (
+            f"The check failed with an error: {str(e)}. "
+            "Compliance determination: Needs Additional Information"
+        )}
+    logging.info(f"{agent_name} finished in {time.perf_counter() - start:.1f}s")
+    state = await ctx.get("state")
+    return state.get("report_content") or {section: "The check finished without writing a report section."}
+
+async def run_compliance_checks(user_msg: str, submission: dict) -> dict:
+    """Pre-screen the submission, then run the checks it could not settle concurrently and merge all report sections in check order."""
+    with instrumentation.span("reference", "compliance_screener"):
+        screener = await asyncio.to_thread(get_compliance_screener)
+    outcomes = screener.screen(submission)
+
+    async def run_check(agent, section, key):
+        outcome = outcomes[key]
+        if outcome.report is not None:
+            logging.info(f"{agent.name} skipped: settled by the deterministic pre-screen")
+            return {section: outcome.report}
+        logging.info(f"{agent.name} reviewing {len(outcome.records)} pre-screened records")
+        return await run_compliance_check(agent.name, section, user_msg, outcome.records)
+
+    results = await asyncio.gather(*(run_check(*check) for check in stage_3_checks))
+    report_content = {}
+    for sections in results:
+        report_content.update(sections)
+    return report_content
+
 @app.route(route="agentic_stage_3")
 async def agentic_stage_3(req: func.HttpRequest) -> func.HttpResponse:
 
     """HTTP trigger function to run the agent workflow for insurance quote submission compliance checks."""
     logging.info('Processing a request to run the agent workflow for insurance quote submission compliance checks.')
     
-    # Define the agent workflow with the agents and initial state
-    agent_workflow = AgentWorkflow(
-        agents=[dnb_check_agent , sanction_check_agent, companies_house_check_agent, company_database_check_agent, check_email_agent],
-        root_agent=dnb_check_agent.name,
-        initial_state={
-            "report_content": {},
-            "customer_email": "not drafted yet."
-        },
-    )
-
-    handler = agent_workflow.run(
-        user_msg=(
-            """
-            Please triage the following property insurance quote submission from a broker:
+    submission_json = """
             {
             "insurance_broker": "Prime Insurance Brokers",
             "date": "24 April 2025",
@@ -1119,9 +1407,37 @@ async def agentic_stage_3(req: func.HttpRequest) -> func.HttpResponse:
             "phone": "+971 4 234 5678"
             }
         }
+            """
+    submission = json.loads(submission_json)
+    user_msg = (
+            """
+            Please triage the following property insurance quote submission from a broker:
+            """ + submission_json + """
             Please analyze this submission and determine if it meets all compliance check.
             """
-        )
+    )
+
+    # Spans of the pre-screen, the checks and the email agent are attributed to one run
+    with instrumentation.run(3):
+        await check_compliance(user_msg, submission)
+
+    return func.HttpResponse(body = "Agentic Stage 3 complete", status_code = 200)
+
+async def check_compliance(user_msg: str, submission: dict) -> None:
+    """Run the stage 3 compliance checks and the CheckEmailAgent on one submission."""
+    # Pre-screen the submission and fan out the remaining compliance checks concurrently
+    report_content = await run_compliance_checks(user_msg, submission)
+
+    # Run the CheckEmailAgent on the merged report, with fresh per-request state
+    agent_workflow = stage_3_email_workflow
+    ctx = await new_run_context(agent_workflow)
+    state = await ctx.get("state")
+    state["report_content"] = report_content
+    await ctx.set("state", state)
+
+    handler = agent_workflow.run(
+        ctx=ctx,
+        user_msg=user_msg + "\nThe report_content in the current state holds the results of all four compliance checks.",
     )
 
     current_agent = None
@@ -1129,6 +1445,7 @@ async def agentic_stage_3(req: func.HttpRequest) -> func.HttpResponse:
 
     try:
         async for event in handler.stream_events():
+            instrumentation.observe(event)
             if (
                 hasattr(event, "current_agent_name")
                 and event.current_agent_name != current_agent
@@ -1165,8 +1482,6 @@ async def agentic_stage_3(req: func.HttpRequest) -> func.HttpResponse:
 
     response = await handler
 
-    return func.HttpResponse(body = "Agentic Stage 3 complete", status_code = 200)
-
 #############################################################################################################################
 # STAGE 4: AGENTIC RESEARCH AND EMAIL RESPONSE FOR INSURANCE QUOTE SUBMISSION
 #############################################################################################################################
@@ -1177,17 +1492,22 @@ async def agentic_stage_4(req: func.HttpRequest) -> func.HttpResponse:
     """HTTP trigger function to run the agent workflow for insurance quote submission research and email response."""
     logging.info('Processing a request to run the agent workflow for insurance quote submission research and email response.')
 
-    # Define the agent workflow with the agents and initial state
-    agent_workflow = AgentWorkflow(
-        agents=[research_agent, research_email_agent],
-        root_agent=research_agent.name,
-        initial_state={
-            "research_notes": {},
-            "customer_email": "not drafted yet."
-        },
-    )
+    with instrumentation.run(4):
+        await research_submission()
+
+    if guidelines_retriever is not None:
+        logging.info(f"Guideline search cache: {guidelines_retriever.stats}")
+
+    return func.HttpResponse(body = "Agentic Stage 4 complete", status_code = 200)
+
+async def research_submission() -> None:
+    """Run the stage 4 research workflow on the sample submission."""
+    # Run the shared stage 4 workflow with fresh per-request state
+    agent_workflow = stage_4_workflow
+    ctx = await new_run_context(agent_workflow)
 
     handler = agent_workflow.run(
+        ctx=ctx,
         user_msg=(
             """
             Please triage the following property insurance quote submission from a broker:
@@ -1252,6 +1572,7 @@ async def agentic_stage_4(req: func.HttpRequest) -> func.HttpResponse:
 
     try:
         async for event in handler.stream_events():
+            instrumentation.observe(event)
             if (
                 hasattr(event, "current_agent_name")
                 and event.current_agent_name != current_agent
@@ -1288,4 +1609,14 @@ async def agentic_stage_4(req: func.HttpRequest) -> func.HttpResponse:
 
     response = await handler
 
-    return func.HttpResponse(body = "Agentic Stage 4 complete", status_code = 200)  
+#############################################################################################################################
+# INSTRUMENTATION
+#############################################################################################################################
+
+@app.route(route="instrumentation_stats")
+async def instrumentation_stats(req: func.HttpRequest) -> func.HttpResponse:
+
+    """HTTP trigger function returning this worker's span percentiles and token usage per stage."""
+    return func.HttpResponse(
+        body=json.dumps(instrumentation.stats(), default=str), mimetype="application/json", status_code=200
+    )
@@ -0,0 +1,224 @@
+import hashlib
+import json
+import logging
+import os
+import shutil
+import time
+from llama_index.core import Settings, SimpleDirectoryReader, StorageContext, VectorStoreIndex, load_index_from_storage
+from llama_index.core.node_parser import SentenceSplitter
+from llama_index.core.schema import MetadataMode
+from vector_search import DenseVectorIndex
+
+# Incrementally maintained guideline index.
+#
+# The persist directory holds one subdirectory per index version plus a CURRENT
+# file naming the live one. Each version carries a manifest with a fingerprint
+# (SHA-256 of the file bytes) for every source document and the hash of every
+# chunk it was split into. On refresh only new or modified documents are
+# re-read and re-split, and only chunks whose text was never embedded before
+# are sent to the embedding model; unchanged chunks keep their stored vectors.
+# The new version is fully written before CURRENT is switched, so readers
+# always see a complete index. Every version also carries a DenseVectorIndex
+# export, which load_dense memory-maps without loading the LlamaIndex storage.
+
+MANIFEST_FILE = "manifest.json"
+CURRENT_FILE = "CURRENT"
+# 2: chunk hashes cover the file path relative to data_dir
+MANIFEST_VERSION = 2
+
+def file_fingerprint(path):
+    """SHA-256 of a file's bytes"""
+    with open(path, "rb") as file:
+        return hashlib.file_digest(file, "sha256").hexdigest()
+
+def chunk_hash(node):
+    """SHA-256 of exactly the content that gets embedded for a node"""
+    return hashlib.sha256(node.get_content(metadata_mode=MetadataMode.EMBED).encode("utf-8")).hexdigest()
+
+class GuidelineIndexManager:
+    """Loads, refreshes and atomically persists a guideline VectorStoreIndex"""
+
+    def __init__(self, data_dir, persist_dir, embed_model=None, chunk_size=1024, chunk_overlap=200):
+        self.data_dir = data_dir
+        self.persist_dir = persist_dir
+        self.embed_model = embed_model or Settings.embed_model
+        self.chunk_size = chunk_size
+        self.chunk_overlap = chunk_overlap
+        self.node_parser = SentenceSplitter(chunk_size=chunk_size, chunk_overlap=chunk_overlap)
+
+    def load(self):
+        """Return the index, bringing it up to date with the source documents first"""
+        index, manifest = self._load_current()
+        sources = self._scan_sources()
+        changed, removed = self._diff(manifest, sources)
+        if index is not None and not changed and not removed:
+            logging.info(f"Guideline index is up to date ({len(sources)} documents)")
+            return index
+        return self._update(index, manifest, sources, changed, removed)
+
+    def load_dense(self):
+        """Return the DenseVectorIndex of the up-to-date index.
+
+        When the sources are unchanged this only memory-maps the stored export;
+        otherwise the index is updated (and exported) through load first.
+        """
+        version_dir, manifest = self._read_current()
+        if version_dir is not None and DenseVectorIndex.exists(version_dir):
+            changed, removed = self._diff(manifest, self._scan_sources())
+            if not changed and not removed:
+                return DenseVectorIndex.load(version_dir)
+
+        index = self.load()
+        version_dir, _ = self._read_current()
+        if not DenseVectorIndex.exists(version_dir):
+            # Versions persisted before the export existed
+            DenseVectorIndex.from_index(index).save(version_dir)
+        return DenseVectorIndex.load(version_dir)
+
+    def current_version(self):
+        """Name of the live index version, or None before the first build"""
+        try:
+            with open(os.path.join(self.persist_dir, CURRENT_FILE), "r") as file:
+                return file.read().strip()
+        except FileNotFoundError:
+            return None
+
+    def _diff(self, manifest, sources):
+        """Source paths that are new or modified, and paths that were removed"""
+        changed = {path for path, fingerprint in sources.items()
+                   if manifest["documents"].get(path, {}).get("fingerprint") != fingerprint}
+        removed = set(manifest["documents"]) - set(sources)
+        return changed, removed
+
+    def _settings(self):
+        return {
+            "chunk_size": self.chunk_size,
+            "chunk_overlap": self.chunk_overlap,
+            "embed_model": getattr(self.embed_model, "model_name", type(self.embed_model).__name__),
+        }
+
+    def _empty_manifest(self):
+        return {"version": MANIFEST_VERSION, "settings": self._settings(), "documents": {}}
+
+    def _read_current(self):
+        """Return the live version directory and its manifest, or (None, empty manifest)"""
+        try:
+            with open(os.path.join(self.persist_dir, CURRENT_FILE), "r") as file:
+                version_dir = os.path.join(self.persist_dir, file.read().strip())
+            with open(os.path.join(version_dir, MANIFEST_FILE), "r") as file:
+                manifest = json.load(file)
+        except FileNotFoundError:
+            return None, self._empty_manifest()
+
+        # Chunking or embedding model changes invalidate every stored vector
+        if manifest.get("version") != MANIFEST_VERSION or manifest.get("settings") != self._settings():
+            logging.info("Guideline index settings changed, rebuilding from scratch")
+            return None, self._empty_manifest()
+        return version_dir, manifest
+
+    def _load_current(self):
+        """Load the live index version and its manifest, or (None, empty manifest)"""
+        version_dir, manifest = self._read_current()
+        if version_dir is None:
+            return None, manifest
+        logging.info(f"Loading guideline index from {version_dir}")
+        storage_context = StorageContext.from_defaults(persist_dir=version_dir)
+        index = load_index_from_storage(storage_context, embed_model=self.embed_model)
+        return index, manifest
+
+    def _scan_sources(self):
+        """Map each source file (relative to data_dir) to its fingerprint"""
+        reader = SimpleDirectoryReader(input_dir=self.data_dir)
+        return {
+            os.path.relpath(str(path), self.data_dir): file_fingerprint(path)
+            for path in reader.input_files
+        }
+
+    def _update(self, index, manifest, sources, changed, removed):
+        if index is None:
+            index = VectorStoreIndex([], embed_model=self.embed_model)
+            changed = set(sources)
+            removed = set()
+            manifest = self._empty_manifest()
+
+        documents = manifest["documents"]
+
+        # Embeddings of every chunk currently in the index, by chunk hash, so a
+        # chunk that survives an edit of its file is not re-embedded
+        stored = {
+            hash_: node_id
+            for entry in documents.values()
+            for hash_, node_id in entry["chunks"]
+        }
+
+        new_nodes = []
+        new_entries = {}
+        for path in sorted(changed):
+            file_documents = SimpleDirectoryReader(
+                input_files=[os.path.join(self.data_dir, path)]
+            ).load_data()
+            # The reader's file_path is spelled the way data_dir was given; it is
+            # part of the embedded text, so keep it independent of the working
+            # directory and of whichever caller built the index
+            for document in file_documents:
+                document.metadata["file_path"] = path
+            nodes = self.node_parser.get_nodes_from_documents(file_documents)
+            chunks = []
+            for node in nodes:
+                hash_ = chunk_hash(node)
+                if hash_ in stored:
+                    node.embedding = index.vector_store.get(stored[hash_])
+                chunks.append([hash_, node.node_id])
+            new_nodes.extend(nodes)
+            new_entries[path] = {"fingerprint": sources[path], "chunks": chunks}
+
+        reused = sum(1 for node in new_nodes if node.embedding is not None)
+        logging.info(
+            f"Updating guideline index: {len(changed)} changed and {len(removed)} removed documents, "
+            f"{len(new_nodes) - reused} chunks to embed, {reused} reused"
+        )
+
+        stale_ids = [
+            node_id
+            for path in changed | removed
+            if path in documents
+            for _, node_id in documents[path]["chunks"]
+        ]
+        if stale_ids:
+            index.delete_nodes(stale_ids, delete_from_docstore=True)
+        # insert_nodes only embeds nodes that don't already carry an embedding
+        if new_nodes:
+            index.insert_nodes(new_nodes)
+
+        for path in removed:
+            documents.pop(path, None)
+        documents.update(new_entries)
+        self._persist(index, manifest)
+        return index
+
+    def _persist(self, index, manifest):
+        """Write a new index version, then switch CURRENT to it"""
+        os.makedirs(self.persist_dir, exist_ok=True)
+        version = f"v{time.time_ns()}"
+        version_dir = os.path.join(self.persist_dir, version)
+        index.storage_context.persist(persist_dir=version_dir)
+        DenseVectorIndex.from_index(index).save(version_dir)
+        with open(os.path.join(version_dir, MANIFEST_FILE), "w") as file:
+            json.dump(manifest, file)
+
+        current_path = os.path.join(self.persist_dir, CURRENT_FILE)
+        previous = None
+        if os.path.exists(current_path):
+            with open(current_path, "r") as file:
+                previous = file.read().strip()
+        tmp_path = f"{current_path}.{os.getpid()}.tmp"
+        with open(tmp_path, "w") as file:
+            file.write(version)
+        os.replace(tmp_path, current_path)
+        logging.info(f"Persisted guideline index version {version}")
+
+        # Keep the previous version for readers that are still loading it
+        for name in os.listdir(self.persist_dir):
+            path = os.path.join(self.persist_dir, name)
+            if os.path.isdir(path) and name.startswith("v") and name not in (version, previous):
+                shutil.rmtree(path, ignore_errors=True)
@@ -0,0 +1,453 @@
+import contextlib
+import contextvars
+import functools
+import json
+import logging
+import os
+import threading
+import time
+import traceback
+import uuid
+from collections import Counter, defaultdict, deque
+import httpx
+from llama_index.core.agent.workflow import AgentInput, AgentOutput, AgentStream, ToolCall, ToolCallResult
+from rate_limiter import DEPLOYMENT_RE
+
+try:
+    from opentelemetry import trace as otel_trace
+except ImportError:  # Optional: only needed for the OpenTelemetry sink
+    otel_trace = None
+
+# Latency and token spans for the agentic stages.
+#
+# A stage runs each submission inside instrumentation.run(stage, submission_id),
+# which puts a Run in a context variable; the workflow tasks, tool calls and
+# worker threads started inside it inherit it, so every span is attributed to
+# its stage and run without passing anything around. Spans come from:
+#   - the stream_events() loops, through observe(): agent activity, handoffs
+#     (from the handoff tool call to the next agent's first event) and LLM
+#     turns with their time to first streamed token
+#   - the tool functions, decorated with @instrumentation.tool
+#   - the HTTP clients of the LLM and embedding models (see wrap): one span
+#     per Azure OpenAI request with time to first byte and prompt/completion
+#     tokens, from the response usage or estimated from the request and the
+#     streamed chunks
+#   - DB and reference data (blob/file) reads, through span() and timed()
+# Each span is a flat dict exported to every sink (MemorySink, JsonLinesSink,
+# OpenTelemetrySink), and its duration is kept in a bounded window per stage,
+# kind and name for the percentiles reported by stats().
+
+SPAN_WINDOW = int(os.getenv("INSTRUMENTATION_WINDOW", "2048"))
+
+PERCENTILES = (50, 95, 99)
+
+current_run = contextvars.ContextVar("instrumentation_run", default=None)
+
+def percentile(ordered, q):
+    """Nearest-rank percentile of a sorted list"""
+    return ordered[min(len(ordered) - 1, max(0, round(q / 100 * len(ordered)) - 1))]
+
+class MemorySink:
+    """Ring buffer of the latest spans"""
+
+    def __init__(self, capacity=10000):
+        self.buffer = deque(maxlen=capacity)
+
+    def export(self, span):
+        self.buffer.append(span)
+
+    def spans(self, kind=None, stage=None):
+        return [span for span in list(self.buffer)
+                if (kind is None or span["kind"] == kind) and (stage is None or span["stage"] == stage)]
+
+    def close(self):
+        pass
+
+class JsonLinesSink:
+    """Appends each span to a JSON-lines file"""
+
+    def __init__(self, path):
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        self.file = open(path, "a", encoding="utf-8")
+        self.lock = threading.Lock()
+
+    def export(self, span):
+        line = json.dumps(span, default=str) + "\n"
+        with self.lock:
+            self.file.write(line)
+            self.file.flush()
+
+    def close(self):
+        with self.lock:
+            self.file.close()
+
+class OpenTelemetrySink:
+    """Exports spans to the globally configured OpenTelemetry tracer provider"""
+
+    def __init__(self, tracer_name="insureflow"):
+        if otel_trace is None:
+            raise ImportError("The OpenTelemetry sink needs the opentelemetry-api package")
+        self.tracer = otel_trace.get_tracer(tracer_name)
+
+    def export(self, span):
+        start = int(span["start"] * 1e9)
+        attributes = {key: value for key, value in span.items()
+                      if isinstance(value, (str, bool, int, float)) and key not in ("start", "seconds")}
+        otel_span = self.tracer.start_span(f"{span['kind']} {span['name']}", start_time=start, attributes=attributes)
+        otel_span.end(end_time=start + int(span["seconds"] * 1e9))
+
+    def close(self):
+        pass
+
+def create_sink(name, jsonl_path=None, capacity=10000):
+    """Sink by name: memory, jsonl or otel"""
+    if name == "memory":
+        return MemorySink(capacity)
+    if name == "jsonl":
+        return JsonLinesSink(jsonl_path)
+    if name == "otel":
+        return OpenTelemetrySink()
+    raise ValueError(f"Unknown instrumentation sink {name!r}")
+
+class Run:
+    """One stage run (a submission, or a stage trigger), following its workflow events"""
+
+    def __init__(self, instrumentation, stage, submission_id=None, parent=None):
+        self.instrumentation = instrumentation
+        self.stage = stage
+        self.submission_id = submission_id
+        self.parent = parent
+        self.id = uuid.uuid4().hex[:12]
+        self.started = time.perf_counter()
+        self.tokens = Counter()
+        self.agent = None
+        self.agent_started = None
+        self.handoff_started = None
+        self.turn_started = None
+        self.first_token = None
+        self.turns = 0
+
+    def observe(self, event):
+        """Derive agent, handoff and LLM turn spans from a workflow event"""
+        now = time.perf_counter()
+        emit = self.instrumentation.emit
+        agent = getattr(event, "current_agent_name", None)
+        if agent and agent != self.agent:
+            if self.agent is not None:
+                emit("agent", self.agent, self.agent_started, now - self.agent_started)
+                if self.handoff_started is not None:
+                    emit("handoff", f"{self.agent}->{agent}", self.handoff_started, now - self.handoff_started)
+            self.agent, self.agent_started, self.handoff_started = agent, now, None
+
+        if isinstance(event, AgentInput):
+            self.turn_started, self.first_token = now, None
+        elif isinstance(event, AgentStream):
+            if self.first_token is None and (event.delta or event.tool_calls):
+                self.first_token = now
+        elif isinstance(event, AgentOutput):
+            if self.turn_started is not None:
+                self.turns += 1
+                if self.parent is not None:
+                    self.parent.turns += 1
+                emit("llm_turn", event.current_agent_name, self.turn_started, now - self.turn_started,
+                     time_to_first_token=None if self.first_token is None else round(self.first_token - self.turn_started, 6),
+                     tool_calls=len(event.tool_calls))
+                self.turn_started = None
+        elif isinstance(event, ToolCallResult):
+            pass
+        elif isinstance(event, ToolCall) and event.tool_name == "handoff":
+            self.handoff_started = now
+
+    def child(self):
+        """Observer for one of several workflows this run drives concurrently; its turns count towards this run"""
+        return Run(self.instrumentation, self.stage, self.submission_id, parent=self)
+
+    def finish(self, error=None):
+        now = time.perf_counter()
+        emit = self.instrumentation.emit
+        if self.agent is not None:
+            emit("agent", self.agent, self.agent_started, now - self.agent_started)
+        # A child's spans and tokens already belong to its parent's run span
+        if self.parent is None:
+            emit("run", f"stage_{self.stage}", self.started, now - self.started,
+                 llm_turns=self.turns, error=error, **self.tokens)
+
+class Instrumentation:
+    """Records spans for the stage runs and exports them to the sinks"""
+
+    def __init__(self, *sinks, window=SPAN_WINDOW):
+        self.sinks = list(sinks)
+        self.lock = threading.Lock()
+        self.durations = defaultdict(lambda: deque(maxlen=window))
+        self.counts = Counter()
+        self.tokens = defaultdict(Counter)
+
+    @contextlib.contextmanager
+    def run(self, stage, submission_id=None):
+        """Attribute the spans recorded inside the block (and the tasks and threads it starts) to a new run"""
+        run = Run(self, stage, submission_id)
+        token = current_run.set(run)
+        error = None
+        try:
+            yield run
+        except BaseException as e:
+            error = type(e).__name__
+            raise
+        finally:
+            run.finish(error)
+            current_run.reset(token)
+
+    @contextlib.contextmanager
+    def child_run(self):
+        """Observer (Run.child) for one of several workflows run concurrently in the current run; None outside a run"""
+        parent = current_run.get()
+        if parent is None:
+            yield None
+            return
+        run = parent.child()
+        try:
+            yield run
+        finally:
+            run.finish()
+
+    def observe(self, event):
+        """Feed a stream_events() event to the current run"""
+        run = current_run.get()
+        if run is not None:
+            run.observe(event)
+
+    @contextlib.contextmanager
+    def span(self, kind, name, **attributes):
+        """Time the block as a span"""
+        started = time.perf_counter()
+        try:
+            yield
+        except BaseException as e:
+            attributes["error"] = type(e).__name__
+            raise
+        finally:
+            self.emit(kind, name, started, time.perf_counter() - started, **attributes)
+
+    def timed(self, kind, name=None):
+        """Decorator recording each call of a blocking function as a span"""
+        def decorate(fn):
+            @functools.wraps(fn)
+            def wrapper(*args, **kwargs):
+                with self.span(kind, name or fn.__name__):
+                    return fn(*args, **kwargs)
+            return wrapper
+        return decorate
+
+    def tool(self, fn):
+        """Decorator recording each call of an async agent tool as a span; the tool keeps its signature and docstring"""
+        @functools.wraps(fn)
+        async def wrapper(*args, **kwargs):
+            with self.span("tool", fn.__name__):
+                return await fn(*args, **kwargs)
+        return wrapper
+
+    def emit(self, kind, name, started, seconds, stage=None, **attributes):
+        """Record a span that started at perf_counter() value started"""
+        run = current_run.get()
+        if stage is None and run is not None:
+            stage = run.stage
+        span = {
+            "kind": kind,
+            "name": name,
+            "stage": stage,
+            "run": run.id if run is not None else None,
+            "submission_id": run.submission_id if run is not None else None,
+            "start": time.time() - (time.perf_counter() - started),
+            "seconds": round(seconds, 6),
+            **{key: value for key, value in attributes.items() if value is not None},
+        }
+        with self.lock:
+            self.durations[(stage, kind, name)].append(seconds)
+            self.counts[(stage, kind, name)] += 1
+            if kind == "llm":
+                usage = {key: span.get(key, 0) for key in ("prompt_tokens", "completion_tokens")}
+                self.tokens[stage].update(usage)
+                if run is not None:
+                    run.tokens.update(usage)
+        for sink in self.sinks:
+            try:
+                sink.export(span)
+            except Exception as e:
+                logging.error(f"Failed to export a span to {type(sink).__name__}: {str(e)}")
+                logging.error(traceback.format_exc())
+        return span
+
+    def stats(self):
+        """Per stage: count, p50/p95/p99 and max seconds of every span kind and name, and the LLM tokens used"""
+        with self.lock:
+            windows = {key: sorted(durations) for key, durations in self.durations.items()}
+            counts = dict(self.counts)
+            tokens = {stage: dict(usage) for stage, usage in self.tokens.items()}
+        stats = {}
+        for (stage, kind, name), ordered in sorted(windows.items(), key=lambda item: str(item[0])):
+            key = "unattributed" if stage is None else f"stage_{stage}"
+            stage_stats = stats.setdefault(key, {"spans": {}, "tokens": tokens.get(stage, {})})
+            stage_stats["spans"].setdefault(kind, {})[name] = {
+                "count": counts[(stage, kind, name)],
+                **{f"p{q}": round(percentile(ordered, q), 4) for q in PERCENTILES},
+                "max": round(ordered[-1], 4),
+            }
+        return stats
+
+    def reset(self):
+        """Forget the aggregated durations and tokens (the sinks keep their spans)"""
+        with self.lock:
+            self.durations.clear()
+            self.counts.clear()
+            self.tokens.clear()
+
+    def wrap(self, transport):
+        """httpx transport recording an llm span per request"""
+        return InstrumentedTransport(transport, self)
+
+    def wrap_async(self, transport):
+        """Async httpx transport recording an llm span per request"""
+        return AsyncInstrumentedTransport(transport, self)
+
+    def close(self):
+        for sink in self.sinks:
+            sink.close()
+
+class ResponseMeter:
+    """Times an Azure OpenAI response body and reads its token usage once it is closed"""
+
+    def __init__(self, instrumentation, request, response, started):
+        self.instrumentation = instrumentation
+        self.request = request
+        self.response = response
+        self.started = started
+        self.first_byte = None
+        self.chunks = []
+
+    def chunk(self, data):
+        if self.first_byte is None:
+            self.first_byte = time.perf_counter()
+        self.chunks.append(data)
+
+    def usage(self):
+        """(prompt tokens, completion tokens) from the response, else estimated"""
+        body = b"".join(self.chunks)
+        if self.response.headers.get("content-encoding"):
+            # The transport sees the body still gzip/deflate encoded; httpx only
+            # decodes it when the client reads the response
+            body = httpx.Response(self.response.status_code, headers=self.response.headers, content=body).content
+        prompt_tokens = completion_tokens = None
+        if "text/event-stream" in self.response.headers.get("content-type", ""):
+            # Streamed chat: usage only arrives with stream_options.include_usage,
+            # otherwise each content or tool call delta counts as a token
+            completion_tokens = 0
+            for line in body.splitlines():
+                if not line.startswith(b"data: {"):
+                    continue
+                chunk = json.loads(line[6:])
+                if chunk.get("usage"):
+                    prompt_tokens = chunk["usage"].get("prompt_tokens")
+                    completion_tokens = chunk["usage"].get("completion_tokens")
+                    break
+                for choice in chunk.get("choices") or []:
+                    delta = choice.get("delta") or {}
+                    completion_tokens += bool(delta.get("content")) + len(delta.get("tool_calls") or [])
+        elif body:
+            usage = json.loads(body).get("usage") or {}
+            prompt_tokens = usage.get("prompt_tokens")
+            completion_tokens = usage.get("completion_tokens", 0)
+        if prompt_tokens is None:
+            request = json.loads(self.request.content or b"{}")
+            prompt = request.get("messages", request.get("input", ""))
+            prompt_tokens = len(json.dumps(prompt)) // 4
+        return prompt_tokens, completion_tokens or 0
+
+    def close(self):
+        seconds = time.perf_counter() - self.started
+        match = DEPLOYMENT_RE.search(self.request.url.path)
+        attributes = {
+            "operation": "embeddings" if self.request.url.path.endswith("/embeddings") else "chat",
+            "status": self.response.status_code,
+            "cached": self.response.headers.get("x-llm-cache") == "hit",
+        }
+        if self.first_byte is not None:
+            attributes["time_to_first_byte"] = round(self.first_byte - self.started, 6)
+        if self.response.status_code == 200:
+            try:
+                attributes["prompt_tokens"], attributes["completion_tokens"] = self.usage()
+            except (ValueError, UnicodeDecodeError, AttributeError, httpx.DecodingError):
+                logging.warning(f"Could not read the token usage of {self.request.url.path}")
+        self.instrumentation.emit("llm", match.group(1) if match else self.request.url.path, self.started, seconds,
+                                  **attributes)
+
+class MeteredStream(httpx.SyncByteStream):
+    """Response body that reports its chunks and its close to a ResponseMeter"""
+
+    def __init__(self, stream, meter):
+        self.stream = stream
+        self.meter = meter
+
+    def __iter__(self):
+        for chunk in self.stream:
+            self.meter.chunk(chunk)
+            yield chunk
+
+    def close(self):
+        try:
+            self.stream.close()
+        finally:
+            if self.meter is not None:
+                self.meter, meter = None, self.meter
+                meter.close()
+
+class AsyncMeteredStream(httpx.AsyncByteStream):
+    """Async response body that reports its chunks and its close to a ResponseMeter"""
+
+    def __init__(self, stream, meter):
+        self.stream = stream
+        self.meter = meter
+
+    async def __aiter__(self):
+        async for chunk in self.stream:
+            self.meter.chunk(chunk)
+            yield chunk
+
+    async def aclose(self):
+        try:
+            await self.stream.aclose()
+        finally:
+            if self.meter is not None:
+                self.meter, meter = None, self.meter
+                meter.close()
+
+class InstrumentedTransport(httpx.BaseTransport):
+    """httpx transport that records an llm span for each request it forwards"""
+
+    def __init__(self, transport, instrumentation):
+        self.transport = transport
+        self.instrumentation = instrumentation
+
+    def handle_request(self, request):
+        started = time.perf_counter()
+        response = self.transport.handle_request(request)
+        response.stream = MeteredStream(response.stream, ResponseMeter(self.instrumentation, request, response, started))
+        return response
+
+    def close(self):
+        self.transport.close()
+
+class AsyncInstrumentedTransport(httpx.AsyncBaseTransport):
+    """Async httpx transport that records an llm span for each request it forwards"""
+
+    def __init__(self, transport, instrumentation):
+        self.transport = transport
+        self.instrumentation = instrumentation
+
+    async def handle_async_request(self, request):
+        started = time.perf_counter()
+        response = await self.transport.handle_async_request(request)
+        response.stream = AsyncMeteredStream(response.stream, ResponseMeter(self.instrumentation, request, response, started))
+        return response
+
+    async def aclose(self):
+        await self.transport.aclose()
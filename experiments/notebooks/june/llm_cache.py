@@ -0,0 +1,282 @@
+import asyncio
+import hashlib
+import json
+import logging
+import re
+import sqlite3
+import threading
+import time
+import traceback
+import httpx
+
+# Deterministic cache of Azure OpenAI responses, with record/replay modes for
+# re-running the agentic stages.
+#
+# The cache is an httpx transport in front of the OpenAI clients' transport, so
+# it sees the exact request the SDK sends and stores the exact response bytes:
+# whole JSON completions, the server-sent-event chunks of streamed responses
+# (replayed chunk by chunk, so the agents see the same deltas) and any tool
+# calls they contain. A request is keyed by deployment, operation and its whole
+# JSON body (fields that never change the response left out), with chat
+# messages normalised.
+#
+# LLM_CACHE_MODE:
+#   off     every request goes to Azure OpenAI (default)
+#   record  every request goes to Azure OpenAI and its response is stored
+#   replay  responses are served from the store only; a miss is a 404 error
+#           and nothing is sent over the network
+#   auto    stored responses are served, misses are sent and recorded
+
+LLM_CACHE_MODES = ("off", "record", "replay", "auto")
+
+DEPLOYMENT_RE = re.compile(r"/deployments/([^/]+)/(.+)$")
+
+# Request fields that never change the response (end-user ids for abuse
+# monitoring); every other field is part of the key
+UNKEYED_FIELDS = {"user"}
+
+# Response headers that are not replayed
+SKIPPED_HEADERS = {"connection", "keep-alive", "transfer-encoding", "set-cookie", "date"}
+
+def normalize_message(message):
+    """Chat message with line endings and trailing whitespace normalised"""
+    message = dict(message)
+    content = message.get("content")
+    if isinstance(content, str):
+        message["content"] = "\n".join(line.rstrip() for line in content.replace("\r\n", "\n").split("\n")).strip()
+    return message
+
+def request_key(request):
+    """(key, deployment) of an OpenAI request; key is the SHA-256 of its canonical form"""
+    match = DEPLOYMENT_RE.search(request.url.path)
+    deployment, operation = match.groups() if match else (request.url.host, request.url.path)
+    try:
+        body = json.loads(request.content or b"{}")
+    except (ValueError, UnicodeDecodeError):
+        body = {"raw": hashlib.sha256(request.content).hexdigest()}
+    if isinstance(body, dict):
+        body = {field: value for field, value in body.items() if field not in UNKEYED_FIELDS and value is not None}
+        if isinstance(body.get("messages"), list):
+            body["messages"] = [normalize_message(message) for message in body["messages"]]
+    canonical = json.dumps(
+        {"deployment": deployment, "operation": operation, "body": body},
+        sort_keys=True, separators=(",", ":"), ensure_ascii=False
+    )
+    return hashlib.sha256(canonical.encode("utf-8")).hexdigest(), deployment
+
+class ResponseStore:
+    """SQLite table of recorded responses: status, headers and body chunks by request key"""
+
+    def __init__(self, path):
+        self.path = path
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            """CREATE TABLE IF NOT EXISTS llm_responses (
+                   key TEXT PRIMARY KEY,
+                   deployment TEXT NOT NULL,
+                   request TEXT NOT NULL,
+                   status INTEGER NOT NULL,
+                   headers TEXT NOT NULL,
+                   body BLOB NOT NULL,
+                   chunk_sizes TEXT NOT NULL,
+                   recorded_at REAL NOT NULL
+               )"""
+        )
+        self._conn.commit()
+
+    def get(self, key):
+        """(status, headers, chunks) of a recorded response, or None"""
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT status, headers, body, chunk_sizes FROM llm_responses WHERE key = ?", (key,)
+            ).fetchone()
+        if row is None:
+            return None
+        status, headers, body, chunk_sizes = row
+        chunks, offset = [], 0
+        for size in json.loads(chunk_sizes):
+            chunks.append(body[offset:offset + size])
+            offset += size
+        return status, json.loads(headers), chunks
+
+    def put(self, key, deployment, request, status, headers, chunks):
+        with self._lock:
+            self._conn.execute(
+                """INSERT OR REPLACE INTO llm_responses
+                   (key, deployment, request, status, headers, body, chunk_sizes, recorded_at)
+                   VALUES (?, ?, ?, ?, ?, ?, ?, ?)""",
+                (key, deployment, request.content.decode("utf-8", "replace"), status, json.dumps(headers),
+                 b"".join(chunks), json.dumps([len(chunk) for chunk in chunks]), time.time())
+            )
+            self._conn.commit()
+
+    def __len__(self):
+        with self._lock:
+            return self._conn.execute("SELECT COUNT(*) FROM llm_responses").fetchone()[0]
+
+class LLMResponseCache:
+    """Record/replay policy over a ResponseStore, applied through wrapped httpx transports"""
+
+    def __init__(self, path, mode="auto"):
+        if mode not in LLM_CACHE_MODES:
+            raise ValueError(f"Unknown LLM cache mode {mode!r}, expected one of {LLM_CACHE_MODES}")
+        self.mode = mode
+        self.store = ResponseStore(path)
+        self._stats_lock = threading.Lock()
+        self.counts = {"hits": 0, "misses": 0, "recorded": 0}
+
+    @property
+    def stats(self):
+        with self._stats_lock:
+            return dict(self.counts)
+
+    def _count(self, name):
+        with self._stats_lock:
+            self.counts[name] += 1
+
+    def lookup(self, request):
+        """(key, deployment, recorded response or None); the lookup is skipped when recording"""
+        key, deployment = request_key(request)
+        if self.mode == "record":
+            return key, deployment, None
+        recorded = self.store.get(key)
+        self._count("hits" if recorded else "misses")
+        return key, deployment, recorded
+
+    def replay(self, request, recorded):
+        status, headers, chunks = recorded
+        return httpx.Response(
+            status, headers=[*headers, ("x-llm-cache", "hit")], stream=ReplayStream(chunks), request=request
+        )
+
+    def miss(self, request, key):
+        """Error response for a replay miss; the SDK does not retry it"""
+        logging.error(f"LLM cache miss in replay mode for {request.url.path} (key {key})")
+        body = json.dumps({"error": {
+            "code": "llm_cache_miss",
+            "message": f"No recorded response for this request (key {key}) and LLM_CACHE_MODE is replay",
+        }}).encode("utf-8")
+        return httpx.Response(
+            404, headers={"content-type": "application/json", "x-should-retry": "false"},
+            stream=ReplayStream([body]), request=request
+        )
+
+    def recorder(self, request, key, deployment, response):
+        """Callback storing the response once its body has been read to the end"""
+        headers = [
+            (name, value) for name, value in response.headers.multi_items() if name.lower() not in SKIPPED_HEADERS
+        ]
+
+        def record(chunks):
+            try:
+                self.store.put(key, deployment, request, response.status_code, headers, chunks)
+                self._count("recorded")
+            except Exception as e:
+                logging.error(f"Failed to record LLM response for key {key}: {str(e)}")
+                logging.error(traceback.format_exc())
+        return record
+
+    def wrap(self, transport):
+        return CachingTransport(self, transport)
+
+    def wrap_async(self, transport):
+        return AsyncCachingTransport(self, transport)
+
+class ReplayStream(httpx.SyncByteStream, httpx.AsyncByteStream):
+    """Recorded body chunks, yielded one by one"""
+
+    def __init__(self, chunks):
+        self.chunks = chunks
+
+    def __iter__(self):
+        yield from self.chunks
+
+    async def __aiter__(self):
+        for chunk in self.chunks:
+            yield chunk
+
+class RecordingStream(httpx.SyncByteStream):
+    """Response body that is passed through and stored if it is read to the end"""
+
+    def __init__(self, stream, on_complete):
+        self.stream = stream
+        self.on_complete = on_complete
+        self.chunks = []
+
+    def __iter__(self):
+        for chunk in self.stream:
+            self.chunks.append(chunk)
+            yield chunk
+        self.on_complete(self.chunks)
+
+    def close(self):
+        self.stream.close()
+
+class AsyncRecordingStream(httpx.AsyncByteStream):
+    """Async response body that is passed through and stored if it is read to the end"""
+
+    def __init__(self, stream, on_complete):
+        self.stream = stream
+        self.on_complete = on_complete
+        self.chunks = []
+
+    async def __aiter__(self):
+        async for chunk in self.stream:
+            self.chunks.append(chunk)
+            yield chunk
+        await asyncio.to_thread(self.on_complete, self.chunks)
+
+    async def aclose(self):
+        await self.stream.aclose()
+
+class CachingTransport(httpx.BaseTransport):
+    """httpx transport serving and recording responses according to an LLMResponseCache"""
+
+    def __init__(self, cache, transport):
+        self.cache = cache
+        self.transport = transport
+
+    def handle_request(self, request):
+        if self.cache.mode == "off":
+            return self.transport.handle_request(request)
+        key, deployment, recorded = self.cache.lookup(request)
+        if recorded is not None:
+            return self.cache.replay(request, recorded)
+        if self.cache.mode == "replay":
+            return self.cache.miss(request, key)
+        response = self.transport.handle_request(request)
+        if response.status_code == 200:
+            response.stream = RecordingStream(
+                response.stream, self.cache.recorder(request, key, deployment, response)
+            )
+        return response
+
+    def close(self):
+        self.transport.close()
+
+class AsyncCachingTransport(httpx.AsyncBaseTransport):
+    """Async httpx transport serving and recording responses according to an LLMResponseCache"""
+
+    def __init__(self, cache, transport):
+        self.cache = cache
+        self.transport = transport
+
+    async def handle_async_request(self, request):
+        if self.cache.mode == "off":
+            return await self.transport.handle_async_request(request)
+        key, deployment, recorded = await asyncio.to_thread(self.cache.lookup, request)
+        if recorded is not None:
+            return self.cache.replay(request, recorded)
+        if self.cache.mode == "replay":
+            return self.cache.miss(request, key)
+        response = await self.transport.handle_async_request(request)
+        if response.status_code == 200:
+            response.stream = AsyncRecordingStream(
+                response.stream, self.cache.recorder(request, key, deployment, response)
+            )
+        return response
+
+    async def aclose(self):
+        await self.transport.aclose()
@@ -0,0 +1,369 @@
+import asyncio
+import json
+import logging
+import os
+import re
+import threading
+import time
+from collections import deque
+import httpx
+
+# Shared admission control for the Azure OpenAI deployments.
+#
+# The LLM and embedding clients send their requests through a
+# RateLimitedTransport (or its async twin), which looks up the limiter of the
+# deployment named in the URL. Each DeploymentLimiter enforces:
+#   - requests/min and tokens/min budgets as token buckets; a request reserves
+#     its share up front and waits until the bucket covers it, so callers are
+#     admitted strictly in arrival order
+#   - an AIMD concurrency limit: +1/limit per fast success, halved on a 429 or
+#     when a request takes longer than the latency target, at most once per
+#     round trip (requests sent before the last decrease no longer count)
+# A 429 pauses the deployment for the Retry-After period and the request is
+# queued again, so callers wait rather than fail; only after
+# RATE_LIMIT_MAX_RETRIES throttled attempts is the 429 returned to the client.
+
+RATE_LIMIT_MAX_RETRIES = int(os.getenv("RATE_LIMIT_MAX_RETRIES", "8"))
+
+DEPLOYMENT_RE = re.compile(r"/deployments/([^/]+)/")
+
+# Completion tokens assumed for a chat request that sets no max_tokens
+DEFAULT_COMPLETION_TOKENS = 512
+
+class TokenBucket:
+    """Budget refilled continuously at per_minute, holding at most one minute's worth"""
+
+    def __init__(self, per_minute):
+        self.rate = per_minute / 60.0
+        self.capacity = float(per_minute)
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+        self.lock = threading.Lock()
+
+    def reserve(self, amount):
+        """Take amount now (the balance may go negative) and return the seconds to wait before using it"""
+        with self.lock:
+            now = time.monotonic()
+            self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+            self.updated = now
+            self.tokens -= min(amount, self.capacity)
+            return max(0.0, -self.tokens / self.rate)
+
+class AdaptiveConcurrency:
+    """AIMD concurrency limit with one FIFO wait queue for threads and event loops alike"""
+
+    def __init__(self, initial, maximum, minimum=1, latency_target=30.0):
+        self.limit = float(initial)
+        self.maximum = maximum
+        self.minimum = minimum
+        self.latency_target = latency_target
+        self.in_flight = 0
+        self.waiters = deque()
+        self.lock = threading.Lock()
+        self.last_decrease = 0.0
+
+    def _admit_or_enqueue(self, waiter):
+        with self.lock:
+            if not self.waiters and self.in_flight < int(self.limit):
+                self.in_flight += 1
+                return True
+            self.waiters.append(waiter)
+            return False
+
+    def acquire(self):
+        """Wait (blocking the thread) for a slot"""
+        event = threading.Event()
+        if not self._admit_or_enqueue(event):
+            event.wait()
+
+    async def acquire_async(self):
+        """Wait (without blocking the event loop) for a slot"""
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        if self._admit_or_enqueue((loop, future)):
+            return
+        try:
+            await future
+        except asyncio.CancelledError:
+            with self.lock:
+                try:
+                    self.waiters.remove((loop, future))
+                    granted = False
+                except ValueError:
+                    granted = True
+            # The slot was granted just as the wait was cancelled
+            if granted:
+                self.release()
+            raise
+
+    def release(self):
+        with self.lock:
+            self.in_flight -= 1
+            self._wake()
+
+    def _wake(self):
+        while self.waiters and self.in_flight < int(self.limit):
+            waiter = self.waiters.popleft()
+            self.in_flight += 1
+            if isinstance(waiter, threading.Event):
+                waiter.set()
+            else:
+                loop, future = waiter
+                loop.call_soon_threadsafe(lambda future=future: future.done() or future.set_result(None))
+
+    def on_success(self, latency, sent):
+        """Record a successful request sent at sent (time.monotonic) that took latency seconds"""
+        with self.lock:
+            if latency > self.latency_target:
+                self._decrease("latency", sent)
+            else:
+                self.limit = min(self.maximum, self.limit + 1.0 / self.limit)
+            self._wake()
+
+    def on_throttled(self, sent):
+        """Record a 429 for a request sent at sent (time.monotonic)"""
+        with self.lock:
+            self._decrease("429", sent)
+
+    def _decrease(self, reason, sent):
+        # Requests sent before the last decrease report the overload that
+        # decrease already answered; only those sent at the lowered limit count
+        if sent < self.last_decrease:
+            return
+        self.last_decrease = time.monotonic()
+        self.limit = max(self.minimum, self.limit / 2)
+        logging.warning(f"Concurrency limit lowered to {int(self.limit)} ({reason})")
+
+def estimate_tokens(request):
+    """Rough token count of an OpenAI request: prompt characters / 4 plus the completion budget"""
+    try:
+        body = json.loads(request.content or b"{}")
+    except (ValueError, UnicodeDecodeError):
+        return 1
+    if "messages" in body:
+        characters = len(json.dumps(body["messages"]))
+        return characters // 4 + (body.get("max_tokens") or body.get("max_completion_tokens") or DEFAULT_COMPLETION_TOKENS)
+    if "input" in body:
+        texts = body["input"] if isinstance(body["input"], list) else [body["input"]]
+        return sum(len(str(text)) for text in texts) // 4 + 1
+    return 1
+
+def retry_after(response, attempt):
+    """Seconds to pause after a 429, from the Retry-After headers or exponential backoff"""
+    for header, scale in (("retry-after-ms", 0.001), ("retry-after", 1.0)):
+        value = response.headers.get(header)
+        if value:
+            try:
+                return float(value) * scale
+            except ValueError:
+                pass
+    return min(30.0, 2.0 ** attempt)
+
+class DeploymentLimiter:
+    """Request, token and concurrency limits of one deployment"""
+
+    def __init__(self, name, requests_per_minute=60, tokens_per_minute=60000,
+                 max_concurrency=8, initial_concurrency=None, latency_target=30.0):
+        self.name = name
+        self.requests = TokenBucket(requests_per_minute)
+        self.tokens = TokenBucket(tokens_per_minute)
+        self.concurrency = AdaptiveConcurrency(
+            initial_concurrency or max_concurrency, max_concurrency, latency_target=latency_target
+        )
+        self.paused_until = 0.0
+        self.lock = threading.Lock()
+        self.counts = {"requests": 0, "throttled": 0, "queued_seconds": 0.0}
+
+    def delay(self, tokens):
+        """Reserve budget for a request and return how long it must wait before being sent"""
+        with self.lock:
+            pause = self.paused_until - time.monotonic()
+        return max(self.requests.reserve(1), self.tokens.reserve(tokens), pause, 0.0)
+
+    def throttled(self, pause, sent):
+        self.concurrency.on_throttled(sent)
+        with self.lock:
+            self.paused_until = max(self.paused_until, time.monotonic() + pause)
+            self.counts["throttled"] += 1
+        logging.warning(f"{self.name} returned 429, pausing {pause:.1f}s")
+
+    def sent(self, waited):
+        with self.lock:
+            self.counts["requests"] += 1
+            self.counts["queued_seconds"] += waited
+
+    @property
+    def stats(self):
+        with self.lock:
+            stats = dict(self.counts)
+        stats["concurrency_limit"] = int(self.concurrency.limit)
+        stats["in_flight"] = self.concurrency.in_flight
+        stats["waiting"] = len(self.concurrency.waiters)
+        return stats
+
+class RateLimitRegistry:
+    """Deployment name -> DeploymentLimiter, created on first use from the configured limits"""
+
+    def __init__(self, **default_limits):
+        self.default_limits = default_limits
+        self.limits = {}
+        self.limiters = {}
+        self.lock = threading.Lock()
+
+    def configure(self, deployment, **limits):
+        self.limits[deployment] = limits
+
+    def get(self, deployment):
+        with self.lock:
+            if deployment not in self.limiters:
+                limits = self.limits.get(deployment, self.default_limits)
+                self.limiters[deployment] = DeploymentLimiter(deployment, **limits)
+            return self.limiters[deployment]
+
+    def for_request(self, request):
+        match = DEPLOYMENT_RE.search(request.url.path)
+        return self.get(match.group(1) if match else request.url.host)
+
+    @property
+    def stats(self):
+        with self.lock:
+            limiters = dict(self.limiters)
+        return {name: limiter.stats for name, limiter in limiters.items()}
+
+class ReleasingStream(httpx.SyncByteStream):
+    """Response body that frees the concurrency slot when it is closed"""
+
+    def __init__(self, stream, on_close):
+        self.stream = stream
+        self.on_close = on_close
+
+    def __iter__(self):
+        yield from self.stream
+
+    def close(self):
+        try:
+            self.stream.close()
+        finally:
+            if self.on_close is not None:
+                self.on_close, on_close = None, self.on_close
+                on_close()
+
+class AsyncReleasingStream(httpx.AsyncByteStream):
+    """Async response body that frees the concurrency slot when it is closed"""
+
+    def __init__(self, stream, on_close):
+        self.stream = stream
+        self.on_close = on_close
+
+    async def __aiter__(self):
+        async for chunk in self.stream:
+            yield chunk
+
+    async def aclose(self):
+        try:
+            await self.stream.aclose()
+        finally:
+            if self.on_close is not None:
+                self.on_close, on_close = None, self.on_close
+                on_close()
+
+def finisher(limiter, start, response):
+    """Callback that releases the request's slot, recording its latency if it succeeded"""
+    success = response.is_success
+    def finish():
+        if success:
+            limiter.concurrency.on_success(time.monotonic() - start, start)
+        limiter.concurrency.release()
+    return finish
+
+class RateLimitedTransport(httpx.BaseTransport):
+    """httpx transport that admits requests through the registry's limiters"""
+
+    def __init__(self, registry, transport=None, max_retries=RATE_LIMIT_MAX_RETRIES):
+        self.registry = registry
+        self.transport = transport or httpx.HTTPTransport()
+        self.max_retries = max_retries
+
+    def handle_request(self, request):
+        limiter = self.registry.for_request(request)
+        tokens = estimate_tokens(request)
+        for attempt in range(self.max_retries + 1):
+            queued = time.monotonic()
+            limiter.concurrency.acquire()
+            try:
+                time.sleep(limiter.delay(tokens))
+                limiter.sent(time.monotonic() - queued)
+                start = time.monotonic()
+                response = self.transport.handle_request(request)
+            except BaseException:
+                limiter.concurrency.release()
+                raise
+            if response.status_code == 429 and attempt < self.max_retries:
+                response.close()
+                limiter.concurrency.release()
+                limiter.throttled(retry_after(response, attempt), start)
+                continue
+            if response.status_code == 429:
+                # Out of retries: the 429 goes back to the client
+                limiter.throttled(retry_after(response, attempt), start)
+            response.stream = ReleasingStream(response.stream, finisher(limiter, start, response))
+            return response
+
+    def close(self):
+        self.transport.close()
+
+class AsyncRateLimitedTransport(httpx.AsyncBaseTransport):
+    """Async httpx transport that admits requests through the registry's limiters"""
+
+    def __init__(self, registry, transport=None, max_retries=RATE_LIMIT_MAX_RETRIES):
+        self.registry = registry
+        self.transport = transport or httpx.AsyncHTTPTransport()
+        self.max_retries = max_retries
+
+    async def handle_async_request(self, request):
+        limiter = self.registry.for_request(request)
+        tokens = estimate_tokens(request)
+        for attempt in range(self.max_retries + 1):
+            queued = time.monotonic()
+            await limiter.concurrency.acquire_async()
+            try:
+                await asyncio.sleep(limiter.delay(tokens))
+                limiter.sent(time.monotonic() - queued)
+                start = time.monotonic()
+                response = await self.transport.handle_async_request(request)
+            except BaseException:
+                limiter.concurrency.release()
+                raise
+            if response.status_code == 429 and attempt < self.max_retries:
+                await response.aclose()
+                limiter.concurrency.release()
+                limiter.throttled(retry_after(response, attempt), start)
+                continue
+            if response.status_code == 429:
+                # Out of retries: the 429 goes back to the client
+                limiter.throttled(retry_after(response, attempt), start)
+            response.stream = AsyncReleasingStream(response.stream, finisher(limiter, start, response))
+            return response
+
+    async def aclose(self):
+        await self.transport.aclose()
+
+def rate_limited_clients(registry, timeout=None, cache=None, instrumentation=None):
+    """(httpx.Client, httpx.AsyncClient) pair routed through the registry, for the OpenAI SDK clients.
+
+    A cache (llm_cache.LLMResponseCache) sits in front of the limiter, so
+    cached responses never wait for budget. Instrumentation
+    (instrumentation.Instrumentation) wraps both, so its llm spans include the
+    time queued for budget and cover cached responses too.
+    """
+    timeout = timeout or httpx.Timeout(600.0, connect=10.0)
+    transport = RateLimitedTransport(registry)
+    async_transport = AsyncRateLimitedTransport(registry)
+    if cache is not None:
+        transport, async_transport = cache.wrap(transport), cache.wrap_async(async_transport)
+    if instrumentation is not None:
+        transport, async_transport = instrumentation.wrap(transport), instrumentation.wrap_async(async_transport)
+    return (
+        httpx.Client(transport=transport, timeout=timeout),
+        httpx.AsyncClient(transport=async_transport, timeout=timeout),
+    )
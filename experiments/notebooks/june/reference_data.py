@@ -0,0 +1,186 @@
+import json
+import logging
+import os
+import threading
+import time
+from azure.storage.blob import BlobClient
+
+# Reference data shared by the agent tools (existing submissions, the stage 3
+# datasets, the submission template).
+#
+# Each dataset is read and parsed once per worker and kept in memory, by
+# default as a column-oriented ReferenceDataset with hash indexes on the keys
+# the tools query by. Before a dataset is served its source is checked (at most
+# every REFERENCE_DATA_CHECK_INTERVAL seconds) and it is reloaded only when the
+# file's mtime/size or the blob's ETag has changed. A failed reload keeps the
+# previous version in service.
+
+REFERENCE_DATA_CHECK_INTERVAL = float(os.getenv("REFERENCE_DATA_CHECK_INTERVAL", "10"))
+
+# Marks a field that is absent from a record (as opposed to present with null)
+MISSING = object()
+
+class FileSource:
+    """A JSON file on local disk, versioned by modification time and size"""
+
+    def __init__(self, path):
+        self.path = path
+
+    def __str__(self):
+        return self.path
+
+    def version(self):
+        stat = os.stat(self.path)
+        return (stat.st_mtime_ns, stat.st_size)
+
+    def read(self):
+        """Return (version, content bytes)"""
+        version = self.version()
+        with open(self.path, "rb") as file:
+            return version, file.read()
+
+class BlobSource:
+    """A JSON blob in Azure Storage, versioned by ETag"""
+
+    def __init__(self, connection_string, container_name, blob_name):
+        self.connection_string = connection_string
+        self.container_name = container_name
+        self.blob_name = blob_name
+        self._blob_client = None
+
+    def __str__(self):
+        return f"{self.container_name}/{self.blob_name}"
+
+    def blob_client(self):
+        # Created on first use so registering a source needs no connection
+        if self._blob_client is None:
+            self._blob_client = BlobClient.from_connection_string(
+                self.connection_string, container_name=self.container_name, blob_name=self.blob_name
+            )
+        return self._blob_client
+
+    def version(self):
+        return self.blob_client().get_blob_properties().etag
+
+    def read(self):
+        """Return (version, content bytes); the ETag comes from the same download"""
+        downloader = self.blob_client().download_blob()
+        return downloader.properties.etag, downloader.readall()
+
+def field_value(record, path):
+    """Value at a dotted path (e.g. "property_information.location"), or None"""
+    value = record
+    for part in path.split("."):
+        if not isinstance(value, dict):
+            return None
+        value = value.get(part)
+    return value
+
+class ReferenceDataset:
+    """Read-only, column-oriented table of JSON records with hash indexes on chosen keys.
+
+    keys maps an index name to (field paths, normalise function): a record is
+    indexed under the normalised value of the first of its fields that is set,
+    and lookups normalise the queried value the same way.
+    """
+
+    __slots__ = ("fields", "columns", "size", "keys", "indexes")
+
+    def __init__(self, records, keys=None):
+        self.fields = list(dict.fromkeys(field for record in records for field in record))
+        self.columns = {
+            field: [record.get(field, MISSING) for record in records]
+            for field in self.fields
+        }
+        self.size = len(records)
+        self.keys = keys or {}
+        self.indexes = {}
+        for name, (paths, normalize) in self.keys.items():
+            index = {}
+            for i, record in enumerate(records):
+                key = self._key(record, paths, normalize)
+                if key:
+                    index.setdefault(key, []).append(i)
+            self.indexes[name] = {key: tuple(rows) for key, rows in index.items()}
+
+    def __len__(self):
+        return self.size
+
+    @staticmethod
+    def _key(record, paths, normalize):
+        for path in paths:
+            value = field_value(record, path)
+            if value:
+                return normalize(str(value))
+        return None
+
+    def record(self, i):
+        """Row i as a dict"""
+        return {
+            field: value
+            for field in self.fields
+            if (value := self.columns[field][i]) is not MISSING
+        }
+
+    def records(self, rows=None):
+        """The given rows (default: every row) as dicts, in order"""
+        return [self.record(i) for i in (range(self.size) if rows is None else rows)]
+
+    def lookup(self, index, value):
+        """Rows whose index key equals the normalised value"""
+        paths, normalize = self.keys[index]
+        return self.indexes[index].get(normalize(str(value)), ())
+
+    def find(self, index, value):
+        """Records whose index key equals the normalised value"""
+        return self.records(self.lookup(index, value))
+
+class ReferenceDataStore:
+    """Registry of reference datasets, each loaded once and reloaded when its source changes"""
+
+    def __init__(self, check_interval=REFERENCE_DATA_CHECK_INTERVAL):
+        self.check_interval = check_interval
+        self._entries = {}
+
+    def register(self, name, source, keys=None, build=None):
+        """Register a source; build turns the parsed JSON into the served object (default: ReferenceDataset)"""
+        self._entries[name] = {
+            "source": source,
+            "build": build or (lambda data: ReferenceDataset(data, keys)),
+            "lock": threading.Lock(),
+            "version": None,
+            "value": None,
+            "checked_at": 0.0,
+        }
+
+    def version(self, name):
+        """Version of the loaded copy of a dataset (None before the first load)"""
+        return self._entries[name]["version"]
+
+    def get(self, name):
+        """Return the dataset, loading it on first use and reloading it if its source changed"""
+        entry = self._entries[name]
+        with entry["lock"]:
+            now = time.monotonic()
+            if entry["value"] is not None and now - entry["checked_at"] < self.check_interval:
+                return entry["value"]
+            try:
+                if entry["value"] is None or entry["source"].version() != entry["version"]:
+                    self._load(name, entry)
+                entry["checked_at"] = now
+            except Exception as e:
+                if entry["value"] is None:
+                    raise
+                logging.error(f"Failed to reload reference data {name} from {entry['source']}, "
+                              f"keeping the loaded version: {str(e)}")
+                entry["checked_at"] = now
+            return entry["value"]
+
+    def _load(self, name, entry):
+        start = time.perf_counter()
+        version, content = entry["source"].read()
+        value = entry["build"](json.loads(content))
+        entry["value"], entry["version"] = value, version
+        size = f"{len(value)} records" if isinstance(value, ReferenceDataset) else "document"
+        logging.info(f"Loaded reference data {name} ({size}) from {entry['source']} "
+                     f"in {time.perf_counter() - start:.3f}s")
@@ -0,0 +1,134 @@
+import logging
+import os
+import socket
+import uuid
+from contextlib import contextmanager
+
+# Work queue over the submissions table for the agentic stage workers.
+#
+# A worker claims submissions waiting at its stage with SELECT ... FOR UPDATE
+# SKIP LOCKED, so concurrent workers never claim the same row, and stamps them
+# with a lease (claimed_by, claimed_at) in the same short transaction. No
+# transaction is held open while the agents run. When a submission has been
+# processed its workflow_stage is advanced and the lease cleared in one UPDATE
+# that only succeeds if this worker still holds the lease; a failed submission
+# is released for another attempt. A released submission keeps claimed_at as
+# the time it may be retried, STAGE_RETRY_SECONDS after the first failure and
+# doubling after each one, and after STAGE_MAX_ATTEMPTS failures at a stage it
+# moves to workflow_stage 'failed'. Leases older than STAGE_LEASE_SECONDS
+# (a crashed worker) can be claimed again.
+
+# workflow_stage each agentic stage consumes, and the one it advances to
+STAGE_TRANSITIONS = {
+    1: ("extraction", "core-data"),
+    2: ("core-data", "enrichment"),
+    3: ("enrichment", "rank"),
+    4: ("rank", "completed"),
+}
+
+STAGE_LEASE_SECONDS = int(os.getenv("STAGE_LEASE_SECONDS", "900"))
+STAGE_RETRY_SECONDS = int(os.getenv("STAGE_RETRY_SECONDS", "60"))
+STAGE_MAX_ATTEMPTS = int(os.getenv("STAGE_MAX_ATTEMPTS", "3"))
+
+# workflow_stage of submissions that failed STAGE_MAX_ATTEMPTS times at a stage
+FAILED_STAGE = "failed"
+
+CLAIM_SQL = """
+    WITH next AS (
+        SELECT id FROM submissions
+        WHERE workflow_stage = %s
+          AND (claimed_at IS NULL
+               OR (claimed_by IS NULL AND claimed_at <= CURRENT_TIMESTAMP)
+               OR claimed_at < CURRENT_TIMESTAMP - %s * INTERVAL '1 second')
+        ORDER BY submitted_at, created_at
+        LIMIT %s
+        FOR UPDATE SKIP LOCKED
+    )
+    UPDATE submissions SET claimed_by = %s, claimed_at = CURRENT_TIMESTAMP
+    FROM next WHERE submissions.id = next.id
+    RETURNING submissions.id
+"""
+
+ADVANCE_SQL = """
+    UPDATE submissions
+    SET workflow_stage = %s, claimed_by = NULL, claimed_at = NULL, stage_attempts = 0, updated_at = CURRENT_TIMESTAMP
+    WHERE id = %s AND workflow_stage = %s AND claimed_by = %s
+"""
+
+# The right-hand sides see the row before the update, so stage_attempts + 1
+# is the number of failures including this one
+RELEASE_SQL = """
+    UPDATE submissions
+    SET claimed_by = NULL,
+        stage_attempts = stage_attempts + 1,
+        workflow_stage = CASE WHEN stage_attempts + 1 >= %s THEN %s ELSE workflow_stage END,
+        claimed_at = CASE WHEN stage_attempts + 1 >= %s THEN NULL
+                          ELSE CURRENT_TIMESTAMP + LEAST(%s * POWER(2, stage_attempts), %s) * INTERVAL '1 second' END,
+        updated_at = CURRENT_TIMESTAMP
+    WHERE id = %s AND workflow_stage = %s AND claimed_by = %s
+    RETURNING workflow_stage, stage_attempts
+"""
+
+@contextmanager
+def pooled_cursor(pool):
+    """Cursor on a pooled connection in its own transaction, committed on success and rolled back on error"""
+    conn = pool.getconn()
+    try:
+        with conn:
+            with conn.cursor() as cursor:
+                yield cursor
+    finally:
+        pool.putconn(conn)
+
+def default_worker_id():
+    """Identifier of this worker process, unique across hosts and restarts"""
+    return os.getenv("STAGE_WORKER_ID") or f"{socket.gethostname()}-{os.getpid()}-{uuid.uuid4().hex[:8]}"
+
+class StageQueue:
+    """Claims, advances and releases submissions by workflow_stage"""
+
+    def __init__(self, pool, worker_id=None, lease_seconds=STAGE_LEASE_SECONDS,
+                 retry_seconds=STAGE_RETRY_SECONDS, max_attempts=STAGE_MAX_ATTEMPTS):
+        self.pool = pool
+        self.worker_id = worker_id or default_worker_id()
+        self.lease_seconds = lease_seconds
+        self.retry_seconds = retry_seconds
+        self.max_attempts = max_attempts
+
+    def claim(self, stage, limit):
+        """Lease up to limit submissions waiting at the stage, oldest first, and return their ids"""
+        waiting_stage, _ = STAGE_TRANSITIONS[stage]
+        with pooled_cursor(self.pool) as cursor:
+            cursor.execute(CLAIM_SQL, (waiting_stage, self.lease_seconds, limit, self.worker_id))
+            submission_ids = [str(row[0]) for row in cursor.fetchall()]
+        if submission_ids:
+            logging.info(f"Worker {self.worker_id} claimed {len(submission_ids)} submissions at stage {stage}")
+        return submission_ids
+
+    def advance(self, submission_id, stage):
+        """Move a claimed submission to the next workflow_stage; False if the lease was lost meanwhile"""
+        waiting_stage, next_stage = STAGE_TRANSITIONS[stage]
+        with pooled_cursor(self.pool) as cursor:
+            cursor.execute(ADVANCE_SQL, (next_stage, submission_id, waiting_stage, self.worker_id))
+            advanced = cursor.rowcount == 1
+        if advanced:
+            logging.info(f"Submission {submission_id} advanced to {next_stage}")
+        else:
+            logging.warning(f"Submission {submission_id} was not advanced: its stage {stage} lease is no longer held")
+        return advanced
+
+    def release(self, submission_id, stage):
+        """Give up the lease on a failed submission: it is retried after a backoff, or marked failed after max_attempts"""
+        waiting_stage, _ = STAGE_TRANSITIONS[stage]
+        with pooled_cursor(self.pool) as cursor:
+            cursor.execute(RELEASE_SQL, (
+                self.max_attempts, FAILED_STAGE, self.max_attempts, self.retry_seconds, self.lease_seconds,
+                submission_id, waiting_stage, self.worker_id
+            ))
+            row = cursor.fetchone()
+        if row is None:
+            logging.warning(f"Submission {submission_id} was not released: its stage {stage} lease is no longer held")
+        elif row[0] == FAILED_STAGE:
+            logging.error(f"Submission {submission_id} failed {row[1]} times at stage {stage} and was marked {FAILED_STAGE}")
+        else:
+            logging.info(f"Submission {submission_id} released at stage {stage} after {row[1]} failed attempts")
@@ -0,0 +1,561 @@
+import argparse
+import asyncio
+import contextlib
+import datetime
+import json
+import logging
+import os
+import platform
+import queue
+import random
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import tracemalloc
+import uuid
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+from fake_openai import DEFAULT_CONFIG, start_fake_openai
+from stage_queue import STAGE_TRANSITIONS
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+# Offline throughput benchmark of the four agentic stages.
+#
+# function_app is imported with its Azure dependencies replaced by local
+# stand-ins: a fake Azure OpenAI endpoint in a child process (fake_openai.py),
+# an in-memory submissions table behind the psycopg2 pool and an in-memory
+# submission template blob. A synthetic corpus of submissions is queued at
+# 'extraction' and drained through stages 1 and 2 by run_stage_jobs, exactly as
+# the HTTP triggers do; the stage 3 and 4 triggers (which still carry their
+# built-in sample submission) are called --submissions times each.
+#
+# Per stage the results give throughput, p50/p95/p99 latency per submission,
+# LLM wait (time the fake endpoint spent serving, summed over requests) against
+# the process CPU time, and the memory high-water mark, plus function_app's
+# per-stage span percentiles (see instrumentation.py), as JSON so runs can be
+# diffed between commits:
+#
+#   cd experiments/notebooks/june
+#   python testing/benchmark_stages.py --submissions 40 --output stages.json
+#   python testing/benchmark_stages.py --baseline stages.json
+
+STAGE_1_FIELDS = [
+    "broker", "insured", "address", "building_type", "construction", "year_built", "area", "stories",
+    "occupancy", "sprinklers", "alarm_system", "building_value", "contents_value", "business_interruption",
+    "deductible", "fire_hazards", "natural_disasters", "security", "property_valuation", "annual_revenue",
+    "source_file",
+]
+
+NAME_PARTS = (
+    ["Green", "North", "Blue", "Silver", "Oak", "River", "Summit", "Harbour", "Coffee", "Atlas", "Bright", "Iron"],
+    ["Tech", "wind", "Haven", "Stone", "field", "Logistics", "Foods", "Works", "Bakery", "Print", "Motors", "Labs"],
+    ["Solutions", "Holdings", "Trading", "Services", "Group", "Partners", ""],
+    ["Ltd", "Limited", "PLC", "LLP"],
+)
+STREETS = ["High Street", "Station Road", "Church Lane", "Mill Road", "Park Avenue", "King Street", "Queens Road"]
+POSTCODES = ["EC1A 1BB", "SW1A 2AA", "M1 1AE", "B33 8TH", "LS1 4AP", "G1 1XQ", "CF10 1EP", "BS1 5TR", "NE1 7RU"]
+BROKERS = ["Prime Insurance Brokers", "Marsh Lane Brokers", "Citywide Risk Partners", "Harbour Brokers"]
+OCCUPANCIES = ["Office", "Warehouse", "Restaurant", "Retail shop", "Light manufacturing", "Hotel", "Bakery"]
+
+PROPERTY_TEMPLATE = {
+    "Broker Information": {"broker": "", "contact_person": "", "email": ""},
+    "Insured Information": {"insured": "", "address": "", "annual_revenue": ""},
+    "Property Details": {field: "" for field in STAGE_1_FIELDS[3:10]},
+    "Coverage": {field: "" for field in STAGE_1_FIELDS[11:15]},
+    "Risk": {field: "" for field in STAGE_1_FIELDS[15:18]},
+}
+
+def company_name(rng):
+    return " ".join(part for part in (rng.choice(parts) for parts in NAME_PARTS) if part).replace("  ", " ")
+
+def submission_row(rng, created_at, stage):
+    street_number = rng.randint(1, 400)
+    insured = company_name(rng)
+    return {
+        "id": str(uuid.UUID(int=rng.getrandbits(128))),
+        "broker": rng.choice(BROKERS),
+        "insured": insured,
+        "address": f"{street_number} {rng.choice(STREETS)}, London {rng.choice(POSTCODES)}",
+        "building_type": rng.choice(["Commercial", "Industrial", "Mixed use"]),
+        "construction": rng.choice(["Brick", "Steel frame", "Reinforced concrete", "Timber frame"]),
+        "year_built": str(rng.randint(1900, 2020)),
+        "area": f"{rng.randint(100, 20000)} sqm",
+        "stories": str(rng.randint(1, 12)),
+        "occupancy": rng.choice(OCCUPANCIES),
+        "sprinklers": rng.choice(["Yes", "No", ""]),
+        "alarm_system": rng.choice(["Yes", "No", "Monitored"]),
+        "building_value": f"${rng.randint(1, 50) * 100000:,}",
+        "contents_value": f"${rng.randint(1, 20) * 50000:,}",
+        "business_interruption": f"${rng.randint(1, 10) * 100000:,}",
+        "deductible": f"${rng.choice([1000, 2500, 5000, 10000]):,}",
+        "fire_hazards": rng.choice(["None known", "Commercial kitchen", "Flammable storage"]),
+        "natural_disasters": rng.choice(["Low flood risk", "Flood zone 2", "None"]),
+        "security": rng.choice(["CCTV", "24/7 guard", "Alarm only"]),
+        "property_valuation": f"${rng.randint(1, 80) * 100000:,}",
+        "annual_revenue": f"${rng.randint(1, 200) * 100000:,}",
+        "source_file": f"submission_{created_at:%Y%m%d%H%M%S%f}.eml",
+        "submitted_at": created_at,
+        "created_at": created_at,
+        "workflow_stage": stage,
+        "claimed_by": None,
+        "claimed_at": None,
+        "stage_attempts": 0,
+    }
+
+def build_corpus(count, existing, duplicate_rate, seed):
+    """Existing (already processed) submissions plus count new ones at 'extraction', some of them near-duplicates"""
+    rng = random.Random(seed)
+    created_at = datetime.datetime(2025, 1, 1)
+    rows = []
+    for _ in range(existing):
+        created_at += datetime.timedelta(minutes=rng.randint(1, 30))
+        rows.append(submission_row(rng, created_at, "completed"))
+    for _ in range(count):
+        created_at += datetime.timedelta(minutes=rng.randint(1, 30))
+        row = submission_row(rng, created_at, "extraction")
+        if rows and rng.random() < duplicate_rate:
+            # Resubmission of an earlier risk, possibly with small edits
+            original = rng.choice(rows)
+            row["insured"] = rng.choice([original["insured"], original["insured"].replace("Ltd", "Limited")])
+            row["address"] = rng.choice([original["address"], original["address"].upper()])
+            row["broker"] = rng.choice([original["broker"], row["broker"]])
+            row["occupancy"] = original["occupancy"]
+        rows.append(row)
+    return rows
+
+class MemoryDatabase:
+    """In-memory stand-in for the submissions and duplicate_info tables, answering the statements function_app runs"""
+
+    def __init__(self, rows, latency=0.0):
+        self.rows = {row["id"]: row for row in rows}
+        self.duplicate_info = []
+        self.latency = latency
+        self.lock = threading.Lock()
+
+    def waiting(self, stage):
+        with self.lock:
+            return sum(1 for row in self.rows.values() if row["workflow_stage"] == stage and row["claimed_by"] is None)
+
+    def set_stage(self, submission_id, stage):
+        with self.lock:
+            self.rows[submission_id].update(workflow_stage=stage, claimed_by=None, claimed_at=None)
+
+    def execute(self, sql, params):
+        """(result rows, rowcount) of one statement"""
+        if self.latency:
+            time.sleep(self.latency)
+        statement = " ".join(sql.split())
+        with self.lock:
+            if statement.startswith("WITH next AS"):
+                stage, _, limit, worker_id = params
+                now = datetime.datetime.now()
+                waiting = sorted(
+                    (row for row in self.rows.values() if row["workflow_stage"] == stage and row["claimed_by"] is None
+                     and (row["claimed_at"] is None or row["claimed_at"] <= now)),
+                    key=lambda row: (row["submitted_at"], row["created_at"])
+                )[:limit]
+                for row in waiting:
+                    row.update(claimed_by=worker_id, claimed_at=datetime.datetime.now())
+                return [(row["id"],) for row in waiting], len(waiting)
+            if statement.startswith("UPDATE submissions SET workflow_stage"):
+                next_stage, submission_id, stage, worker_id = params
+                row = self.rows.get(submission_id)
+                if row is None or row["workflow_stage"] != stage or row["claimed_by"] != worker_id:
+                    return [], 0
+                row.update(workflow_stage=next_stage, claimed_by=None, claimed_at=None, stage_attempts=0)
+                return [], 1
+            if statement.startswith("UPDATE submissions SET claimed_by = NULL"):
+                max_attempts, failed_stage, _, retry_seconds, max_backoff, submission_id, stage, worker_id = params
+                row = self.rows.get(submission_id)
+                if row is None or row["workflow_stage"] != stage or row["claimed_by"] != worker_id:
+                    return [], 0
+                backoff = min(retry_seconds * 2 ** row["stage_attempts"], max_backoff)
+                row["stage_attempts"] += 1
+                if row["stage_attempts"] >= max_attempts:
+                    row.update(workflow_stage=failed_stage, claimed_by=None, claimed_at=None)
+                else:
+                    row.update(claimed_by=None, claimed_at=datetime.datetime.now() + datetime.timedelta(seconds=backoff))
+                return [(row["workflow_stage"], row["stage_attempts"])], 1
+            if statement.startswith("SELECT") and " FROM submissions" in statement:
+                columns = [column.strip().strip('"') for column in statement[7:statement.index(" FROM ")].split(",")]
+                if "WHERE id = %s" in statement:
+                    rows = [self.rows[params[0]]] if params[0] in self.rows else []
+                else:
+                    rows = sorted(self.rows.values(), key=lambda row: row["created_at"])
+                    if "WHERE created_at >= %s" in statement:
+                        rows = [row for row in rows if row["created_at"] >= params[0]]
+                return [tuple(row[column] for column in columns) for row in rows], len(rows)
+            if statement.startswith("INSERT INTO duplicate_info"):
+                if any(params[:2] == existing[:2] for existing in self.duplicate_info):
+                    return [], 0
+                self.duplicate_info.append(params)
+                return [], 1
+        raise NotImplementedError(f"The benchmark database does not handle: {statement[:200]}")
+
+class MemoryCursor:
+    def __init__(self, database):
+        self.database = database
+        self.results = []
+        self.rowcount = -1
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        return False
+
+    def execute(self, sql, params=()):
+        self.results, self.rowcount = self.database.execute(sql, params)
+
+    def fetchone(self):
+        return self.results[0] if self.results else None
+
+    def fetchall(self):
+        return list(self.results)
+
+    def close(self):
+        pass
+
+class MemoryConnection:
+    def __init__(self, database):
+        self.database = database
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        return False
+
+    def cursor(self):
+        return MemoryCursor(self.database)
+
+class MemoryPool:
+    """Stand-in for psycopg2.pool.ThreadedConnectionPool"""
+
+    def __init__(self, database):
+        self.database = database
+
+    def getconn(self):
+        return MemoryConnection(self.database)
+
+    def putconn(self, conn):
+        pass
+
+    def closeall(self):
+        pass
+
+class MemoryBlobSource:
+    """Stand-in for reference_data.BlobSource serving a fixed JSON document"""
+
+    def __init__(self, document, latency=0.0):
+        self.content = json.dumps(document).encode("utf-8")
+        self.latency = latency
+
+    def __str__(self):
+        return "memory://submission-template"
+
+    def version(self):
+        time.sleep(self.latency)
+        return "etag-0"
+
+    def read(self):
+        time.sleep(self.latency)
+        return "etag-0", self.content
+
+def configure_environment(args, endpoint, work_dir):
+    """Point function_app at the fake endpoint and at scratch storage before it is imported"""
+    os.environ.update({
+        "AZURE_OPENAI_ENDPOINT": endpoint,
+        "AZURE_OPENAI_API_KEY": "benchmark",
+        "AZURE_GPT_API_VERSION": "2024-06-01",
+        "AZURE_GPT_MODEL_NAME": "gpt-4o",
+        "AZURE_GPT_DEPLOYMENT_NAME": "gpt-benchmark",
+        "AZURE_EMBEDDING_API_VERSION": "2024-06-01",
+        "AZURE_EMBEDDING_MODEL_NAME": "text-embedding-ada-002",
+        "AZURE_EMBEDDING_DEPLOYMENT_NAME": "embedding-benchmark",
+        "AZURE_STORAGE_CONNECTION_STRING": "",
+        "LLM_CACHE_MODE": "off",
+        "STAGE_BATCH_SIZE": str(args.concurrency),
+        "EMBEDDING_CACHE_PATH": os.path.join(work_dir, "embedding_cache.sqlite"),
+        "GUIDELINES_INDEX_DIR": os.path.join(work_dir, "stage4_index"),
+    })
+    # No client-side throttling unless the limits are set explicitly
+    for setting in ("LLM_REQUESTS_PER_MINUTE", "LLM_TOKENS_PER_MINUTE",
+                    "EMBEDDING_REQUESTS_PER_MINUTE", "EMBEDDING_TOKENS_PER_MINUTE"):
+        os.environ.setdefault(setting, "100000000")
+
+def load_function_app(database, template_latency):
+    """Import function_app with the database pool and the template blob replaced by the in-memory stand-ins"""
+    import psycopg2.pool
+    psycopg2.pool.ThreadedConnectionPool = lambda *args, **kwargs: MemoryPool(database)
+    import function_app
+    function_app.reference_data.register(
+        "property_template",
+        MemoryBlobSource(PROPERTY_TEMPLATE, template_latency),
+        build=function_app.format_property_template,
+    )
+    return function_app
+
+def user_function(handler):
+    """The coroutine function behind an @app.route handler"""
+    function = getattr(handler, "_function", None)
+    return function.get_user_function() if function is not None else handler
+
+def percentile(values, q):
+    """Nearest-rank percentile"""
+    if not values:
+        return None
+    values = sorted(values)
+    return values[max(0, min(len(values) - 1, int(round(q * len(values) + 0.5)) - 1))]
+
+def drain(stats_queue, settle=0.2):
+    """Request records reported by the fake endpoint since the last drain"""
+    records = []
+    deadline = time.monotonic() + settle
+    while True:
+        try:
+            records.append(stats_queue.get(timeout=max(0.0, deadline - time.monotonic())))
+        except queue.Empty:
+            return records
+
+def max_rss_bytes():
+    if resource is None:
+        return None
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return rss if sys.platform == "darwin" else rss * 1024
+
+async def measure(name, run, stats_queue, trace_memory):
+    """Run one stage's workload and return its metrics"""
+    drain(stats_queue, settle=0.0)
+    if trace_memory:
+        tracemalloc.reset_peak()
+    cpu_start, wall_start = time.process_time(), time.perf_counter()
+    with open(os.devnull, "w") as devnull, contextlib.redirect_stdout(devnull):
+        latencies, failures = await run()
+    wall, cpu = time.perf_counter() - wall_start, time.process_time() - cpu_start
+    requests = drain(stats_queue)
+    chat = [record for record in requests if record["kind"] == "chat"]
+    embeddings = [record for record in requests if record["kind"] == "embedding"]
+    processed = len(latencies)
+    llm_wait = sum(record["seconds"] for record in requests)
+
+    def rounded(value, digits=4):
+        return round(value, digits) if value is not None else None
+
+    def per_submission(value):
+        return rounded(value / processed) if processed else None
+
+    result = {
+        "submissions": processed,
+        "failures": failures,
+        "wall_seconds": rounded(wall, 3),
+        "throughput_per_minute": rounded(60 * processed / wall, 2),
+        "latency_seconds": {
+            "p50": rounded(percentile(latencies, 0.50)),
+            "p95": rounded(percentile(latencies, 0.95)),
+            "p99": rounded(percentile(latencies, 0.99)),
+            "mean": per_submission(sum(latencies)),
+            "max": rounded(max(latencies, default=None)),
+        },
+        "llm": {
+            "chat_requests": len(chat),
+            "embedding_requests": len(embeddings),
+            "tool_calls": sum(record["tool_calls"] for record in chat),
+            "prompt_tokens": sum(record["prompt_tokens"] for record in requests),
+            "completion_tokens": sum(record["completion_tokens"] for record in chat),
+            "wait_seconds": rounded(llm_wait, 3),
+        },
+        "cpu_seconds": rounded(cpu, 3),
+        "per_submission": {
+            "llm_wait_seconds": per_submission(llm_wait),
+            "cpu_seconds": per_submission(cpu),
+            "chat_requests": per_submission(len(chat)),
+        },
+        "max_rss_bytes": max_rss_bytes(),
+        "tracemalloc_peak_bytes": tracemalloc.get_traced_memory()[1] if trace_memory else None,
+    }
+    logging.warning(f"{name}: {processed} submissions in {wall:.1f}s, p95 {result['latency_seconds']['p95']}s, "
+                    f"LLM wait {llm_wait:.1f}s, CPU {cpu:.1f}s")
+    return result
+
+def queue_stage_runner(app, database, stage, process_submission):
+    """Workload draining the submissions waiting at a stage through run_stage_jobs"""
+    waiting_stage = STAGE_TRANSITIONS[stage][0]
+
+    async def run():
+        latencies, failures = [], 0
+
+        async def timed(submission_id):
+            nonlocal failures
+            start = time.perf_counter()
+            try:
+                await process_submission(submission_id)
+            except Exception as e:
+                failures += 1
+                logging.error(f"Stage {stage} failed for {submission_id}: {str(e)}")
+                # Park the submission so it is not claimed again
+                database.set_stage(submission_id, f"failed-stage-{stage}")
+            latencies.append(time.perf_counter() - start)
+
+        while database.waiting(waiting_stage):
+            await app.run_stage_jobs(stage, timed)
+        return latencies, failures
+    return run
+
+def trigger_stage_runner(handler, route, count, concurrency):
+    """Workload calling an HTTP trigger count times, at most concurrency at once"""
+    import azure.functions as func
+    handler = user_function(handler)
+
+    async def run():
+        latencies, failures = [], 0
+        semaphore = asyncio.Semaphore(concurrency)
+
+        async def call():
+            nonlocal failures
+            async with semaphore:
+                start = time.perf_counter()
+                try:
+                    response = await handler(func.HttpRequest(method="POST", url=f"/api/{route}", body=b""))
+                    if response.status_code != 200:
+                        failures += 1
+                except Exception as e:
+                    failures += 1
+                    logging.error(f"{route} failed: {str(e)}")
+                latencies.append(time.perf_counter() - start)
+
+        await asyncio.gather(*(call() for _ in range(count)))
+        return latencies, failures
+    return run
+
+async def warm_up(app, database, rows):
+    """Process one submission per stage outside the measurements (index builds, first reference data loads)"""
+    import azure.functions as func
+    warm_id = rows[-1]["id"]
+    database.set_stage(warm_id, "benchmark-warm-up")
+    timings = {}
+    steps = [
+        ("stage_1", lambda: app.triage_submission(warm_id)),
+        ("stage_2", lambda: app.check_duplicates(warm_id)),
+        ("stage_3", lambda: user_function(app.agentic_stage_3)(func.HttpRequest(method="POST", url="/api/agentic_stage_3", body=b""))),
+        ("stage_4", lambda: user_function(app.agentic_stage_4)(func.HttpRequest(method="POST", url="/api/agentic_stage_4", body=b""))),
+    ]
+    with open(os.devnull, "w") as devnull, contextlib.redirect_stdout(devnull):
+        for name, step in steps:
+            start = time.perf_counter()
+            await step()
+            timings[name] = round(time.perf_counter() - start, 3)
+    return timings
+
+def git_commit():
+    try:
+        return subprocess.run(["git", "rev-parse", "HEAD"], capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+def compare(results, baseline):
+    """Print throughput and p95 changes against a baseline results file"""
+    print(f"{'stage':<8} {'throughput/min':>24} {'p95 latency (s)':>24} {'CPU s/submission':>24}", file=sys.stderr)
+    for stage, current in results["stages"].items():
+        previous = baseline.get("stages", {}).get(stage)
+        if not previous:
+            continue
+        columns = []
+        for old, new in [
+            (previous["throughput_per_minute"], current["throughput_per_minute"]),
+            (previous["latency_seconds"]["p95"], current["latency_seconds"]["p95"]),
+            (previous["per_submission"]["cpu_seconds"], current["per_submission"]["cpu_seconds"]),
+        ]:
+            change = f"{100 * (new - old) / old:+.1f}%" if old and new is not None else "n/a"
+            columns.append(f"{old} -> {new} ({change})")
+        print(f"{stage:<8} " + " ".join(f"{column:>24}" for column in columns), file=sys.stderr)
+
+async def run_benchmark(args, app, database, rows, stats_queue):
+    warm_up_seconds = {} if args.no_warm_up else await warm_up(app, database, rows)
+    app.instrumentation.reset()
+    stages = {
+        "stage_1": queue_stage_runner(app, database, 1, app.triage_submission),
+        "stage_2": queue_stage_runner(app, database, 2, app.check_duplicates),
+        "stage_3": trigger_stage_runner(app.agentic_stage_3, "agentic_stage_3", args.submissions, args.concurrency),
+        "stage_4": trigger_stage_runner(app.agentic_stage_4, "agentic_stage_4", args.submissions, args.concurrency),
+    }
+    results = {}
+    for name, run in stages.items():
+        if args.stages and name not in args.stages:
+            continue
+        results[name] = await measure(name, run, stats_queue, args.tracemalloc)
+        results[name]["warm_up_seconds"] = warm_up_seconds.get(name)
+    if "stage_2" in results:
+        results["stage_2"]["duplicate_info_rows"] = len(database.duplicate_info)
+    return results
+
+def main():
+    parser = argparse.ArgumentParser(description="Offline throughput benchmark of the agentic stages")
+    parser.add_argument("--submissions", type=int, default=20, help="Submissions per stage")
+    parser.add_argument("--existing", type=int, default=2000, help="Already processed submissions in the table")
+    parser.add_argument("--duplicate-rate", type=float, default=0.3)
+    parser.add_argument("--concurrency", type=int, default=4, help="Submissions processed at once (STAGE_BATCH_SIZE)")
+    parser.add_argument("--stages", nargs="*", choices=["stage_1", "stage_2", "stage_3", "stage_4"])
+    parser.add_argument("--db-latency", type=float, default=0.002, help="Seconds per database statement")
+    parser.add_argument("--blob-latency", type=float, default=0.02, help="Seconds per template blob call")
+    parser.add_argument("--no-warm-up", action="store_true")
+    parser.add_argument("--tracemalloc", action="store_true", help="Also report the peak of Python allocations")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", help="Write the JSON results here instead of stdout")
+    parser.add_argument("--baseline", help="Results file of an earlier run to compare with")
+    parser.add_argument("--log-level", default="WARNING")
+    for key, value in DEFAULT_CONFIG.items():
+        parser.add_argument(f"--llm-{key.replace('_', '-')}", dest=f"llm_{key}",
+                            type=int if isinstance(value, bool) else type(value), default=value)
+    args = parser.parse_args()
+    logging.basicConfig(level=args.log_level, format="%(asctime)s - %(levelname)s - %(message)s")
+    if args.stages and "stage_2" in args.stages and "stage_1" not in args.stages:
+        parser.error("stage_2 consumes the submissions stage_1 triages; include stage_1")
+
+    llm_config = {key: getattr(args, f"llm_{key}") for key in DEFAULT_CONFIG}
+    llm_config["handoff"] = bool(llm_config["handoff"])
+    process, endpoint, stats_queue = start_fake_openai(llm_config)
+    try:
+        with tempfile.TemporaryDirectory(prefix="insureflow-benchmark-") as work_dir:
+            configure_environment(args, endpoint, work_dir)
+            rows = build_corpus(args.submissions + 1, args.existing, args.duplicate_rate, args.seed)
+            database = MemoryDatabase(rows, args.db_latency)
+            app = load_function_app(database, args.blob_latency)
+            if args.tracemalloc:
+                tracemalloc.start()
+            stage_results = asyncio.run(run_benchmark(args, app, database, rows, stats_queue))
+            span_stats = app.instrumentation.stats()
+    finally:
+        process.terminate()
+
+    results = {
+        "config": {key: value for key, value in vars(args).items() if key not in ("output", "baseline", "log_level")},
+        "environment": {
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "cpu_count": os.cpu_count(),
+            "git_commit": git_commit(),
+            "finished_at": datetime.datetime.now().isoformat(timespec="seconds"),
+        },
+        "stages": stage_results,
+        # Per-stage agent, handoff, LLM, tool and I/O percentiles from instrumentation.py
+        "spans": span_stats,
+    }
+    output = json.dumps(results, indent=2, sort_keys=True, default=str)
+    if args.output:
+        with open(args.output, "w") as file:
+            file.write(output + "\n")
+    else:
+        print(output)
+    if args.baseline:
+        with open(args.baseline, "r") as file:
+            compare(results, json.load(file))
+
+if __name__ == "__main__":
+    main()
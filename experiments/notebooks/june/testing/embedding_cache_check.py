@@ -0,0 +1,137 @@
+import asyncio
+import logging
+import os
+import sys
+import tempfile
+import threading
+import time
+from typing import List
+from pydantic import PrivateAttr
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+from llama_index.core import Document, VectorStoreIndex
+from llama_index.core.node_parser import SentenceSplitter
+from embedding_cache import CachedEmbedding, DeterministicEmbedding
+
+# Checks the content-addressed embedding cache offline.
+#
+# A synthetic guideline corpus is indexed twice through CachedEmbedding wrapped
+# around DeterministicEmbedding, in place of the Azure model. The first build
+# must embed every chunk in batches of at most EMBED_BATCH_SIZE texts with no
+# more than MAX_CONCURRENCY batches in flight; the second (same text, fresh
+# index) must be served entirely from the cache: 0 misses and no calls to the
+# wrapped model. The async path is checked the same way.
+#
+#   python testing/embedding_cache_check.py
+
+CHUNKS = int(os.getenv("CHUNKS", "120"))
+EMBED_BATCH_SIZE = int(os.getenv("EMBED_BATCH_SIZE", "8"))
+MAX_CONCURRENCY = int(os.getenv("MAX_CONCURRENCY", "3"))
+# Time each batch takes, so concurrent batches overlap
+BATCH_LATENCY = float(os.getenv("BATCH_LATENCY", "0.02"))
+
+class BatchRecorder:
+    """Sizes of the embedding batches sent to the model and the most run at once"""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        self.batches = []
+        self.in_flight = 0
+        self.max_in_flight = 0
+
+    def enter(self, texts):
+        with self.lock:
+            self.batches.append(len(texts))
+            self.in_flight += 1
+            self.max_in_flight = max(self.max_in_flight, self.in_flight)
+
+    def exit(self):
+        with self.lock:
+            self.in_flight -= 1
+
+class CountingEmbedding(DeterministicEmbedding):
+    """DeterministicEmbedding that reports its batches to a BatchRecorder"""
+
+    _recorder: BatchRecorder = PrivateAttr()
+
+    def __init__(self, recorder, **kwargs):
+        super().__init__(embed_batch_size=EMBED_BATCH_SIZE, **kwargs)
+        self._recorder = recorder
+
+    def _get_text_embeddings(self, texts: List[str]) -> List[List[float]]:
+        self._recorder.enter(texts)
+        try:
+            time.sleep(BATCH_LATENCY)
+            return [self._embed(text) for text in texts]
+        finally:
+            self._recorder.exit()
+
+    async def _aget_text_embeddings(self, texts: List[str]) -> List[List[float]]:
+        self._recorder.enter(texts)
+        try:
+            await asyncio.sleep(BATCH_LATENCY)
+            return [self._embed(text) for text in texts]
+        finally:
+            self._recorder.exit()
+
+def guideline_nodes():
+    """Chunks of a synthetic underwriting guideline, one per section"""
+    sections = [
+        f"Section {i}. Properties of construction class {i % 7} with occupancy group {i % 11} "
+        f"require sprinklers above {1000 + 250 * i} square metres. Deductibles start at "
+        f"{500 * (i % 9 + 1)} and business interruption cover is limited to {i % 5 + 1} years."
+        for i in range(CHUNKS)
+    ]
+    documents = [Document(text=section, metadata={"file_path": "guidelines.txt"}) for section in sections]
+    # One chunk per section
+    return SentenceSplitter(chunk_size=1024, chunk_overlap=0).get_nodes_from_documents(documents)
+
+def check(name, condition, detail):
+    print(f"{'ok  ' if condition else 'FAIL'} {name}: {detail}")
+    return condition
+
+def check_run(label, recorder, cached, run):
+    """Index the corpus twice with run(nodes); the second pass must be all cache hits"""
+    nodes = guideline_nodes()
+    results = []
+
+    recorder.reset()
+    start = cached.stats
+    run(nodes)
+    first = {key: cached.stats[key] - start[key] for key in start}
+    results.append(check(f"{label} first build", first["misses"] == len(nodes),
+                         f"{first['misses']} misses for {len(nodes)} chunks"))
+    results.append(check(f"{label} batch size", max(recorder.batches) <= EMBED_BATCH_SIZE,
+                         f"{len(recorder.batches)} batches, largest {max(recorder.batches)} (at most {EMBED_BATCH_SIZE})"))
+    results.append(check(f"{label} concurrency", recorder.max_in_flight <= MAX_CONCURRENCY,
+                         f"at most {recorder.max_in_flight} batches in flight (limit {MAX_CONCURRENCY})"))
+
+    recorder.reset()
+    start = cached.stats
+    run(guideline_nodes())
+    second = {key: cached.stats[key] - start[key] for key in start}
+    results.append(check(f"{label} rebuild", second["misses"] == 0 and not recorder.batches,
+                         f"{second['misses']} misses, {second['hits']} hits, {len(recorder.batches)} model calls"))
+    return all(results)
+
+def main():
+    with tempfile.TemporaryDirectory() as directory:
+        recorder = BatchRecorder()
+        cached = CachedEmbedding(CountingEmbedding(recorder), os.path.join(directory, "sync.sqlite"),
+                                 max_concurrency=MAX_CONCURRENCY)
+        sync_ok = check_run("sync", recorder, cached, lambda nodes: VectorStoreIndex(nodes, embed_model=cached))
+
+        recorder = BatchRecorder()
+        cached = CachedEmbedding(CountingEmbedding(recorder), os.path.join(directory, "async.sqlite"),
+                                 max_concurrency=MAX_CONCURRENCY)
+        async_ok = check_run("async", recorder, cached, lambda nodes: asyncio.run(
+            cached.aget_text_embedding_batch([node.get_content() for node in nodes])
+        ))
+    return sync_ok and async_ok
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.WARNING)
+    sys.exit(0 if main() else 1)
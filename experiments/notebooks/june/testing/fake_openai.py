@@ -0,0 +1,255 @@
+import ast
+import base64
+import hashlib
+import json
+import multiprocessing
+import random
+import re
+import threading
+import time
+from array import array
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+# Fake Azure OpenAI endpoint for the offline benchmarks.
+#
+# Serves chat completions (plain and streamed) and embeddings for any
+# deployment. A chat request with tools is answered by calling tools the
+# conversation has not called yet (tool_turns turns of up to
+# parallel_tool_calls calls each), then by handing off once to the first agent
+# the handoff tool offers, then with a text answer of completion_tokens words.
+# Time to first token is latency (+/- jitter) and streamed tokens arrive at
+# tokens_per_second. Each served request is reported on the stats queue so a
+# benchmark can separate LLM wait from its own CPU time.
+
+DEFAULT_CONFIG = {
+    "latency": 0.5,
+    "jitter": 0.2,
+    "tokens_per_second": 200.0,
+    "completion_tokens": 120,
+    "tool_turns": 4,
+    "parallel_tool_calls": 1,
+    "handoff": True,
+    "embedding_latency": 0.02,
+    "embedding_dim": 256,
+    "seed": 0,
+}
+
+WORDS = (
+    "the submission property insured broker coverage risk building sprinklers alarm occupancy "
+    "construction value deductible compliance guideline notes email review information"
+).split()
+
+WORD_RE = re.compile(r"\w+")
+
+def embed_text(text, dim):
+    """Hashed bag-of-words unit vector, so equal texts get equal vectors"""
+    vector = [0.0] * dim
+    for word in WORD_RE.findall(text.lower()):
+        digest = hashlib.blake2b(word.encode("utf-8"), digest_size=8).digest()
+        vector[int.from_bytes(digest[:4], "little") % dim] += 1.0 if digest[4] & 1 else -1.0
+    norm = sum(value * value for value in vector) ** 0.5
+    return [value / norm for value in vector] if norm else vector
+
+def argument_value(schema):
+    kind = schema.get("type")
+    if kind == "integer":
+        return 1
+    if kind == "number":
+        return 1.0
+    if kind == "boolean":
+        return True
+    if kind == "array":
+        return []
+    if kind == "object":
+        return {}
+    return "Benchmark value"
+
+def tool_arguments(tool):
+    """Arguments for the required parameters of a tool"""
+    parameters = tool["function"].get("parameters") or {}
+    properties = parameters.get("properties") or {}
+    return {name: argument_value(properties.get(name, {})) for name in parameters.get("required", [])}
+
+def handoff_target(tool):
+    """First agent listed in the handoff tool description"""
+    description = tool["function"].get("description", "")
+    listing = description.split("Currently available agents:", 1)[-1].strip()
+    try:
+        agents = ast.literal_eval(listing)
+        if isinstance(agents, dict) and agents:
+            return next(iter(agents))
+    except (ValueError, SyntaxError):
+        pass
+    match = re.search(r"['\"]?([A-Za-z][\w ]*?)['\"]?\s*:", listing)
+    return match.group(1) if match else None
+
+def plan_reply(body, config):
+    """("tool_calls", [(name, arguments)]) or ("text", None) for a chat request"""
+    tools = body.get("tools") or []
+    messages = body.get("messages") or []
+    called, turns = set(), 0
+    for message in messages:
+        calls = message.get("tool_calls") or [] if message.get("role") == "assistant" else []
+        names = {call["function"]["name"] for call in calls}
+        called |= names
+        if names - {"handoff"}:
+            turns += 1
+    uncalled = [tool for tool in tools if tool["function"]["name"] not in called | {"handoff"}]
+    if uncalled and turns < config["tool_turns"]:
+        return "tool_calls", [
+            (tool["function"]["name"], tool_arguments(tool)) for tool in uncalled[:config["parallel_tool_calls"]]
+        ]
+    handoff = next((tool for tool in tools if tool["function"]["name"] == "handoff"), None)
+    if config["handoff"] and handoff is not None and "handoff" not in called:
+        target = handoff_target(handoff)
+        if target:
+            return "tool_calls", [("handoff", {"to_agent": target, "reason": "Benchmark handoff"})]
+    return "text", None
+
+class FakeOpenAIHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def do_POST(self):
+        start = time.perf_counter()
+        body = json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))) or b"{}")
+        match = re.search(r"/deployments/([^/]+)/", self.path)
+        deployment = match.group(1) if match else ""
+        with self.server.lock:
+            self.server.requests += 1
+            rng = random.Random(self.server.config["seed"] * 1000003 + self.server.requests)
+        if self.path.split("?")[0].endswith("/embeddings"):
+            stats = self.embeddings(body)
+        else:
+            stats = self.chat(body, rng)
+        stats.update({"deployment": deployment, "seconds": time.perf_counter() - start})
+        if self.server.stats_queue is not None:
+            self.server.stats_queue.put(stats)
+
+    def embeddings(self, body):
+        config = self.server.config
+        texts = body.get("input") or []
+        texts = texts if isinstance(texts, list) else [texts]
+        time.sleep(config["embedding_latency"])
+        data = []
+        for i, text in enumerate(texts):
+            vector = embed_text(str(text), config["embedding_dim"])
+            if body.get("encoding_format") == "base64":
+                vector = base64.b64encode(array("f", vector).tobytes()).decode("ascii")
+            data.append({"object": "embedding", "index": i, "embedding": vector})
+        tokens = sum(len(str(text)) for text in texts) // 4
+        self.reply_json({
+            "object": "list", "data": data, "model": body.get("model", "fake-embedding"),
+            "usage": {"prompt_tokens": tokens, "total_tokens": tokens},
+        })
+        return {"kind": "embedding", "prompt_tokens": tokens, "completion_tokens": 0, "tool_calls": 0}
+
+    def chat(self, body, rng):
+        config = self.server.config
+        kind, calls = plan_reply(body, config)
+        if kind == "tool_calls":
+            tool_calls = [
+                {"index": i, "id": f"call_{rng.getrandbits(48):012x}", "type": "function",
+                 "function": {"name": name, "arguments": json.dumps(arguments)}}
+                for i, (name, arguments) in enumerate(calls)
+            ]
+            tokens = [json.dumps(tool_calls)]
+            completion_tokens = sum(len(call["function"]["arguments"]) // 4 + 5 for call in tool_calls)
+        else:
+            tool_calls = []
+            tokens = [f"{rng.choice(WORDS)} " for _ in range(config["completion_tokens"])]
+            completion_tokens = len(tokens)
+        prompt_tokens = len(json.dumps(body.get("messages") or [])) // 4
+        usage = {"prompt_tokens": prompt_tokens, "completion_tokens": completion_tokens,
+                 "total_tokens": prompt_tokens + completion_tokens}
+
+        time.sleep(max(0.0, config["latency"] + rng.uniform(-config["jitter"], config["jitter"])))
+        if body.get("stream"):
+            self.stream_chat(body, tokens, tool_calls, usage, completion_tokens)
+        else:
+            time.sleep(completion_tokens / config["tokens_per_second"])
+            message = {"role": "assistant", "content": None if tool_calls else "".join(tokens)}
+            if tool_calls:
+                message["tool_calls"] = [{key: call[key] for key in ("id", "type", "function")} for call in tool_calls]
+            self.reply_json({
+                "id": "chatcmpl-fake", "object": "chat.completion", "created": int(time.time()),
+                "model": body.get("model", "fake-gpt"), "usage": usage,
+                "choices": [{"index": 0, "message": message,
+                             "finish_reason": "tool_calls" if tool_calls else "stop"}],
+            })
+        return {"kind": "chat", "prompt_tokens": prompt_tokens, "completion_tokens": completion_tokens,
+                "tool_calls": len(tool_calls)}
+
+    def stream_chat(self, body, tokens, tool_calls, usage, completion_tokens):
+        self.send_response(200)
+        self.send_header("Content-Type", "text/event-stream")
+        self.send_header("Transfer-Encoding", "chunked")
+        self.end_headers()
+        base = {"id": "chatcmpl-fake", "object": "chat.completion.chunk", "created": int(time.time()),
+                "model": body.get("model", "fake-gpt")}
+        self.send_event({**base, "choices": [{"index": 0, "delta": {"role": "assistant", "content": ""}}]})
+        if tool_calls:
+            time.sleep(completion_tokens / self.server.config["tokens_per_second"])
+            self.send_event({**base, "choices": [{"index": 0, "delta": {"tool_calls": tool_calls}}]})
+        else:
+            interval = 1.0 / self.server.config["tokens_per_second"]
+            for token in tokens:
+                time.sleep(interval)
+                self.send_event({**base, "choices": [{"index": 0, "delta": {"content": token}}]})
+        self.send_event({**base, "choices": [{"index": 0, "delta": {},
+                                              "finish_reason": "tool_calls" if tool_calls else "stop"}]})
+        if (body.get("stream_options") or {}).get("include_usage"):
+            self.send_event({**base, "choices": [], "usage": usage})
+        self.send_chunk(b"data: [DONE]\n\n")
+        self.send_chunk(b"")
+
+    def send_event(self, event):
+        self.send_chunk(f"data: {json.dumps(event)}\n\n".encode("utf-8"))
+
+    def send_chunk(self, data):
+        self.wfile.write(b"%x\r\n%s\r\n" % (len(data), data))
+        self.wfile.flush()
+
+    def reply_json(self, body):
+        content = json.dumps(body).encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(content)))
+        self.end_headers()
+        self.wfile.write(content)
+
+    def log_message(self, format, *args):
+        pass
+
+def serve(config, port_queue, stats_queue=None, port=0):
+    """Run the fake endpoint until the process is terminated; the bound port is put on port_queue"""
+    server = ThreadingHTTPServer(("127.0.0.1", port), FakeOpenAIHandler)
+    server.daemon_threads = True
+    server.config = {**DEFAULT_CONFIG, **config}
+    server.stats_queue = stats_queue
+    server.lock = threading.Lock()
+    server.requests = 0
+    port_queue.put(server.server_address[1])
+    server.serve_forever()
+
+def start_fake_openai(config=None):
+    """Start the fake endpoint in a child process (so its CPU time is not the benchmark's); return (process, endpoint, stats queue)"""
+    context = multiprocessing.get_context("spawn")
+    port_queue, stats_queue = context.Queue(), context.Queue()
+    process = context.Process(target=serve, args=(config or {}, port_queue, stats_queue), daemon=True)
+    process.start()
+    port = port_queue.get(timeout=30)
+    return process, f"http://127.0.0.1:{port}", stats_queue
+
+if __name__ == "__main__":
+    import argparse
+    import queue
+
+    parser = argparse.ArgumentParser(description="Run the fake Azure OpenAI endpoint in the foreground")
+    parser.add_argument("--port", type=int, default=8011)
+    for key, value in DEFAULT_CONFIG.items():
+        parser.add_argument(f"--{key.replace('_', '-')}", type=type(value) if not isinstance(value, bool) else int,
+                            default=value)
+    args = vars(parser.parse_args())
+    port = args.pop("port")
+    print(f"Fake Azure OpenAI endpoint on http://127.0.0.1:{port}")
+    serve(args, queue.Queue(), port=port)
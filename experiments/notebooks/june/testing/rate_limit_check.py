@@ -0,0 +1,129 @@
+import asyncio
+import json
+import logging
+import os
+import sys
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+from rate_limiter import RateLimitRegistry, rate_limited_clients
+
+# Drives the rate limiter against a fake local Azure OpenAI endpoint.
+#
+# The fake endpoint answers chat completions after FAKE_LATENCY seconds and
+# returns 429 (with Retry-After) whenever more than FAKE_CAPACITY requests are
+# in flight, plus every Nth request if THROTTLE_EVERY is set. Every caller
+# should succeed: 429s are absorbed by the limiter's queue. The limiter starts
+# at four times the capacity and must back off quickly: the check fails if more
+# than MAX_THROTTLED_RATIO of the requests the endpoint saw were throttled.
+#
+#   python testing/rate_limit_check.py
+
+FAKE_CAPACITY = int(os.getenv("FAKE_CAPACITY", "4"))
+FAKE_LATENCY = float(os.getenv("FAKE_LATENCY", "0.2"))
+THROTTLE_EVERY = int(os.getenv("THROTTLE_EVERY", "0"))
+CALLERS = int(os.getenv("CALLERS", "60"))
+MAX_THROTTLED_RATIO = float(os.getenv("MAX_THROTTLED_RATIO", "0.3"))
+DEPLOYMENT = "gpt-fake"
+
+server_state = {"in_flight": 0, "requests": 0, "throttled": 0, "max_in_flight": 0}
+server_lock = threading.Lock()
+
+class FakeAzureOpenAI(BaseHTTPRequestHandler):
+    def do_POST(self):
+        self.rfile.read(int(self.headers.get("Content-Length", 0)))
+        with server_lock:
+            server_state["requests"] += 1
+            server_state["in_flight"] += 1
+            server_state["max_in_flight"] = max(server_state["max_in_flight"], server_state["in_flight"])
+            throttle = server_state["in_flight"] > FAKE_CAPACITY or (
+                THROTTLE_EVERY and server_state["requests"] % THROTTLE_EVERY == 0
+            )
+        try:
+            if throttle:
+                with server_lock:
+                    server_state["throttled"] += 1
+                self.reply(429, {"error": {"code": "429", "message": "Rate limit exceeded"}},
+                           {"retry-after-ms": "200"})
+                return
+            time.sleep(FAKE_LATENCY)
+            self.reply(200, {
+                "id": "chatcmpl-fake",
+                "object": "chat.completion",
+                "choices": [{"index": 0, "finish_reason": "stop",
+                             "message": {"role": "assistant", "content": "ok"}}],
+                "usage": {"prompt_tokens": 10, "completion_tokens": 1, "total_tokens": 11},
+            })
+        finally:
+            with server_lock:
+                server_state["in_flight"] -= 1
+
+    def reply(self, status, body, headers=None):
+        content = json.dumps(body).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(content)))
+        for key, value in (headers or {}).items():
+            self.send_header(key, value)
+        self.end_headers()
+        self.wfile.write(content)
+
+    def log_message(self, format, *args):
+        pass
+
+def percentile(values, q):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(q * len(values)))] if values else 0.0
+
+async def main():
+    server = ThreadingHTTPServer(("127.0.0.1", 0), FakeAzureOpenAI)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    url = (f"http://127.0.0.1:{server.server_address[1]}/openai/deployments/{DEPLOYMENT}"
+           f"/chat/completions?api-version=2024-06-01")
+
+    # Start above the endpoint's capacity so the limiter has to back off
+    registry = RateLimitRegistry()
+    registry.configure(DEPLOYMENT, requests_per_minute=600, tokens_per_minute=600000,
+                       max_concurrency=FAKE_CAPACITY * 4, latency_target=FAKE_LATENCY * 5)
+    http_client, async_http_client = rate_limited_clients(registry)
+
+    latencies = []
+    failures = 0
+
+    async def call(i):
+        nonlocal failures
+        start = time.perf_counter()
+        response = await async_http_client.post(
+            url, json={"messages": [{"role": "user", "content": f"request {i}"}], "max_tokens": 16}
+        )
+        latencies.append(time.perf_counter() - start)
+        if response.status_code != 200:
+            failures += 1
+
+    start = time.perf_counter()
+    await asyncio.gather(*(call(i) for i in range(CALLERS)))
+    # The sync client shares the same limiter
+    response = http_client.post(url, json={"messages": [{"role": "user", "content": "sync"}]})
+    if response.status_code != 200:
+        failures += 1
+    elapsed = time.perf_counter() - start
+
+    await async_http_client.aclose()
+    http_client.close()
+    server.shutdown()
+
+    stats = registry.stats[DEPLOYMENT]
+    throttled_ratio = server_state["throttled"] / max(1, server_state["requests"])
+    print(f"Callers: {CALLERS + 1}, failed: {failures} (expected 0), elapsed {elapsed:.2f}s")
+    print(f"Endpoint: {server_state['requests']} requests, {server_state['throttled']} throttled "
+          f"({throttled_ratio:.0%}, at most {MAX_THROTTLED_RATIO:.0%}), "
+          f"max in flight {server_state['max_in_flight']} (capacity {FAKE_CAPACITY})")
+    print(f"Limiter: {stats}")
+    print(f"Caller latency p50 {percentile(latencies, 0.5):.2f}s, p95 {percentile(latencies, 0.95):.2f}s")
+    return failures == 0 and throttled_ratio <= MAX_THROTTLED_RATIO
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.WARNING)
+    sys.exit(0 if asyncio.run(main()) else 1)
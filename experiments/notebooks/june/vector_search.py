@@ -0,0 +1,265 @@
+import asyncio
+import json
+import logging
+import os
+import re
+import threading
+from collections import OrderedDict
+import numpy as np
+
+try:
+    import hnswlib
+except ImportError:  # Optional: only needed for approximate search on large corpora
+    hnswlib = None
+
+# In-process retrieval over the guideline chunks.
+#
+# DenseVectorIndex keeps the chunk embeddings as one normalised float32 matrix
+# saved next to the LlamaIndex storage and memory-mapped on load, so a cold
+# start reads no JSON vector store. Top-k is an exact dot product plus
+# argpartition; when hnswlib is installed and the corpus is large an HNSW graph
+# is built alongside it and used instead.
+
+VECTORS_FILE = "vectors.npy"
+CHUNKS_FILE = "chunks.json"
+HNSW_FILE = "hnsw.bin"
+
+# Corpus size from which an HNSW graph is built (when hnswlib is available)
+HNSW_MIN_CHUNKS = int(os.getenv("ANN_HNSW_MIN_CHUNKS", "20000"))
+HNSW_EF_SEARCH = int(os.getenv("ANN_HNSW_EF_SEARCH", "64"))
+
+def normalize(vectors):
+    """Scale vectors (rows of a matrix, or a single vector) to unit length"""
+    norms = np.linalg.norm(vectors, axis=-1, keepdims=True)
+    norms[norms == 0] = 1.0
+    return vectors / norms
+
+def write_atomic(path, write):
+    """Write a file through a temporary path so readers never see it half written"""
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    write(tmp_path)
+    os.replace(tmp_path, path)
+
+class DenseVectorIndex:
+    """Normalised embedding matrix with exact top-k search and an optional HNSW graph"""
+
+    def __init__(self, vectors, texts, hnsw=None):
+        self.vectors = vectors
+        self.texts = texts
+        self.hnsw = hnsw
+
+    def __len__(self):
+        return len(self.texts)
+
+    @classmethod
+    def from_index(cls, index):
+        """Build from a VectorStoreIndex backed by the default SimpleVectorStore"""
+        embedding_dict = index.vector_store.data.embedding_dict
+        node_ids = list(embedding_dict)
+        nodes = index.docstore.get_nodes(node_ids)
+        if not node_ids:
+            return cls(np.zeros((0, 0), dtype=np.float32), [])
+        vectors = normalize(np.asarray([embedding_dict[node_id] for node_id in node_ids], dtype=np.float32))
+        return cls(vectors, [node.text for node in nodes])
+
+    @staticmethod
+    def exists(directory):
+        # The chunk texts are written last, so their presence means a complete save
+        return os.path.exists(os.path.join(directory, CHUNKS_FILE))
+
+    def save(self, directory):
+        """Write the matrix, the optional HNSW graph and finally the chunk texts"""
+        def write_vectors(path):
+            with open(path, "wb") as file:
+                np.save(file, self.vectors)
+        write_atomic(os.path.join(directory, VECTORS_FILE), write_vectors)
+
+        if hnswlib is not None and len(self) >= HNSW_MIN_CHUNKS:
+            logging.info(f"Building HNSW graph over {len(self)} chunks")
+            graph = hnswlib.Index(space="ip", dim=self.vectors.shape[1])
+            graph.init_index(max_elements=len(self), ef_construction=200, M=16)
+            graph.add_items(self.vectors, np.arange(len(self)))
+            write_atomic(os.path.join(directory, HNSW_FILE), graph.save_index)
+
+        def write_chunks(path):
+            with open(path, "w") as file:
+                json.dump(self.texts, file)
+        write_atomic(os.path.join(directory, CHUNKS_FILE), write_chunks)
+
+    @classmethod
+    def load(cls, directory):
+        """Memory-map a saved index (and load its HNSW graph if there is one)"""
+        vectors = np.load(os.path.join(directory, VECTORS_FILE), mmap_mode="r")
+        with open(os.path.join(directory, CHUNKS_FILE), "r") as file:
+            texts = json.load(file)
+        hnsw = None
+        hnsw_path = os.path.join(directory, HNSW_FILE)
+        if hnswlib is not None and os.path.exists(hnsw_path):
+            hnsw = hnswlib.Index(space="ip", dim=vectors.shape[1])
+            hnsw.load_index(hnsw_path, max_elements=len(texts))
+            hnsw.set_ef(HNSW_EF_SEARCH)
+        logging.info(f"Loaded {len(texts)} guideline chunks from {directory}"
+                     + (" with HNSW graph" if hnsw is not None else ""))
+        return cls(vectors, texts, hnsw)
+
+    def search(self, query_vector, top_k):
+        """Return the top_k (text, score) pairs by cosine similarity, best first"""
+        top_k = min(top_k, len(self))
+        if top_k == 0:
+            return []
+        query = normalize(np.asarray(query_vector, dtype=np.float32))
+        if self.hnsw is not None:
+            labels, distances = self.hnsw.knn_query(query, k=top_k)
+            ids, scores = labels[0], 1.0 - distances[0]
+        else:
+            all_scores = self.vectors @ query
+            ids = np.argpartition(-all_scores, top_k - 1)[:top_k]
+            ids = ids[np.argsort(-all_scores[ids])]
+            scores = all_scores[ids]
+        return [(self.texts[i], float(score)) for i, score in zip(ids, scores)]
+
+# Retrieval backends used by search_documents. Both expose
+# "async aretrieve(query) -> list of chunk texts" and never block the event loop.
+
+class DenseRetriever:
+    """Retrieval backend over a DenseVectorIndex"""
+
+    def __init__(self, dense_index, embed_model, top_k=5):
+        self.dense_index = dense_index
+        self.embed_model = embed_model
+        self.top_k = top_k
+
+    async def aretrieve(self, query):
+        query_vector = await self.embed_model.aget_query_embedding(query)
+        return await self.aretrieve_by_vector(query_vector)
+
+    async def aretrieve_by_vector(self, query_vector):
+        results = await asyncio.to_thread(self.dense_index.search, query_vector, self.top_k)
+        return [text for text, _ in results]
+
+class LlamaIndexRetriever:
+    """Retrieval backend over a LlamaIndex retriever (the default in-memory vector store)"""
+
+    def __init__(self, retriever):
+        self.retriever = retriever
+
+    async def aretrieve(self, query):
+        nodes = await self.retriever.aretrieve(query)
+        return [node.text for node in nodes]
+
+# Query-result cache in front of a retrieval backend. Research agents ask the
+# same guideline questions for every submission, so results are reused:
+#   - exact tier: LRU from normalised query text to the retrieved chunks
+#   - semantic tier: the results of a previous query whose embedding is within
+#     SEARCH_CACHE_SIMILARITY (cosine) of the new one; only available when the
+#     backend can retrieve by vector, so the query is embedded once per miss
+# Chunk texts are stored by reference, so a cached result costs a list of
+# pointers. The cache is cleared whenever the backend is swapped for a rebuilt
+# index version.
+
+SEARCH_CACHE_SIZE = int(os.getenv("SEARCH_CACHE_SIZE", "1024"))
+SEARCH_CACHE_SEMANTIC_SIZE = int(os.getenv("SEARCH_CACHE_SEMANTIC_SIZE", "512"))
+SEARCH_CACHE_SIMILARITY = float(os.getenv("SEARCH_CACHE_SIMILARITY", "0.95"))
+
+QUERY_WORD_RE = re.compile(r"\w+")
+
+def normalize_query(query):
+    """Lowercase a query and reduce it to its words, so case, spacing and punctuation don't matter"""
+    return " ".join(QUERY_WORD_RE.findall(query.lower()))
+
+class CachedRetriever:
+    """Retrieval backend wrapper with an exact LRU tier and a semantic similarity tier"""
+
+    def __init__(self, backend, version=None, max_entries=SEARCH_CACHE_SIZE,
+                 semantic_entries=SEARCH_CACHE_SEMANTIC_SIZE, similarity=SEARCH_CACHE_SIMILARITY):
+        self.max_entries = max_entries
+        self.semantic_entries = semantic_entries
+        self.similarity = similarity
+        self._lock = threading.Lock()
+        self._counts = {"exact_hits": 0, "semantic_hits": 0, "misses": 0, "invalidations": 0}
+        self.reset(backend, version)
+
+    def reset(self, backend, version=None):
+        """Switch to a new backend (e.g. a rebuilt index version), dropping every cached result"""
+        with self._lock:
+            if getattr(self, "backend", None) is not None:
+                self._counts["invalidations"] += 1
+                logging.info(f"Guideline search cache invalidated for index version {version}")
+            self.backend = backend
+            self.version = version
+            self._exact = OrderedDict()
+            self._vectors = None
+            self._semantic_results = []
+            self._next_slot = 0
+
+    @property
+    def stats(self):
+        """Hit/miss counters, hit rate and current cache sizes"""
+        with self._lock:
+            stats = dict(self._counts)
+            lookups = stats["exact_hits"] + stats["semantic_hits"] + stats["misses"]
+            stats["hit_rate"] = (stats["exact_hits"] + stats["semantic_hits"]) / lookups if lookups else 0.0
+            stats["exact_entries"] = len(self._exact)
+            stats["semantic_entries"] = len(self._semantic_results)
+            return stats
+
+    async def aretrieve(self, query):
+        key = normalize_query(query)
+        with self._lock:
+            backend = self.backend
+            results = self._exact.get(key)
+            if results is not None:
+                self._exact.move_to_end(key)
+                self._counts["exact_hits"] += 1
+                return list(results)
+
+        if not hasattr(backend, "aretrieve_by_vector"):
+            results = await backend.aretrieve(query)
+            self._remember(backend, key, results)
+            return list(results)
+
+        query_vector = normalize(np.asarray(await backend.embed_model.aget_query_embedding(query), dtype=np.float32))
+        with self._lock:
+            results = self._semantic_lookup(backend, query_vector)
+            if results is not None:
+                self._counts["semantic_hits"] += 1
+                self._exact[key] = results
+                self._trim_exact()
+                return list(results)
+
+        results = await backend.aretrieve_by_vector(query_vector)
+        self._remember(backend, key, results, query_vector)
+        return list(results)
+
+    def _semantic_lookup(self, backend, query_vector):
+        if backend is not self.backend or not self._semantic_results:
+            return None
+        filled = len(self._semantic_results)
+        scores = self._vectors[:filled] @ query_vector
+        best = int(np.argmax(scores))
+        return self._semantic_results[best] if scores[best] >= self.similarity else None
+
+    def _remember(self, backend, key, results, query_vector=None):
+        with self._lock:
+            self._counts["misses"] += 1
+            # Results from a backend that was swapped out meanwhile are not cached
+            if backend is not self.backend:
+                return
+            self._exact[key] = results
+            self._trim_exact()
+            if query_vector is None or self.semantic_entries == 0:
+                return
+            if self._vectors is None:
+                self._vectors = np.zeros((self.semantic_entries, len(query_vector)), dtype=np.float32)
+            # Ring buffer: once full, the oldest semantic entry is overwritten
+            slot = self._next_slot
+            self._vectors[slot] = query_vector
+            if slot < len(self._semantic_results):
+                self._semantic_results[slot] = results
+            else:
+                self._semantic_results.append(results)
+            self._next_slot = (slot + 1) % self.semantic_entries
+
+    def _trim_exact(self):
+        while len(self._exact) > self.max_entries:
+            self._exact.popitem(last=False)
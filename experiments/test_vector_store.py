@@ -1,4 +1,5 @@
 import os
+import sys
 import logging
 from llama_index.core import VectorStoreIndex, StorageContext
 from llama_index.core.settings import Settings
@@ -7,6 +8,9 @@ from llama_index.core.node_parser import SentenceSplitter
 from llama_index.llms.azure_openai import AzureOpenAI
 from llama_index.embeddings.azure_openai import AzureOpenAIEmbedding
 
+sys.path.insert(0, "experiments/notebooks/june")
+from embedding_cache import CachedEmbedding
+
 # Configure logging
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
 logger = logging.getLogger(__name__)
@@ -31,12 +35,16 @@ def test_vector_store():
             temperature=0.1
         )
         
-        embed_model = AzureOpenAIEmbedding(
-            model="text-embedding-ada-002",
-            deployment_name="text-embedding-ada-002",
-            api_key=os.getenv('AZURE_OPENAI_API_KEY'),
-            azure_endpoint=os.getenv('AZURE_OPENAI_ENDPOINT'),
-            api_version=os.getenv('AZURE_EMBEDDING_API_VERSION', '2023-12-01-preview')
+        # Unchanged chunks are served from the local embedding cache
+        embed_model = CachedEmbedding(
+            AzureOpenAIEmbedding(
+                model="text-embedding-ada-002",
+                deployment_name="text-embedding-ada-002",
+                api_key=os.getenv('AZURE_OPENAI_API_KEY'),
+                azure_endpoint=os.getenv('AZURE_OPENAI_ENDPOINT'),
+                api_version=os.getenv('AZURE_EMBEDDING_API_VERSION', '2023-12-01-preview')
+            ),
+            cache_path="experiments/storage/embedding_cache.sqlite"
         )
         
         # Configure settings
@@ -58,7 +66,7 @@ def test_vector_store():
         # Create and persist index
         logger.info("Creating vector store index...")
         index = VectorStoreIndex.from_documents(documents)
-        logger.info("Successfully created index")
+        logger.info(f"Successfully created index (embedding cache: {embed_model.stats})")
         
         # Persist index
         logger.info(f"Persisting index to {persist_dir}")
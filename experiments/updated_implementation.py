@@ -2,15 +2,15 @@
 Updated implementation of the InsuranceAgentSystem class using the new Settings API
 """
 
-import os
+import sys
 import logging
-from llama_index.core import VectorStoreIndex, StorageContext
 from llama_index.core.settings import Settings
-from llama_index.readers.file import PDFReader
-from llama_index.core.node_parser import SentenceSplitter
 from azure.ai.openai import AzureOpenAI
 from azure.ai.openai.embedding import AzureOpenAIEmbedding
 
+sys.path.insert(0, "experiments/notebooks/june")
+from guideline_index import GuidelineIndexManager
+
 def setup_llm_and_embeddings(self):
     """Configure the LLM and embedding models"""
     self.llm = AzureOpenAI(
@@ -38,42 +38,15 @@ def setup_llm_and_embeddings(self):
     logger.info("LLM and embedding models initialized")
 
 def setup_guidelines_vector_store(self):
-    """Initialize the guidelines vector store from the PDF"""
+    """Initialize the guidelines vector store, embedding only new or changed guideline chunks"""
     try:
-        # Define paths
-        pdf_path = "experiments/data/UW Commercial Insurance Manual.pdf"
-        persist_dir = "experiments/storage/guidelines_index"
+        # Define paths (shared with the June function app)
+        data_dir = "experiments/data/stage4"
+        persist_dir = "experiments/storage/stage4_index"
         
-        # Check if index already exists
-        if os.path.exists(persist_dir) and os.listdir(persist_dir):
-            logger.info(f"Loading existing index from {persist_dir}")
-            storage_context = StorageContext.from_defaults(persist_dir=persist_dir)
-            self.guidelines_index = VectorStoreIndex.from_storage_context(storage_context)
-        else:
-            # Load and process PDF if needed
-            logger.info(f"Loading PDF document from {pdf_path}")
-            pdf_reader = PDFReader()
-            documents = pdf_reader.load_data(pdf_path)
-            logger.info(f"Loaded {len(documents)} documents from PDF")
-            
-            # Configure settings with node parser
-            Settings.node_parser = SentenceSplitter(
-                chunk_size=1024,
-                chunk_overlap=200,
-                separator=" ",
-                paragraph_separator="\n\n",
-            )
-            
-            # Create index
-            logger.info("Creating vector store index...")
-            self.guidelines_index = VectorStoreIndex.from_documents(documents)
-            logger.info("Successfully created index")
-            
-            # Persist the index
-            os.makedirs(persist_dir, exist_ok=True)
-            logger.info(f"Persisting index to {persist_dir}")
-            self.guidelines_index.storage_context.persist(persist_dir=persist_dir)
-            logger.info("Successfully persisted index")
+        # Load the persisted index and bring it up to date with the guideline documents
+        manager = GuidelineIndexManager(data_dir, persist_dir, chunk_size=1024, chunk_overlap=200)
+        self.guidelines_index = manager.load()
         
         # Create retriever
         self.guidelines_retriever = self.guidelines_index.as_retriever(similarity_top_k=3)